@@ -0,0 +1,117 @@
+#!/usr/bin/env python3
+
+import asyncio
+
+
+class AuditsAdapter:
+    """
+    What the HTTP endpoints ask of the bot. Every request names the audit it
+    is about, subclasses decide where the Audits method actually runs.
+    """
+
+    async def call(self, audit_name: str, method: str, *args):
+        raise NotImplementedError
+
+    async def broadcast(self, method: str, *args):
+        # Run a method against every Audits instance, returns the results
+        raise NotImplementedError
+
+    async def scatter(self, audit_names, method: str, rows: list):
+        # Run method with the rows belonging to each audit's owner, rows[n]
+        # being about audit_names[n]. Results come back in the order of rows.
+        if not rows:
+            return []
+        return await self.call(audit_names[0], method, rows)
+
+    async def register_audit(self, fields: dict):
+        return await self.call(fields["name"], "create_audit", fields)
+
+    async def register_audits(self, batch: list):
+        names = [str(fields.get("name")) for fields in batch]
+        return await self.scatter(names, "register_audits", batch)
+
+    async def get_audit_outcome(self, audit_name: str):
+        return await self.call(audit_name, "get_audit_outcome", audit_name)
+
+    async def has_audit(self, audit_name: str):
+        return await self.call(audit_name, "has_audit", audit_name)
+
+    async def get_settlement(self, audit_name: str):
+        return await self.call(audit_name, "get_settlement", audit_name)
+
+    async def acknowledge_settlement(self, audit_name: str, settlement_hash=None):
+        return await self.call(
+            audit_name, "acknowledge_settlement", audit_name, settlement_hash
+        )
+
+    async def clear_audits(self):
+        await self.broadcast("clear_audits")
+
+    def on_settled(self, callback):
+        # callback(audit_name, settlement) when an audit's compensation is
+        # calculated, called on the bot's thread
+        raise NotImplementedError
+
+    async def start_profile(self, mode: str, seconds: float):
+        return await self.broadcast("start_profile", mode, seconds)
+
+    async def stop_profile(self):
+        return await self.broadcast("stop_profile")
+
+    async def collect_metrics(self):
+        # Metric families of every bot, see metrics.py
+        families = []
+        for bot_families in await self.broadcast("collect_metrics"):
+            families.extend(bot_families)
+        return families
+
+
+class LocalAdapter(AuditsAdapter):
+    """Calls straight into a bot running on the same event loop"""
+
+    def __init__(self, bot):
+        self.bot = bot
+
+    async def call(self, audit_name: str, method: str, *args):
+        return self.bot.profiled(method, *args)
+
+    async def broadcast(self, method: str, *args):
+        return [self.bot.profiled(method, *args)]
+
+    def on_settled(self, callback):
+        self.bot.settlement_callbacks.append(callback)
+
+
+class ThreadedAdapter(AuditsAdapter):
+    """
+    Used when the HTTP server and the bot run on separate event loops in
+    separate threads. Calls are handed to the inner adapter on the bot's loop
+    and awaited from the HTTP loop, so audit state is only touched from the
+    bot's thread.
+    """
+
+    def __init__(self, inner: AuditsAdapter, loop):
+        self.inner = inner
+        self.loop = loop
+
+    async def _on_bot_loop(self, coroutine):
+        future = asyncio.run_coroutine_threadsafe(coroutine, self.loop)
+        return await asyncio.wrap_future(future)
+
+    async def call(self, audit_name: str, method: str, *args):
+        return await self._on_bot_loop(self.inner.call(audit_name, method, *args))
+
+    async def broadcast(self, method: str, *args):
+        return await self._on_bot_loop(self.inner.broadcast(method, *args))
+
+    async def scatter(self, audit_names, method: str, rows: list):
+        return await self._on_bot_loop(self.inner.scatter(audit_names, method, rows))
+
+    async def clear_audits(self):
+        await self._on_bot_loop(self.inner.clear_audits())
+
+    async def collect_metrics(self):
+        return await self._on_bot_loop(self.inner.collect_metrics())
+
+    def on_settled(self, callback):
+        self.inner.on_settled(callback)
@@ -1,10 +1,20 @@
 #!/usr/bin/env python3
 
+import logging
+import time
+from bisect import bisect_left, insort
+from collections import deque
 from random import random, choice
 from typing import List, Optional, Dict
+import numpy as np
 from pydantic import BaseModel, Field
 from enum import Enum
 from fastapi import FastAPI, Body
+from eth_abi import encode_abi
+from eth_abi.exceptions import EncodingError
+from eth_utils import is_address, keccak
+
+from logs import log_event
 
 
 class State(Enum):
@@ -20,6 +30,13 @@ class State(Enum):
     COMPLETE = 9
 
 
+class AssignmentMode(Enum):
+    # STATIC fixes every inspection at start, DYNAMIC hands them out as
+    # auditors become free
+    STATIC = 0
+    DYNAMIC = 1
+
+
 class AuditorState(Enum):
     INIT = 0
     REQUESTING_PROJECT = 1
@@ -37,6 +54,8 @@ class Auditor(BaseModel):
     audit_count: int = 0
     audits_aligned: int = 0
     compensation: float = 0
+    # Inspections taken away for not being answered in time
+    timeouts: int = 0
 
 
 # For communicating with through fastAPI
@@ -54,6 +73,101 @@ class DataDumpRequest(BaseModel):
     name: str
 
 
+# Largest compensation the contract's uint16[] payout can carry
+MAX_SETTLEMENT_AMOUNT = 2**16 - 1
+
+
+class SettlementError(ValueError):
+    # The payout of an audit cannot be encoded for the contract
+    pass
+
+
+def encode_settlement(addresses: List[str], amounts: List[int]):
+    try:
+        return encode_abi(["address[]", "uint16[]"], [addresses, amounts])
+    except EncodingError as error:
+        raise SettlementError(str(error)) from error
+
+
+# Auditor column value of a DYNAMIC inspection slot nobody holds yet
+UNASSIGNED = -1
+
+# Default and largest page sizes for listings
+PAGE_LIMIT = 50
+MAX_PAGE_LIMIT = 500
+
+# Inspections built per step when an audit is started without blocking
+START_CHUNK = 65536
+
+
+def _number_column(batch: List[dict], key: str, default: float):
+    # One float per entry in batch, nan where the value is not a number
+    column = np.full(len(batch), np.nan)
+    for row, fields in enumerate(batch):
+        value = fields.get(key, default)
+        if isinstance(value, (int, float)) and not isinstance(value, bool):
+            column[row] = value
+    return column
+
+
+class InspectionStore:
+    """
+    Columnar storage for the inspections of an audit. Row n holds inspection_id n.
+    Auditors are stored as an index into the audit's auditor list.
+    """
+
+    def __init__(self, capacity: int = 0):
+        self.size = 0
+        self._auditor = np.zeros(capacity, dtype=np.int32)
+        self._item = np.zeros(capacity, dtype=np.int32)
+        self._completed = np.zeros(capacity, dtype=bool)
+        self._finding = np.zeros(capacity, dtype=bool)
+        self._aligned = np.zeros(capacity, dtype=bool)
+
+    def __len__(self):
+        return self.size
+
+    @property
+    def auditor(self):
+        return self._auditor[: self.size]
+
+    @property
+    def item(self):
+        return self._item[: self.size]
+
+    @property
+    def completed(self):
+        return self._completed[: self.size]
+
+    @property
+    def finding(self):
+        return self._finding[: self.size]
+
+    @property
+    def aligned(self):
+        return self._aligned[: self.size]
+
+    def reserve(self, capacity: int):
+        if capacity <= len(self._item):
+            return
+        capacity = max(capacity, 2 * len(self._item))
+        for column in ("_auditor", "_item", "_completed", "_finding", "_aligned"):
+            old = getattr(self, column)
+            new = np.zeros(capacity, dtype=old.dtype)
+            new[: self.size] = old[: self.size]
+            setattr(self, column, new)
+
+    def append(self, auditors, items):
+        # Returns the inspection ids of the appended rows
+        count = len(items)
+        start = self.size
+        self.reserve(start + count)
+        self._auditor[start : start + count] = auditors
+        self._item[start : start + count] = items
+        self.size += count
+        return np.arange(start, start + count)
+
+
 class Audit(BaseModel):
     class Config:
         underscore_attrs_are_private = True
@@ -83,6 +197,9 @@ class Audit(BaseModel):
         "waiting_for_calculations": "Outcomes are being calculated. You will be notified once the results are ready.",
         "assignment_message": "You have been assigned the following inspection: ",
         "auditor_complete": "You have complete all your tasks. You will be notified when this phase is complete",
+        "assignment_pending": "Inspections are still being assigned. You will be sent your next one shortly",
+        "auditor_parked": "All open inspections are taken for now. You will be notified if one comes free",
+        "inspection_timeout": "Your inspection was not answered in time and has been given to another auditor",
         "compensation_message": "Your compensation is :",
     }
 
@@ -97,134 +214,689 @@ class Audit(BaseModel):
 
     state: State = State.INITIALIZATION
 
-    inspections: List[Inspection] = []
-
-    _item_results: List[bool] = []
-    # _auditor_audits_aligned: List[int] = []
-    # _auditor_audits_count: List[int] = []
-
-    # auditor_compensation: List[float] = []
+    assignment: AssignmentMode = AssignmentMode.STATIC
+    # Set while the inspections of a started audit are still being built
+    assignment_pending: bool = False
+
+    # Seconds an auditor has to answer their current inspection, 0 for no limit
+    inspection_timeout: float = 0
+
+    # ABI encoded (address[], uint16[]) payout, fixed once compensation is known
+    settlement: Optional[str] = None
+    settlement_hash: Optional[str] = None
+
+    _inspections: InspectionStore = InspectionStore()
+
+    # Auditor jids in the order used by the inspection store's auditor column
+    _auditor_jids: List[str] = []
+    _auditor_ids: Dict[str, int] = {}
+    # Inspections for item n are _item_offsets[n] to _item_offsets[n + 1]
+    _item_offsets: np.ndarray = np.zeros(1, dtype=np.int64)
+
+    _item_results: np.ndarray = np.zeros(0, dtype=bool)
+
+    # Lookup indexes over the inspections, maintained on assignment and on
+    # completion so that the per-answer paths never scan every inspection.
+    _auditor_inspections: Dict[str, List[int]] = {}
+    # Outstanding inspection ids per auditor, with each id's position in its
+    # pool, for O(1) random pick and swap-remove
+    _outstanding: Dict[str, List[int]] = {}
+    _outstanding_position: np.ndarray = np.zeros(0, dtype=np.int64)
+
+    # Running tallies, updated as each finding arrives
+    _outstanding_count: int = 0
+    _item_remaining: np.ndarray = np.zeros(0, dtype=np.int64)
+    _item_true_votes: np.ndarray = np.zeros(0, dtype=np.int64)
+    _item_false_votes: np.ndarray = np.zeros(0, dtype=np.int64)
+
+    # Changes not yet written to a durable store, only tracked once an
+    # AuditStore has started tracking this audit (see storage.py)
+    _track_changes: bool = False
+    _items_dirty: bool = False
+    _dirty_auditors: Dict[str, None] = {}
+    _dirty_inspections: Dict[int, None] = {}
+    _inspections_saved: int = 0
+    # (jid, item) of DYNAMIC inspections taken away by a timeout
+    _dirty_timed_out: List[tuple] = []
+
+    # DYNAMIC assignment. Slots for every inspection exist from the start with
+    # UNASSIGNED auditors, items with free slots are kept in item order.
+    _item_assigned: np.ndarray = np.zeros(0, dtype=np.int64)
+    _unassigned_count: int = 0
+    _open_items: deque = deque()
+    _auditor_items: Dict[str, set] = {}
+    _assigned_at: Dict[int, float] = {}
+    # Smoothed seconds from hand-out to answer, per auditor
+    _answer_time: Dict[str, float] = {}
+    _parked: Dict[str, None] = {}
+    _straggler_factor: float = 2.0
+    _answer_smoothing: float = 0.3
 
     def register_auditor(self, auditor: Auditor):
         assert self.state == State.AUDITOR_REGISTRATION
         self.auditors[auditor.jid] = auditor
+        self.touch_auditor(auditor.jid)
+
+    def touch_auditor(self, jid: str):
+        # Mark an auditor as changed for the durable store
+        if self._track_changes:
+            self._dirty_auditors[jid] = None
+
+    def touch_all_auditors(self):
+        if self._track_changes:
+            self._dirty_auditors.update(dict.fromkeys(self.auditors))
 
     def is_jid_registered(self, jid: str):
         return jid in self.auditors
 
     def add_item(self, description: str):
         self.items.append(description)
+        self._items_dirty = self._track_changes
+
+    def add_items(self, descriptions: List[str]):
+        self.items.extend(descriptions)
+        self._items_dirty = self._track_changes
 
     def delete_item(self, number):
         del self.items[number]
+        self._items_dirty = self._track_changes
 
     def list_items(self):
         return self.items
 
     def list_items_for_print(self):
-        output = ""
-        for number, description in enumerate(self.items):
-            output += f"{number} : {description}\n"
-        return output
+        return "".join(
+            f"{number} : {description}\n"
+            for number, description in enumerate(self.items)
+        )
+
+    def page_items(self, cursor: int = 0, limit: int = PAGE_LIMIT):
+        # Items numbered cursor onwards, and the cursor of the next page
+        limit = max(1, min(limit, MAX_PAGE_LIMIT))
+        cursor = max(0, cursor)
+        end = min(cursor + limit, len(self.items))
+        page = list(enumerate(self.items[cursor:end], start=cursor))
+        return page, (end if end < len(self.items) else None)
+
+    def items_page_for_print(self, cursor: int = 0, limit: int = PAGE_LIMIT):
+        page, next_cursor = self.page_items(cursor, limit)
+        lines = [f"{number} : {description}" for number, description in page]
+        if next_cursor is not None:
+            lines.append(f"More: items {next_cursor} {limit}")
+        return "\n".join(lines)
 
     def calculate_inspection_reward(self):
         self.inspection_reward = self.bond / (
             len(self.items) * self.number_of_audits_per_item
         )
 
+    def _reset_inspections(self, capacity: int):
+        self._auditor_jids = list(self.auditors.keys())
+        self._auditor_ids = {jid: n for n, jid in enumerate(self._auditor_jids)}
+        num_items = self.number_of_items()
+        self._inspections = InspectionStore(capacity)
+        self._item_offsets = (
+            np.arange(num_items + 1, dtype=np.int64) * self.number_of_audits_per_item
+        )
+        self._auditor_inspections = {}
+        self._outstanding = {}
+        self._outstanding_count = 0
+        self._item_remaining = np.zeros(num_items, dtype=np.int64)
+        self._item_true_votes = np.zeros(num_items, dtype=np.int64)
+        self._item_false_votes = np.zeros(num_items, dtype=np.int64)
+        self._dirty_inspections = {}
+        self._inspections_saved = 0
+        self._dirty_timed_out = []
+        self._item_assigned = np.zeros(num_items, dtype=np.int64)
+        self._unassigned_count = 0
+        self._open_items = deque()
+        self._auditor_items = {}
+        self._assigned_at = {}
+        self._answer_time = {}
+        self._parked = {}
+
     def assign_auditors_to_items(self):
-        inspection_count = 0
-        auditors = []
-        for key in self.auditors.keys():
-            auditors.append(key)
-        auditor_iterator = 0
-        num_auditors = len(auditors)
-
-        for item_iterator in range(len(self.items)):
-            for audit_per_item_iterator in range(self.number_of_audits_per_item):
-                self.inspections.append(
-                    self.Inspection(
-                        **{
-                            "auditor": auditors[auditor_iterator],
-                            "item": item_iterator,
-                            "inspection_id": inspection_count,
-                        }
-                    )
+        for _ in self.assign_auditors_in_chunks():
+            pass
+
+    def assign_auditors_in_chunks(self, chunk_size: int = 0):
+        """
+        Builds the inspections, then indexes them about chunk_size at a time
+        (all at once for 0), yielding the auditors given inspections by each
+        chunk. A STATIC chunk covers whole auditors, so each auditor is
+        yielded once with all of their inspections in place. If the build
+        was interrupted it carries on after the inspections it had.
+        """
+        num_auditors = len(self.auditors)
+        per_item = self.number_of_audits_per_item
+        count = self.number_of_items() * per_item
+        if not self.assignment_pending or self._inspections.size == 0:
+            self._reset_inspections(count)
+        self.assignment_pending = True
+        dynamic = self.assignment == AssignmentMode.DYNAMIC
+
+        start = self._inspections.size
+        ids = np.arange(start, count)
+        if dynamic:
+            # Handed out later by request_inspection
+            auditors = np.full(len(ids), UNASSIGNED)
+        else:
+            # Round robin: inspection n goes to auditor n % num_auditors
+            auditors = ids % max(num_auditors, 1)
+        # Inspection n is of item n // per_item
+        self._inspections.append(auditors, ids // per_item)
+        chunk_size = chunk_size or max(len(ids), 1)
+
+        if dynamic:
+            for first in range(start, count, chunk_size):
+                self._index_inspections(ids[first - start : first - start + chunk_size])
+                yield []
+            self._rebuild_open_items()
+        elif len(ids):
+            # Auditor k holds every num_auditors-th new inspection from its first
+            per_auditor = -(-len(ids) // num_auditors)
+            step = max(1, chunk_size // per_auditor)
+            for first in range(0, num_auditors, step):
+                auditor_ids = np.arange(first, min(first + step, num_auditors))
+                firsts = start + (auditor_ids - start) % num_auditors
+                grid = firsts[:, None] + num_auditors * np.arange(per_auditor)
+                self._index_inspections(grid[grid < count])
+                yield [self.auditors[self._auditor_jids[n]] for n in auditor_ids]
+        self.assignment_pending = False
+
+    def auditors_needed(self):
+        # Auditors still missing before the audit can start. Every item of a
+        # DYNAMIC audit needs number_of_audits_per_item different auditors,
+        # with fewer its last slots could never be handed out.
+        needed = 1
+        if self.assignment == AssignmentMode.DYNAMIC:
+            needed = self.number_of_audits_per_item
+        return max(0, needed - len(self.auditors))
+
+    def abort_start(self):
+        # Back to before 'start', after building the inspections failed
+        self.state = State.AUDITOR_REGISTRATION_COMPLETE
+        self.assignment_pending = False
+        self._reset_inspections(0)
+        for auditor in self.auditors.values():
+            auditor.current_inspection = None
+        self.touch_all_auditors()
+
+    def load_inspections(self, auditors, items, completed, finding):
+        # Rebuild the inspection store and its indexes from saved columns
+        self._reset_inspections(len(items))
+        ids = self._inspections.append(auditors, items)
+        self._inspections.completed[:] = completed
+        self._inspections.finding[:] = finding
+        self._index_inspections(ids)
+        if self.assignment == AssignmentMode.DYNAMIC:
+            self._rebuild_open_items()
+        self._inspections_saved = len(items)
+
+    def load_assignment_history(self, timed_out, answer_time, parked):
+        # DYNAMIC state kept outside the inspections: items taken away from
+        # an auditor by a timeout, smoothed answer times and parked auditors
+        for jid, item in timed_out:
+            self._auditor_items.setdefault(jid, set()).add(item)
+        self._answer_time.update(answer_time)
+        self._parked.update(dict.fromkeys(parked))
+
+    def _rebuild_open_items(self):
+        # DYNAMIC items with free slots, in item order
+        self._open_items = deque(
+            np.flatnonzero(self._item_assigned < np.diff(self._item_offsets)).tolist()
+        )
+
+    def _index_inspections(self, inspection_ids):
+        store = self._inspections
+        if len(self._outstanding_position) < store.size:
+            position = np.zeros(len(store._item), dtype=np.int64)
+            position[: len(self._outstanding_position)] = self._outstanding_position
+            self._outstanding_position = position
+
+        assigned = store.auditor[inspection_ids] != UNASSIGNED
+        assigned_ids = inspection_ids[assigned]
+        auditor_column = store.auditor[assigned_ids]
+        order = np.argsort(auditor_column, kind="stable")
+        # Only the auditors holding some of these inspections are visited
+        auditor_ids, counts = np.unique(auditor_column, return_counts=True)
+        grouped = np.split(assigned_ids[order], np.cumsum(counts)[:-1])
+        dynamic = self.assignment == AssignmentMode.DYNAMIC
+        for auditor_id, ids in zip(auditor_ids.tolist(), grouped):
+            jid = self._auditor_jids[auditor_id]
+            self._auditor_inspections.setdefault(jid, []).extend(ids.tolist())
+            outstanding = ids[~store.completed[ids]]
+            pool = self._outstanding.setdefault(jid, [])
+            self._outstanding_position[outstanding] = np.arange(
+                len(pool), len(pool) + len(outstanding)
+            )
+            pool.extend(outstanding.tolist())
+            if dynamic:
+                self._auditor_items.setdefault(jid, set()).update(
+                    store.item[ids].tolist()
                 )
-                inspection_count += 1
-                auditor_iterator += 1
-                if auditor_iterator >= num_auditors:
-                    auditor_iterator = 0
 
-    def get_item_audits(self, item):
-        item_audits = []
+        items = store.item[inspection_ids]
+        if dynamic:
+            self._item_assigned += np.bincount(
+                items[assigned], minlength=len(self._item_assigned)
+            )
+            self._unassigned_count += int(np.count_nonzero(~assigned))
+        completed = store.completed[inspection_ids]
+        finding = store.finding[inspection_ids]
+        num_items = len(self._item_remaining)
+        self._outstanding_count += int(np.count_nonzero(~completed))
+        self._item_remaining += np.bincount(items[~completed], minlength=num_items)
+        self._item_true_votes += np.bincount(
+            items[completed & finding], minlength=num_items
+        )
+        self._item_false_votes += np.bincount(
+            items[completed & ~finding], minlength=num_items
+        )
 
-        for inspect in self.inspections:
-            if inspect.item == item:
-                item_audits.append(inspect)
+    def _complete_inspection(self, inspection_id: int, finding: bool):
+        store = self._inspections
+        item = store._item[inspection_id]
+        if store._completed[inspection_id]:
+            # A finding that is changed moves its vote
+            if store._finding[inspection_id]:
+                self._item_true_votes[item] -= 1
+            else:
+                self._item_false_votes[item] -= 1
+        store._finding[inspection_id] = finding
+        if finding:
+            self._item_true_votes[item] += 1
+        else:
+            self._item_false_votes[item] += 1
+        if self._track_changes:
+            self._dirty_inspections[inspection_id] = None
+        if store._completed[inspection_id]:
+            return
+        store._completed[inspection_id] = True
+        self._outstanding_count -= 1
+        self._item_remaining[item] -= 1
+        handed_out = self._assigned_at.pop(inspection_id, None)
+        if handed_out is not None:
+            self._record_answer_time(
+                self._auditor_jids[store._auditor[inspection_id]],
+                time.monotonic() - handed_out,
+            )
 
-        return item_audits
+        self._remove_outstanding(
+            self._auditor_jids[store._auditor[inspection_id]], inspection_id
+        )
 
-    def get_auditor_audits(self, auditor: Auditor):
-        auditor_audits = []
+    def _remove_outstanding(self, jid: str, inspection_id: int):
+        # Swap-remove from the auditor's outstanding pool
+        pool = self._outstanding[jid]
+        position = self._outstanding_position[inspection_id]
+        last = pool.pop()
+        if last != inspection_id:
+            pool[position] = last
+            self._outstanding_position[last] = position
+
+    def _give_inspection(self, auditor: Auditor, inspection_id: int):
+        # Add an inspection to an auditor's indexes and outstanding pool
+        jid = auditor.jid
+        self._inspections._auditor[inspection_id] = self._auditor_ids[jid]
+        insort(self._auditor_inspections.setdefault(jid, []), inspection_id)
+        pool = self._outstanding.setdefault(jid, [])
+        self._outstanding_position[inspection_id] = len(pool)
+        pool.append(inspection_id)
+        if self._track_changes:
+            self._dirty_inspections[inspection_id] = None
+        self.touch_auditor(jid)
+
+    def expire_inspection(self, inspection_id: int):
+        """
+        Takes an unanswered inspection away from its auditor and gives it to
+        an auditor who has not inspected the item. A STATIC audit gives it to
+        the least loaded of them. A DYNAMIC audit frees the slot so it is handed
+        out next, to an idle auditor if there is one. Parked auditors are
+        left to wake_parked.
+
+        Returns None if the inspection stays where it is: it was answered,
+        or nobody else can take it. Otherwise returns the original auditor
+        and the auditors that were given a new current inspection.
+        """
+        store = self._inspections
+        if (
+            store._completed[inspection_id]
+            or store._auditor[inspection_id] == UNASSIGNED
+        ):
+            return None
+        original = self.auditors[self.auditor_jid(store._auditor[inspection_id])]
+        item = int(store._item[inspection_id])
+        first, last = self._item_offsets[item], self._item_offsets[item + 1]
+        holders = {
+            self._auditor_jids[auditor_id]
+            for auditor_id in store._auditor[first:last].tolist()
+            if auditor_id != UNASSIGNED
+        }
+        dynamic = self.assignment == AssignmentMode.DYNAMIC
+        candidates = [
+            auditor
+            for auditor in self.auditors.values()
+            if auditor.jid not in holders
+            and not (dynamic and item in self._auditor_items.get(auditor.jid, ()))
+        ]
+        if not candidates:
+            return None
+
+        # Take it away from the original auditor, who keeps the item in their
+        # DYNAMIC history so it is not handed back to them
+        jid = original.jid
+        self._remove_outstanding(jid, inspection_id)
+        ids = self._auditor_inspections[jid]
+        del ids[bisect_left(ids, inspection_id)]
+        self._assigned_at.pop(inspection_id, None)
+        original.timeouts += 1
+        if original.current_inspection == inspection_id:
+            original.current_inspection = None
+        self.touch_auditor(jid)
+
+        assigned = []
+        if dynamic:
+            store._auditor[inspection_id] = UNASSIGNED
+            if self._track_changes:
+                self._dirty_inspections[inspection_id] = None
+                self._dirty_timed_out.append((jid, item))
+            if self._item_assigned[item] == last - first:
+                # Freed slots go out before the rest
+                self._open_items.appendleft(item)
+            self._item_assigned[item] -= 1
+            self._unassigned_count += 1
+            for auditor in candidates:
+                if self._item_assigned[item] == last - first:
+                    break
+                if (
+                    auditor.current_inspection is not None
+                    or auditor.jid in self._parked
+                ):
+                    continue
+                if self.request_inspection(auditor):
+                    assigned.append(auditor)
+        else:
+            replacement = min(
+                candidates, key=lambda auditor: self.auditor_remaining(auditor)
+            )
+            self._give_inspection(replacement, inspection_id)
+            if replacement.current_inspection is None:
+                replacement.current_inspection = inspection_id
+                assigned.append(replacement)
+        return original, assigned
+
+    def auditor_jid(self, auditor_id: int):
+        # Jid for an inspection store auditor index, "" for an unassigned slot
+        if auditor_id == UNASSIGNED:
+            return ""
+        return self._auditor_jids[auditor_id]
+
+    def number_of_inspections(self):
+        return self._inspections.size
+
+    def get_inspection(self, inspection_id: int):
+        store = self._inspections
+        return self.Inspection(
+            auditor=self.auditor_jid(store._auditor[inspection_id]),
+            item=int(store._item[inspection_id]),
+            inspection_id=inspection_id,
+            completed=bool(store._completed[inspection_id]),
+            finding=bool(store._finding[inspection_id]),
+            aligned=bool(store._aligned[inspection_id]),
+        )
 
-        for inspect in self.inspections:
-            if inspect.auditor == auditor.jid:
-                auditor_audits.append(inspect)
+    def get_inspections(self, inspection_ids):
+        return [self.get_inspection(int(i)) for i in inspection_ids]
+
+    def get_item_audits(self, item):
+        return self.get_inspections(
+            range(self._item_offsets[item], self._item_offsets[item + 1])
+        )
 
-        return auditor_audits
+    def get_auditor_audits(self, auditor: Auditor):
+        return self.get_inspections(self._auditor_inspections.get(auditor.jid, []))
 
     def get_outstanding_item_audits(self, item):
-        outstanding_audits = []
-        audits = self.get_item_audits(item)
-        for audit in audits:
-            if not audit.completed:
-                outstanding_audits.append(audit)
-        return outstanding_audits
+        first, last = self._item_offsets[item], self._item_offsets[item + 1]
+        completed = self._inspections.completed[first:last]
+        return self.get_inspections(first + np.flatnonzero(~completed))
 
     def get_outstanding_auditor_audits(self, auditor: Auditor):
-        outstanding_audits = []
-        audits = self.get_auditor_audits(auditor)
-        for audit in audits:
-            if not audit.completed:
-                outstanding_audits.append(audit)
-        return outstanding_audits
+        return self.get_inspections(self._outstanding.get(auditor.jid, []))
+
+    def auditor_remaining(self, auditor: Auditor):
+        return len(self._outstanding.get(auditor.jid, []))
 
     def auditor_done(self, auditor):
-        return len(self.get_outstanding_auditor_audits(auditor)) == 0
+        if self.assignment_pending or self.auditor_remaining(auditor) > 0:
+            return False
+        if self.assignment == AssignmentMode.STATIC:
+            return True
+        # DYNAMIC auditors are done once no open slot is one they can take
+        return (
+            auditor.jid not in self._parked and self._eligible_item(auditor.jid) is None
+        )
 
     def assign_current_inspection(self, auditor: Auditor):
         # Randomly assign an auditor an inspection to perform
-        outstanding_audits = self.get_outstanding_auditor_audits(auditor)
+        outstanding_audits = self._outstanding.get(auditor.jid, [])
+        self.touch_auditor(auditor.jid)
         if len(outstanding_audits) > 0:
-            auditor.current_inspection = choice(outstanding_audits).inspection_id
+            auditor.current_inspection = choice(outstanding_audits)
             return True
+        elif self.assignment == AssignmentMode.DYNAMIC:
+            return self.request_inspection(auditor)
         else:
             auditor.current_inspection = None
         return False
 
+    def is_parked(self, auditor: Auditor):
+        return auditor.jid in self._parked
+
+    def _record_answer_time(self, jid: str, seconds: float):
+        self.touch_auditor(jid)
+        previous = self._answer_time.get(jid)
+        if previous is None:
+            self._answer_time[jid] = seconds
+        else:
+            self._answer_time[jid] = previous + self._answer_smoothing * (
+                seconds - previous
+            )
+
+    def _eligible_item(self, jid: str):
+        # First item with a free slot that this auditor has not inspected
+        done = self._auditor_items.get(jid, ())
+        for item in self._open_items:
+            if item not in done:
+                return item
+        return None
+
+    def _straggler_threshold(self):
+        # Auditors slower than this are parked near the end of an audit
+        if len(self._answer_time) < 2:
+            return None
+        return self._straggler_factor * float(
+            np.median(np.fromiter(self._answer_time.values(), dtype=float))
+        )
+
+    def _busy_below(self, threshold: float):
+        # Auditors holding an inspection whose answer time is under threshold
+        return sum(
+            1
+            for jid, pool in self._outstanding.items()
+            if pool and self._answer_time.get(jid, 0.0) <= threshold
+        )
+
+    def _hand_out(self, auditor: Auditor, item: int):
+        store = self._inspections
+        jid = auditor.jid
+        first, last = self._item_offsets[item], self._item_offsets[item + 1]
+        inspection_id = int(
+            first + np.flatnonzero(store._auditor[first:last] == UNASSIGNED)[0]
+        )
+        self._item_assigned[item] += 1
+        self._unassigned_count -= 1
+        if self._item_assigned[item] == last - first:
+            self._open_items.remove(item)
+
+        self._give_inspection(auditor, inspection_id)
+        self._auditor_items.setdefault(jid, set()).add(item)
+        self._assigned_at[inspection_id] = time.monotonic()
+        auditor.current_inspection = inspection_id
+
+    def request_inspection(self, auditor: Auditor):
+        """
+        Hands a DYNAMIC audit's next free slot to an auditor who is free.
+        Once there are no more free slots than faster auditors who are busy,
+        an auditor much slower than the rest is parked instead, so the last
+        inspections do not wait on them. Returns True if one was assigned.
+        """
+        jid = auditor.jid
+        self._parked.pop(jid, None)
+        auditor.current_inspection = None
+        self.touch_auditor(jid)
+        item = self._eligible_item(jid)
+        if item is None:
+            return False
+
+        if self._unassigned_count <= len(self.auditors):
+            threshold = self._straggler_threshold()
+            if (
+                threshold is not None
+                and self._answer_time.get(jid, 0.0) > threshold
+                and self._unassigned_count <= self._busy_below(threshold)
+            ):
+                self._parked[jid] = None
+                return False
+
+        self._hand_out(auditor, item)
+        return True
+
+    def wake_parked(self):
+        """
+        Gives parked auditors a slot once there are more free slots than fast
+        auditors to take them, fastest first. Returns the auditors that were
+        given an inspection and those released with nothing left to do.
+        """
+        woken, released = [], []
+        if not self._parked:
+            return woken, released
+
+        threshold = self._straggler_threshold()
+        busy = 0 if threshold is None else self._busy_below(threshold)
+        for jid in sorted(
+            self._parked, key=lambda jid: self._answer_time.get(jid, 0.0)
+        ):
+            auditor = self.auditors[jid]
+            item = self._eligible_item(jid)
+            if item is None:
+                del self._parked[jid]
+                self.touch_auditor(jid)
+                released.append(auditor)
+            elif self._unassigned_count > busy:
+                del self._parked[jid]
+                self._hand_out(auditor, item)
+                woken.append(auditor)
+        return woken, released
+
     def assign_all_current_inspection(self):
         for auditor in self.auditors.values():
             self.assign_current_inspection(auditor)
 
+    def _outstanding_ids(self):
+        return np.flatnonzero(~self._inspections.completed)
+
     def get_outstanding_audits(self):
-        outstanding_audits = []
-        for inspection in self.inspections:
-            if not inspection.completed:
-                outstanding_audits.append(inspection)
-        return outstanding_audits
+        return self.get_inspections(self._outstanding_ids())
 
     def get_outstanding_audits_for_print(self):
+        store = self._inspections
         outstanding_audits = []
-        for inspection in self.inspections:
-            if not inspection.completed:
-                outstanding_audits.append(
-                    f"{inspection.auditor} -> {self.items[inspection.item]}"
-                )
+        for inspection_id in self._outstanding_ids():
+            outstanding_audits.append(
+                f"{self.auditor_jid(store._auditor[inspection_id]) or '(unassigned)'} -> {self.items[store._item[inspection_id]]}"
+            )
         return "\n".join(outstanding_audits)
 
+    def page_outstanding(
+        self,
+        cursor: int = 0,
+        limit: int = PAGE_LIMIT,
+        auditor: Optional[str] = None,
+        item: Optional[int] = None,
+    ):
+        """
+        Outstanding inspection ids from cursor onwards, in id order, optionally
+        only those of one auditor and/or one item. Returns the ids and the
+        cursor of the next page, None on the last page.
+        """
+        limit = max(1, min(limit, MAX_PAGE_LIMIT))
+        cursor = max(0, cursor)
+        completed = self._inspections.completed
+
+        if auditor is not None:
+            # Each auditor's inspections are indexed in id order
+            ids = self._auditor_inspections.get(auditor, [])
+            page = []
+            for position in range(bisect_left(ids, cursor), len(ids)):
+                inspection_id = ids[position]
+                if completed[inspection_id]:
+                    continue
+                if item is not None and self._inspections._item[inspection_id] != item:
+                    continue
+                if len(page) == limit:
+                    return page, inspection_id
+                page.append(inspection_id)
+            return page, None
+
+        if item is not None:
+            if not 0 <= item < len(self._item_offsets) - 1:
+                return [], None
+            first = max(cursor, self._item_offsets[item])
+            end = self._item_offsets[item + 1]
+        else:
+            first, end = cursor, len(completed)
+
+        # Scan forward in growing windows until the page is full
+        page = []
+        window = max(4 * limit, 4096)
+        while first < end:
+            last = min(first + window, end)
+            found = first + np.flatnonzero(~completed[first:last])
+            needed = limit + 1 - len(page)
+            page.extend(found[:needed].tolist())
+            if len(page) > limit:
+                return page[:limit], page[limit]
+            first = last
+            window *= 2
+        return page, None
+
+    def outstanding_page_for_print(
+        self,
+        cursor: int = 0,
+        limit: int = PAGE_LIMIT,
+        auditor: Optional[str] = None,
+        item: Optional[int] = None,
+    ):
+        page, next_cursor = self.page_outstanding(cursor, limit, auditor, item)
+        store = self._inspections
+        lines = [
+            f"{inspection_id} : {self.auditor_jid(store._auditor[inspection_id]) or '(unassigned)'}"
+            f" -> {self.items[store._item[inspection_id]]}"
+            for inspection_id in page
+        ]
+        if next_cursor is not None:
+            more = f"More: outstanding_inspections {next_cursor} {limit}"
+            if auditor is not None:
+                more += f" auditor={auditor}"
+            if item is not None:
+                more += f" item={item}"
+            lines.append(more)
+        return "\n".join(lines)
+
     def inspection_id_to_description(self, id: int):
-        return self.items[self.inspections[id].item]
+        return self.items[self._inspections._item[id]]
 
     def auditor_current_inspection(self, auditor: Auditor):
         current_inspection = auditor.current_inspection
@@ -232,45 +904,33 @@ class Audit(BaseModel):
 
     def set_audit(self, auditor, item, finding):
         assert self.state == State.AUDITING, "Not currently auditing"
-        audit_found = False
-        audits = self.get_auditor_audits(auditor)
-        for audit in audits:
-            if audit.item == item:
-                audit_found = True
-                temp_audit = audit
-                temp_audit.finding = finding
-                temp_audit.completed = True
-                self.inspections[temp_audit.inspection_id] = temp_audit
-                break
-
-        if audit_found:
-            return True
-        else:
-            return False
+        for inspection_id in self._auditor_inspections.get(auditor.jid, []):
+            if self._inspections._item[inspection_id] == item:
+                self._complete_inspection(inspection_id, finding)
+                return True
+        return False
 
     def set_audit_by_audit(self, audit, finding):
         assert self.state == State.AUDITING, "Not currently auditing"
-        temp_audit = self.inspections[audit]
-        temp_audit.completed = True
-        temp_audit.finding = finding
-        self.inspections[audit] = temp_audit
+        self._complete_inspection(audit, finding)
+
+    def outstanding_count(self):
+        return self._outstanding_count
 
     def check_if_audit_complete(self):
-        return len(self.get_outstanding_audits()) == 0
+        return not self.assignment_pending and self._outstanding_count == 0
+
+    def get_item_result(self, item: int):
+        # Outcome of an item once all of its inspections are in, else None
+        if self._item_remaining[item] > 0:
+            return None
+        return bool(self._item_true_votes[item] > self._item_false_votes[item])
 
     def calculate_item_results(self):
         # Check if in correct state
         assert self.check_if_audit_complete(), "Audit not complete"
         assert self.state == State.AUDITING_FINISHED, "Not in AUDITING_FINISHED state"
-        self._item_results = []
-        for item in range(self.number_of_items()):
-            item_finding = 0
-            for audit in self.get_item_audits(item):
-                if audit.finding:
-                    item_finding += 1
-                else:
-                    item_finding -= 1
-            self._item_results.append(item_finding > 0)
+        self._item_results = self._item_true_votes > self._item_false_votes
 
         # Set state for next phase
         self.state = State.CALCULATED_ITEM_RESULTS
@@ -280,8 +940,8 @@ class Audit(BaseModel):
             self.state == State.CALCULATED_ITEM_RESULTS
         ), "Not currently calculating item results"
         self.state = State.CALCULATED_AUDIT_RESULTS
-        for audit in self.inspections:
-            audit.aligned = audit.finding == self._item_results[audit.item]
+        store = self._inspections
+        store.aligned[:] = store.finding == self._item_results[store.item]
 
     def calculate_auditor_results(self):
         # Check if in correct state
@@ -289,15 +949,19 @@ class Audit(BaseModel):
             self.state == State.CALCULATED_AUDIT_RESULTS
         ), "Not currently calculating audit results"
 
-        for auditor in self.auditors.values():
-            audit_count = 0
-            aligned_count = 0
-            for audit in self.get_auditor_audits(auditor):
-                audit_count += 1
-                if audit.aligned:
-                    aligned_count += 1
+        store = self._inspections
+        num_auditors = len(self._auditor_jids)
+        audit_counts = np.bincount(store.auditor, minlength=num_auditors)
+        aligned_counts = np.bincount(
+            store.auditor[store.aligned], minlength=num_auditors
+        )
+        for jid, audit_count, aligned_count in zip(
+            self._auditor_jids, audit_counts.tolist(), aligned_counts.tolist()
+        ):
+            auditor = self.auditors[jid]
             auditor.audit_count = audit_count
             auditor.audits_aligned = aligned_count
+        self.touch_all_auditors()
 
         # Set state for next phase
         self.state = State.CALCULATED_AUDITOR_RESULTS
@@ -308,45 +972,271 @@ class Audit(BaseModel):
             self.state == State.CALCULATED_AUDITOR_RESULTS
         ), "Not currently calculating auditor results"
 
-        for auditor in self.auditors.values():
-            incorrect_answers = auditor.audit_count - auditor.audits_aligned
-            compensation_units = max(
-                0,
-                auditor.audits_aligned - self.slashing_ratio * incorrect_answers,
-            )
-            auditor.compensation = compensation_units * self.inspection_reward
+        auditors = list(self.auditors.values())
+        audit_counts = np.array([auditor.audit_count for auditor in auditors])
+        aligned_counts = np.array([auditor.audits_aligned for auditor in auditors])
+        incorrect_answers = audit_counts - aligned_counts
+        compensation_units = np.maximum(
+            0, aligned_counts - self.slashing_ratio * incorrect_answers
+        )
+        compensations = compensation_units * self.inspection_reward
+
+        # Checked before anything is kept, so a payout the contract cannot
+        # take leaves the audit as it was
+        for auditor, compensation in zip(auditors, compensations.tolist()):
+            if not is_address(auditor.addr):
+                raise SettlementError(f"{auditor.jid} has no Ethereum address")
+            if not 0 <= int(compensation) <= MAX_SETTLEMENT_AMOUNT:
+                raise SettlementError(
+                    f"compensation {int(compensation)} for {auditor.jid} is over"
+                    f" the contract's limit of {MAX_SETTLEMENT_AMOUNT}"
+                )
+        payload = encode_settlement(
+            [auditor.addr for auditor in auditors],
+            [int(compensation) for compensation in compensations.tolist()],
+        )
+
+        for auditor, compensation in zip(auditors, compensations.tolist()):
+            auditor.compensation = compensation
+        self.touch_all_auditors()
+        self.set_settlement(payload)
 
         # Set state for next phase
         self.state = State.WAITING_FOR_CONTRACT
 
+    def calculate_results(self):
+        """
+        Stops a complete audit and runs every calculation stage, leaving it
+        WAITING_FOR_CONTRACT. If the payout cannot be encoded the audit goes
+        back to AUDITING, so stop can be tried again, and SettlementError
+        says why. The per-auditor counts are worked out again next time.
+        """
+        assert self.state == State.AUDITING, "Not currently auditing"
+        self.state = State.AUDITING_FINISHED
+        try:
+            self.calculate_item_results()
+            self.calculate_audit_results()
+            self.calculate_auditor_results()
+            self.calculate_auditor_compensation()
+        except SettlementError:
+            self.state = State.AUDITING
+            raise
+
+    def get_outcome(self):
+        addresses = [auditor.addr for auditor in self.auditors.values()]
+        amounts = [int(auditor.compensation) for auditor in self.auditors.values()]
+        return addresses, amounts
+
+    def build_settlement(self):
+        self.set_settlement(encode_settlement(*self.get_outcome()))
+
+    def set_settlement(self, payload: bytes):
+        self.settlement = "0x" + payload.hex()
+        self.settlement_hash = "0x" + keccak(payload).hex()
+
 
 class Audits:
-    def __init__(self):
-        self.audits = dict()
+    def __init__(self, store=None):
+        # Optional durable backend, see storage.py
+        self.store = store
+        if store is None:
+            self.audits = dict()
+            # Routing indexes from jid to audit name. The first audit a jid is
+            # seen in wins, matching the order audits used to be scanned in.
+            self._jid_index = dict()
+            self._admin_index = dict()
+        else:
+            self.audits = store.registry()
+            self._jid_index, self._admin_index = store.load_routes()
+
+    def persist(self, audit: Audit, *auditors: Auditor):
+        # Queue an audit, and auditors changed outside of Audit, for saving
+        if self.store is None:
+            return
+        for auditor in auditors:
+            audit.touch_auditor(auditor.jid)
+        self.store.save(audit)
 
     def add_audit(self, audit: Audit):
-        if audit.name in self.audits:
+        # Names of COMPLETE audits in the store stay taken too
+        if self.has_audit(audit.name):
             return "9"
         self.audits[audit.name] = audit
+        self._admin_index.setdefault(audit.admin_jid, audit.name)
+        for jid in audit.auditors:
+            self._jid_index.setdefault(jid, audit.name)
+        if self.store is not None:
+            self.store.track(audit)
+            self.store.save(audit)
         return 200
 
+    def create_audit(self, fields: dict):
+        return self.add_audit(Audit(**fields))
+
+    def register_audits(self, batch: List[dict]):
+        """
+        Creates an audit, items included, for every entry in batch. Entries
+        are checked column by column and each one gets its own result, so one
+        bad entry does not stop the others from being registered.
+        """
+        count = len(batch)
+        errors = np.full(count, None, dtype=object)
+        statuses = np.full(count, 200)
+
+        def reject(mask, status, reason):
+            # The first problem found with an entry is the one reported
+            mask = mask & (statuses == 200)
+            errors[mask] = reason
+            statuses[mask] = status
+
+        names = [fields.get("name") for fields in batch]
+        admins = [fields.get("admin_jid") for fields in batch]
+        items = [fields.get("items", []) for fields in batch]
+        reject(
+            np.array([not (isinstance(name, str) and name) for name in names], bool),
+            400,
+            "name must be a non-empty string",
+        )
+        reject(
+            np.array([not (isinstance(jid, str) and jid) for jid in admins], bool),
+            400,
+            "admin_jid must be a non-empty string",
+        )
+
+        bond = _number_column(batch, "bond", np.nan)
+        reject(~(bond > 0), 400, "bond must be a positive number")
+        per_item = _number_column(batch, "number_of_audits_per_item", 3)
+        reject(
+            ~(per_item >= 1) | (per_item != np.floor(per_item)),
+            400,
+            "number_of_audits_per_item must be a positive integer",
+        )
+        slashing_ratio = _number_column(batch, "slashing_ratio", 0.5)
+        reject(
+            ~((slashing_ratio >= 0) & (slashing_ratio <= 1)),
+            400,
+            "slashing_ratio must be between 0 and 1",
+        )
+        reject(
+            np.array(
+                [
+                    not isinstance(descriptions, list)
+                    or not all(isinstance(item, str) for item in descriptions)
+                    for descriptions in items
+                ],
+                bool,
+            ),
+            400,
+            "items must be a list of strings",
+        )
+
+        inspection_timeout = _number_column(batch, "inspection_timeout", 0)
+        reject(
+            ~(inspection_timeout >= 0),
+            400,
+            "inspection_timeout must be a number of seconds, 0 for none",
+        )
+        modes = [str(fields.get("assignment", "static")).upper() for fields in batch]
+        reject(
+            np.array([mode not in AssignmentMode.__members__ for mode in modes], bool),
+            400,
+            "assignment must be static or dynamic",
+        )
+
+        keys = np.array([str(name) for name in names], dtype=object)
+        _, first = np.unique(keys, return_index=True)
+        repeated = np.ones(count, bool)
+        repeated[first] = False
+        reject(repeated, 409, "name appears more than once in the request")
+        reject(
+            np.array([self.has_audit(name) for name in keys], bool),
+            409,
+            "audit already exists",
+        )
+
+        results = []
+        for row in range(count):
+            result = {"name": names[row], "status": int(statuses[row])}
+            if statuses[row] != 200:
+                result["error"] = errors[row]
+                results.append(result)
+                continue
+            audit = Audit(
+                name=names[row],
+                admin_jid=admins[row],
+                bond=bond[row],
+                number_of_audits_per_item=int(per_item[row]),
+                slashing_ratio=slashing_ratio[row],
+                assignment=AssignmentMode[modes[row]],
+                inspection_timeout=inspection_timeout[row],
+            )
+            audit.add_items(items[row])
+            self.add_audit(audit)
+            result["items"] = len(audit.items)
+            results.append(result)
+        return results
+
+    def register_auditor(self, audit: Audit, auditor: Auditor):
+        audit.register_auditor(auditor)
+        self._jid_index.setdefault(auditor.jid, audit.name)
+
+    def clear_audits(self):
+        self.audits.clear()
+        self._jid_index.clear()
+        self._admin_index.clear()
+        if self.store is not None:
+            self.store.delete_all()
+
     def jid_in_audit(self, jid):
-        for audit in self.audits.values():
-            if jid in audit.auditors:
-                return audit, audit.auditors[jid], audit.auditors[jid].state
-        return (None, None, None)
+        name = self._jid_index.get(jid)
+        if name is None:
+            return (None, None, None)
+        audit = self.audits[name]
+        return audit, audit.auditors[jid], audit.auditors[jid].state
 
     def jid_in_admin(self, jid):
-        for audit in self.audits.values():
-            if jid == audit.admin_jid:
-                return audit
-        return None
+        name = self._admin_index.get(jid)
+        if name is None:
+            return None
+        return self.audits[name]
 
     def jid_to_auditor(self, jid):
-        for audit in self.audits.values():
-            if jid in audit.auditors:
-                return audit.auditors[jid]
-        return None
+        name = self._jid_index.get(jid)
+        if name is None:
+            return None
+        return self.audits[name].auditors[jid]
+
+    def items_page(self, audit_name, cursor: int = 0, limit: int = PAGE_LIMIT):
+        audit = self.audits.get(audit_name)
+        if audit is None:
+            return None
+        page, next_cursor = audit.page_items(cursor, limit)
+        return {
+            "items": [
+                {"number": number, "description": description}
+                for number, description in page
+            ],
+            "next_cursor": next_cursor,
+        }
+
+    def outstanding_page(
+        self,
+        audit_name,
+        cursor: int = 0,
+        limit: int = PAGE_LIMIT,
+        auditor: Optional[str] = None,
+        item: Optional[int] = None,
+    ):
+        audit = self.audits.get(audit_name)
+        if audit is None:
+            return None
+        page, next_cursor = audit.page_outstanding(cursor, limit, auditor, item)
+        return {
+            "inspections": [
+                inspection.dict() for inspection in audit.get_inspections(page)
+            ],
+            "next_cursor": next_cursor,
+        }
 
     def get_audit_outcome(self, audit_name):
         audit = self.audits.get(audit_name, None)
@@ -354,20 +1244,70 @@ class Audits:
         if audit == None:
             return [], []
 
-        if audit.state != State.WAITING_FOR_CONTRACT:
+        if audit.state not in (State.WAITING_FOR_CONTRACT, State.COMPLETE):
             return [], []
 
-        addresses = []
-        amounts = []
-        for beneficiary in audit.auditors.values():
-            addresses.append(beneficiary.addr)
-            amounts.append(int(beneficiary.compensation))
-
-        print("Addresses:")
-        print(addresses)
-        print("Amounts")
-        print(amounts)
+        addresses, amounts = audit.get_outcome()
 
-        audit.state = State.COMPLETE
+        log_event(
+            "audit_outcome",
+            "Audit outcome served",
+            audit=audit_name,
+            auditors=len(addresses),
+            addresses=addresses,
+            amounts=amounts,
+        )
 
         return addresses, amounts
+
+    def has_audit(self, audit_name):
+        # Whether the audit is loaded or in the store, settled or not
+        if audit_name in self.audits:
+            return True
+        return self.store is not None and self.store.has_audit(audit_name)
+
+    def get_settlement(self, audit_name):
+        # The cached payout for an audit, None until compensation is known.
+        # Repeat requests are served the same payload until and after the
+        # contract acknowledges it.
+        audit = self.audits.get(audit_name)
+        if audit is None:
+            if self.store is None:
+                return None
+            return self.store.load_settlement(audit_name)
+        if audit.state not in (State.WAITING_FOR_CONTRACT, State.COMPLETE):
+            return None
+        if audit.settlement is None:
+            # Saved before settlements were kept
+            try:
+                audit.build_settlement()
+            except SettlementError as error:
+                log_event(
+                    "settlement_failed",
+                    "Settlement cannot be encoded",
+                    logging.ERROR,
+                    audit=audit_name,
+                    error=str(error),
+                )
+                return None
+            self.persist(audit)
+        return {"response": audit.settlement, "hash": audit.settlement_hash}
+
+    def acknowledge_settlement(self, audit_name, settlement_hash=None):
+        # Marks the audit COMPLETE once the payload has been delivered.
+        # Returns False if there is nothing to acknowledge or the hash is not
+        # the one that was served.
+        audit = self.audits.get(audit_name)
+        if audit is None:
+            return self.store is not None and self.store.settled(
+                audit_name, settlement_hash
+            )
+        if audit.state == State.COMPLETE:
+            return settlement_hash in (None, audit.settlement_hash)
+        if audit.state != State.WAITING_FOR_CONTRACT:
+            return False
+        if settlement_hash not in (None, audit.settlement_hash):
+            return False
+        audit.state = State.COMPLETE
+        self.persist(audit)
+        return True
@@ -0,0 +1,239 @@
+#!/usr/bin/env python3
+
+"""
+Times each stage of an audit's life in audit.py across audit sizes, from
+tens to 100k auditors and up to 1M items, and records the peak memory each
+stage allocates. Results are written as JSON, one record per size, together
+with the scaling exponent of every stage between neighbouring sizes, so
+regressions and complexity blow-ups show up when runs are compared.
+
+    python benchmarks/audit_scaling.py --sizes 10x10,1000x10000 --json out.json
+
+Each size is run twice: once for timings, and once under tracemalloc for
+memory, since tracing slows everything down.
+"""
+
+import gc
+import json
+import math
+import os
+import sys
+import time
+import tracemalloc
+from argparse import ArgumentParser
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from audit import Audit, Auditor, State
+from xmpp_interface import RWABot
+
+# auditors x items
+DEFAULT_SIZES = "10x10,100x1000,1000x10000,10000x100000,100000x1000000"
+
+STAGES = [
+    "register_auditors",
+    "assign_auditors_to_items",
+    "assign_all_current_inspection",
+    "auditor_command",
+    "set_audit_by_audit",
+    "check_if_audit_complete",
+    "calculate_item_results",
+    "calculate_audit_results",
+    "calculate_auditor_results",
+    "calculate_auditor_compensation",
+]
+
+
+class BenchBot(RWABot):
+    # Replies and notifications are dropped instead of queued
+    def send_message(self, mto, mbody, msubject=None, mtype=None, **kwargs):
+        pass
+
+
+class Recorder:
+    def __init__(self, memory: bool):
+        self.memory = memory
+        self.stages = {}
+
+    def run(self, stage, function, operations=1):
+        gc.collect()
+        if self.memory:
+            tracemalloc.reset_peak()
+            before = tracemalloc.get_traced_memory()[0]
+        started = time.perf_counter()
+        result = function()
+        seconds = time.perf_counter() - started
+        if self.memory:
+            current, peak = tracemalloc.get_traced_memory()
+            record = {"peak_bytes": peak - before, "retained_bytes": current - before}
+        else:
+            record = {"seconds": seconds, "operations": operations}
+            if operations:
+                record["us_per_operation"] = seconds / operations * 1e6
+        self.stages[stage] = record
+        return result
+
+
+def run_audit(num_auditors, num_items, per_item, command_answers, memory):
+    recorder = Recorder(memory)
+    bot = BenchBot("bench@bench", "")
+    audit = Audit(
+        name="bench",
+        admin_jid="admin@bench",
+        bond=1000,
+        number_of_audits_per_item=per_item,
+    )
+    audit.add_items([f"Room {n}" for n in range(num_items)])
+    audit.calculate_inspection_reward()
+    audit.state = State.AUDITOR_REGISTRATION
+
+    def register_auditors():
+        for n in range(num_auditors):
+            bot.register_auditor(
+                audit,
+                Auditor(
+                    jid=f"auditor{n}@bench",
+                    addr="0x" + f"{n + 1:040x}",
+                    audit="bench",
+                ),
+            )
+
+    recorder.run("register_auditors", register_auditors, num_auditors)
+    audit.state = State.AUDITING
+    recorder.run("assign_auditors_to_items", audit.assign_auditors_to_items)
+    recorder.run("assign_all_current_inspection", audit.assign_all_current_inspection)
+    inspections = audit.number_of_inspections()
+
+    # A share of the answers go through the full chat handler, the rest are
+    # recorded directly
+    msg = {"body": "y"}
+    reply = lambda line: None
+    auditors = list(audit.auditors.values())
+    command_answers = min(command_answers, inspections)
+
+    def answer_by_command():
+        done = 0
+        while done < command_answers:
+            for auditor in auditors:
+                if done == command_answers:
+                    break
+                if auditor.current_inspection is not None:
+                    bot.auditor_command(audit, auditor, msg, reply)
+                    done += 1
+
+    recorder.run("auditor_command", answer_by_command, command_answers)
+
+    def answer_directly():
+        completed = audit._inspections.completed
+        count = 0
+        for inspection_id in range(inspections):
+            if not completed[inspection_id]:
+                audit.set_audit_by_audit(inspection_id, inspection_id % 3 != 0)
+                count += 1
+        return count
+
+    remaining = int((~audit._inspections.completed).sum())
+    recorder.run("set_audit_by_audit", answer_directly, remaining)
+    recorder.run("check_if_audit_complete", audit.check_if_audit_complete)
+
+    audit.state = State.AUDITING_FINISHED
+    for stage in STAGES[-4:]:
+        recorder.run(stage, getattr(audit, stage))
+
+    return inspections, recorder.stages
+
+
+def scaling_exponents(runs):
+    # log(time ratio) / log(inspection ratio) between neighbouring sizes
+    exponents = []
+    for smaller, larger in zip(runs, runs[1:]):
+        ratio = larger["inspections"] / smaller["inspections"]
+        if ratio <= 1:
+            continue
+        stages = {}
+        for stage in STAGES:
+            before = smaller["stages"][stage]["seconds"]
+            after = larger["stages"][stage]["seconds"]
+            if before > 0 and after > 0:
+                stages[stage] = math.log(after / before) / math.log(ratio)
+        exponents.append(
+            {"from": smaller["size"], "to": larger["size"], "exponents": stages}
+        )
+    return exponents
+
+
+def main(options):
+    runs = []
+    for size in options.sizes.split(","):
+        num_auditors, num_items = (int(part) for part in size.split("x"))
+        inspections, stages = run_audit(
+            num_auditors, num_items, options.per_item, options.command_answers, False
+        )
+        if options.memory:
+            tracemalloc.start()
+            _, memory = run_audit(
+                num_auditors,
+                num_items,
+                options.per_item,
+                options.command_answers,
+                True,
+            )
+            tracemalloc.stop()
+            for stage, record in memory.items():
+                stages[stage].update(record)
+        runs.append(
+            {
+                "size": size,
+                "auditors": num_auditors,
+                "items": num_items,
+                "per_item": options.per_item,
+                "inspections": inspections,
+                "stages": stages,
+            }
+        )
+        print(f"{size} ({inspections} inspections)", file=sys.stderr)
+        for stage in STAGES:
+            record = stages[stage]
+            line = f"  {stage:32s} {record['seconds'] * 1000:10.2f}ms"
+            if "us_per_operation" in record and record["operations"] > 1:
+                line += f" {record['us_per_operation']:8.2f}us/op"
+            if "peak_bytes" in record:
+                line += f" peak {record['peak_bytes'] / 2**20:8.2f}MiB"
+            print(line, file=sys.stderr)
+
+    return {
+        "python": sys.version.split()[0],
+        "runs": runs,
+        "scaling": scaling_exponents(runs),
+    }
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser(description="audit.py scaling benchmarks")
+    parser.add_argument(
+        "--sizes", default=DEFAULT_SIZES, help="Comma separated auditors x items"
+    )
+    parser.add_argument("--per-item", dest="per_item", type=int, default=3)
+    parser.add_argument(
+        "--command-answers",
+        dest="command_answers",
+        type=int,
+        default=10000,
+        help="Answers sent through auditor_command, the rest use set_audit_by_audit",
+    )
+    parser.add_argument(
+        "--no-memory",
+        dest="memory",
+        action="store_false",
+        help="Skip the tracemalloc pass",
+    )
+    parser.add_argument("--json", dest="json_path", help="Write results here")
+    options = parser.parse_args()
+
+    report = main(options)
+    output = json.dumps(report, indent=2)
+    if options.json_path:
+        with open(options.json_path, "w") as results:
+            results.write(output)
+    else:
+        print(output)
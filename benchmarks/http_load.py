@@ -0,0 +1,190 @@
+#!/usr/bin/env python3
+
+"""
+Chat latency of the bot while the HTTP adapter is idle and while it is under
+load, for both run modes of rwa.py: the HTTP server sharing the bot's event
+loop, and --http-thread.
+
+Chat messages are injected straight into RWABot.message and timed until the
+reply reaches the outbound queue's send, so no XMPP server is needed. The
+HTTP load comes from a separate process posting /register_audit/ and
+/data_dump/ requests over keep-alive connections.
+
+    python benchmarks/http_load.py --seconds 5 --clients 32
+"""
+
+import asyncio
+import contextlib
+import multiprocessing
+import os
+import sys
+import threading
+import time
+from argparse import ArgumentParser
+from collections import deque
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import numpy as np
+from uvicorn import Config, Server
+
+import rwa
+from adapter import LocalAdapter, ThreadedAdapter
+from xmpp_interface import RWABot
+
+ADMIN = "admin@bench"
+
+
+def http_load(port, clients, seconds, results):
+    import aiohttp
+
+    async def client(session, number, deadline):
+        done = 0
+        url = f"http://127.0.0.1:{port}"
+        while time.monotonic() < deadline:
+            if done % 2:
+                payload = {"data": {"name": "bench"}}
+                path = "/data_dump/"
+            else:
+                name = f"load-{number}-{done}"
+                payload = {"data": {"name": name, "admin_jid": ADMIN, "bond": 1}}
+                path = "/register_audit/"
+            async with session.post(url + path, json=payload) as response:
+                await response.read()
+            done += 1
+        return done
+
+    async def main():
+        deadline = time.monotonic() + seconds
+        async with aiohttp.ClientSession() as session:
+            counts = await asyncio.gather(
+                *(client(session, number, deadline) for number in range(clients))
+            )
+        results.put(sum(counts))
+
+    asyncio.run(main())
+
+
+class Probe:
+    """Sends the admin 'state' command every interval and times the replies"""
+
+    def __init__(self, bot, interval):
+        self.bot = bot
+        self.interval = interval
+        self.sent = deque()
+        self.latencies = []
+        self.msg = bot.make_message(
+            mto=bot.bot_jid, mbody="state", mtype="chat", mfrom=ADMIN
+        )
+        bot.outbound.send = self.received
+
+    def received(self, mto, mbody, mtype):
+        if mto == ADMIN and self.sent:
+            self.latencies.append(time.perf_counter() - self.sent.popleft())
+
+    def run(self, seconds):
+        self.latencies = []
+        deadline = time.monotonic() + seconds
+        while time.monotonic() < deadline:
+            self.sent.append(time.perf_counter())
+            self.bot.loop.call_soon_threadsafe(self.bot.message, self.msg)
+            time.sleep(self.interval)
+        # Let the last replies arrive
+        time.sleep(0.2)
+        self.sent.clear()
+        return np.array(self.latencies) * 1000
+
+
+def summary(latencies):
+    if len(latencies) == 0:
+        return "no replies"
+    return "n={:5d}  p50={:7.2f}ms  p99={:7.2f}ms  max={:7.2f}ms".format(
+        len(latencies),
+        np.percentile(latencies, 50),
+        np.percentile(latencies, 99),
+        latencies.max(),
+    )
+
+
+def run_mode(threaded, options):
+    asyncio.set_event_loop(asyncio.new_event_loop())
+    bot = RWABot("botty@bench", "", send_rate=0)
+    bot.create_audit({"name": "bench", "admin_jid": ADMIN, "bond": 1})
+    probe = Probe(bot, options.interval)
+    bot.outbound.start(bot.loop)
+
+    rwa.adapter = LocalAdapter(bot)
+    if threaded:
+        rwa.adapter = ThreadedAdapter(rwa.adapter, bot.loop)
+        bot_thread = threading.Thread(target=bot.loop.run_forever, daemon=True)
+        bot_thread.start()
+        http_loop = asyncio.new_event_loop()
+    else:
+        http_loop = bot.loop
+
+    server = Server(
+        Config(app=rwa.app, port=options.port, ws="none", log_level="warning")
+    )
+    report = {}
+
+    async def scenario():
+        serving = asyncio.ensure_future(server.serve())
+        while not server.started:
+            if serving.done():
+                # Startup failed, raises the reason
+                serving.result()
+            await asyncio.sleep(0.01)
+
+        # The probe blocks, so it runs in a thread while this loop serves HTTP
+        report["idle"] = await http_loop.run_in_executor(
+            None, probe.run, options.seconds
+        )
+
+        context = multiprocessing.get_context("spawn")
+        results = context.Queue()
+        load = context.Process(
+            target=http_load,
+            args=(options.port, options.clients, options.seconds + 1, results),
+        )
+        load.start()
+        await asyncio.sleep(0.5)
+        report["load"] = await http_loop.run_in_executor(
+            None, probe.run, options.seconds
+        )
+        report["requests"] = await http_loop.run_in_executor(None, results.get)
+        load.join()
+
+        server.should_exit = True
+        await serving
+
+    async def stop_outbound():
+        bot.outbound.stop()
+        await asyncio.sleep(0)
+
+    with contextlib.redirect_stdout(open(os.devnull, "w")):
+        http_loop.run_until_complete(scenario())
+
+    if threaded:
+        asyncio.run_coroutine_threadsafe(stop_outbound(), bot.loop).result()
+        bot.loop.call_soon_threadsafe(bot.loop.stop)
+        bot_thread.join()
+    else:
+        bot.loop.run_until_complete(stop_outbound())
+    return report
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser(description="Chat latency under HTTP load")
+    parser.add_argument("--seconds", type=float, default=5.0)
+    parser.add_argument("--clients", type=int, default=32)
+    parser.add_argument("--interval", type=float, default=0.005)
+    parser.add_argument("--port", type=int, default=8089)
+    options = parser.parse_args()
+
+    for name, threaded in (("shared loop", False), ("http thread", True)):
+        report = run_mode(threaded, options)
+        print(f"{name}:")
+        print(f"  idle       {summary(report['idle'])}")
+        print(f"  http load  {summary(report['load'])}")
+        rate = report["requests"] / (options.seconds + 1)
+        print(f"  http       {rate:.0f} requests/s")
@@ -0,0 +1,3 @@
+# Unit tests are in tests/. The contract tests in rwa_poc_sol/tests are run
+# with brownie, and test_scripts/ drives a live XMPP server.
+collect_ignore = ["rwa_poc_sol", "test_scripts"]
@@ -0,0 +1,34 @@
+#!/usr/bin/env python3
+
+import bisect
+import hashlib
+
+
+class HashRing:
+    """Consistent hash ring, with replicas points per node"""
+
+    def __init__(self, nodes, replicas: int = 64):
+        self._points = sorted(
+            (self.hash(f"{node}:{replica}"), node)
+            for node in nodes
+            for replica in range(replicas)
+        )
+        self._keys = [point for point, _ in self._points]
+
+    @staticmethod
+    def hash(key: str):
+        return int.from_bytes(hashlib.md5(key.encode()).digest()[:8], "big")
+
+    def lookup(self, key: str):
+        index = bisect.bisect(self._keys, self.hash(key)) % len(self._keys)
+        return self._points[index][1]
+
+    def walk(self, key: str):
+        # Nodes in ring order starting from the owner of key
+        index = bisect.bisect(self._keys, self.hash(key))
+        seen = []
+        for offset in range(len(self._points)):
+            node = self._points[(index + offset) % len(self._points)][1]
+            if node not in seen:
+                seen.append(node)
+                yield node
@@ -0,0 +1,124 @@
+#!/usr/bin/env python3
+
+import asyncio
+import logging
+import time
+from collections import deque
+from typing import Dict
+
+import aiohttp
+
+from logs import log_event
+
+
+class SettlementJobs:
+    """
+    Chainlink job runs waiting on an audit's settlement. /data_dump/ answers
+    pending for an audit that is not settled yet and adds the run here. When
+    the bot settles the audit, settled() is called from the bot's thread and
+    the settlement is POSTed to callback_url for every run waiting on it, as
+    {"jobRunID": id, "data": {"response": ..., "hash": ...}}.
+
+    A run asked about again while it waits is only called back once. Runs
+    still waiting after max_age seconds are dropped, the node has given up
+    on them by then.
+    """
+
+    def __init__(
+        self,
+        loop,
+        callback_url: str,
+        attempts: int = 3,
+        retry_delay: float = 1.0,
+        max_age: float = 3600.0,
+    ):
+        self.loop = loop
+        self.callback_url = callback_url
+        self.attempts = attempts
+        self.retry_delay = retry_delay
+        self.max_age = max_age
+        # Audit name -> job run id -> time it was added
+        self.pending: Dict[str, dict] = {}
+        # (time added, audit name, job run id), oldest first
+        self._added = deque()
+        self._session = None
+        self._tasks = set()
+
+    def add(self, audit_name: str, job_id):
+        # False if the run is already waiting
+        self.expire()
+        runs = self.pending.setdefault(audit_name, {})
+        if job_id in runs:
+            return False
+        runs[job_id] = time.monotonic()
+        self._added.append((runs[job_id], audit_name, job_id))
+        return True
+
+    def expire(self):
+        cutoff = time.monotonic() - self.max_age
+        while self._added and self._added[0][0] <= cutoff:
+            added, audit_name, job_id = self._added.popleft()
+            # Runs taken or called back since are no longer pending
+            if self.pending.get(audit_name, {}).get(job_id) != added:
+                continue
+            self.take(audit_name, job_id)
+            log_event(
+                "settlement_job_expired",
+                "Job run dropped before its audit was settled",
+                logging.WARNING,
+                audit=audit_name,
+                job=job_id,
+            )
+
+    def take(self, audit_name: str, job_id):
+        # Removes a run that turned out not to need a callback. False if its
+        # callback is already on the way.
+        runs = self.pending.get(audit_name, {})
+        if job_id not in runs:
+            return False
+        del runs[job_id]
+        if not runs:
+            del self.pending[audit_name]
+        return True
+
+    def settled(self, audit_name: str, settlement: dict):
+        # May be called from any thread
+        self.loop.call_soon_threadsafe(self._complete, audit_name, settlement)
+
+    def _complete(self, audit_name: str, settlement: dict):
+        for job_id in self.pending.pop(audit_name, {}):
+            task = self.loop.create_task(self.post(job_id, settlement))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def post(self, job_id, settlement: dict):
+        if self._session is None:
+            self._session = aiohttp.ClientSession(
+                timeout=aiohttp.ClientTimeout(total=10)
+            )
+        body = {"jobRunID": job_id, "data": settlement}
+        for attempt in range(1, self.attempts + 1):
+            try:
+                async with self._session.post(self.callback_url, json=body) as reply:
+                    reply.raise_for_status()
+                log_event("settlement_callback", "Settlement sent", job=job_id)
+                return True
+            except (aiohttp.ClientError, asyncio.TimeoutError) as error:
+                log_event(
+                    "settlement_callback_failed",
+                    "Settlement callback failed",
+                    logging.WARNING,
+                    job=job_id,
+                    attempt=attempt,
+                    error=repr(error),
+                )
+            if attempt < self.attempts:
+                await asyncio.sleep(self.retry_delay * 2 ** (attempt - 1))
+        return False
+
+    async def close(self):
+        if self._tasks:
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
@@ -0,0 +1,139 @@
+#!/usr/bin/env python3
+
+import itertools
+import json
+import logging
+import logging.handlers
+import queue
+import sys
+
+# Log one in every n of these events, the rest are only counted
+SAMPLE_EVERY = {}
+
+_seen = {}
+
+
+def log_event(event: str, message: str, level=logging.INFO, **fields):
+    """
+    Logs a structured event. fields go into the JSON record as they are, and
+    are capped in size by the writer thread, so large lists can be passed
+    without copying or formatting them here. They must not be changed after.
+    """
+    every = SAMPLE_EVERY.get(event, 1)
+    if every > 1:
+        seen = _seen.get(event, 0)
+        _seen[event] = seen + 1
+        if seen % every:
+            return
+    logging.log(
+        level, message, extra={"event": event, "fields": fields, "sampled": every}
+    )
+
+
+class JSONFormatter(logging.Formatter):
+    """
+    One JSON object per line. Strings longer than max_length and lists longer
+    than max_items are cut down, with the full size noted.
+    """
+
+    def __init__(self, static=None, max_length: int = 1000, max_items: int = 20):
+        super().__init__()
+        # Added to every record, e.g. the shard a worker runs
+        self.static = static or {}
+        self.max_length = max_length
+        self.max_items = max_items
+
+    def cap(self, value):
+        if isinstance(value, str):
+            if len(value) > self.max_length:
+                return f"{value[: self.max_length]}... ({len(value)} chars)"
+            return value
+        if isinstance(value, (list, tuple, set)):
+            head = itertools.islice(value, self.max_items)
+            items = [self.cap(item) for item in head]
+            if len(value) > self.max_items:
+                items.append(f"... ({len(value)} items)")
+            return items
+        if isinstance(value, dict):
+            capped = {
+                str(key): self.cap(item)
+                for key, item in itertools.islice(value.items(), self.max_items)
+            }
+            if len(value) > self.max_items:
+                capped["..."] = f"{len(value)} keys"
+            return capped
+        if isinstance(value, (int, float, bool)) or value is None:
+            return value
+        return self.cap(str(value))
+
+    def format(self, record):
+        entry = {
+            "time": self.formatTime(record, "%Y-%m-%dT%H:%M:%S")
+            + f".{int(record.msecs):03d}",
+            "level": record.levelname,
+            "logger": record.name,
+            "message": self.cap(record.getMessage()),
+            **self.static,
+        }
+        event = getattr(record, "event", None)
+        if event is not None:
+            entry["event"] = event
+            if record.sampled > 1:
+                entry["sampled"] = record.sampled
+            entry.update(self.cap(record.fields))
+        dropped = getattr(record, "dropped_before", 0)
+        if dropped:
+            entry["dropped_before"] = dropped
+        if record.exc_info:
+            entry["exception"] = self.cap(self.formatException(record.exc_info))
+        return json.dumps(entry, default=str)
+
+
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    """
+    Hands records to the writer thread without formatting them. When the
+    queue is full records are dropped rather than waited on, and the next
+    record that gets through says how many were lost.
+    """
+
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+        self._unreported = 0
+
+    def prepare(self, record):
+        # Formatting happens on the writer thread
+        return record
+
+    def enqueue(self, record):
+        if self._unreported:
+            record.dropped_before = self._unreported
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+            self._unreported += 1
+            return
+        self._unreported = 0
+
+
+def setup_logging(level=logging.INFO, stream=None, max_queue: int = 10000, **static):
+    """
+    Routes all logging through a bounded queue to a background thread that
+    writes JSON lines to stream (stderr by default). Returns the listener,
+    stop() it on exit to write out what is still queued.
+    """
+    log_queue = queue.Queue(max_queue)
+    writer = logging.StreamHandler(stream or sys.stderr)
+    writer.setFormatter(JSONFormatter(static))
+    listener = logging.handlers.QueueListener(
+        log_queue, writer, respect_handler_level=True
+    )
+
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.addHandler(DroppingQueueHandler(log_queue))
+    root.setLevel(level)
+    listener.start()
+    return listener
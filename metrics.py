@@ -0,0 +1,329 @@
+#!/usr/bin/env python3
+
+import bisect
+import time
+
+# Seconds, for handler, HTTP and loop lag histograms
+LATENCY_BUCKETS = (
+    0.0005,
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+)
+
+# The response adds "; charset=utf-8"
+CONTENT_TYPE = "text/plain; version=0.0.4"
+
+
+class Metric:
+    kind = "untyped"
+
+    def __init__(self, name: str, help: str, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+
+    def samples(self):
+        # (name, {label: value}, value) for every series
+        raise NotImplementedError
+
+    def family(self):
+        return (self.name, self.kind, self.help, list(self.samples()))
+
+
+class Counter(Metric):
+    """A count per combination of label values, only ever goes up"""
+
+    kind = "counter"
+
+    def __init__(self, name: str, help: str, labels=()):
+        super().__init__(name, help, labels)
+        self._values = {}
+
+    def inc(self, *label_values, amount=1):
+        self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def samples(self):
+        for label_values, value in self._values.items():
+            yield self.name, dict(zip(self.labels, label_values)), value
+
+
+class Gauge(Metric):
+    """
+    A value that goes up and down. Either set directly, or read at scrape time
+    from collect(), which returns a number or {label values tuple: number}.
+    """
+
+    kind = "gauge"
+
+    def __init__(self, name: str, help: str, labels=(), collect=None, kind=None):
+        super().__init__(name, help, labels)
+        self.collect = collect
+        # Totals kept elsewhere are exposed as counters through collect
+        if kind is not None:
+            self.kind = kind
+        self._values = {}
+
+    def set(self, value, *label_values):
+        self._values[label_values] = value
+
+    def samples(self):
+        values = self._values
+        if self.collect is not None:
+            values = self.collect()
+            if not isinstance(values, dict):
+                values = {(): values}
+        for label_values, value in values.items():
+            yield self.name, dict(zip(self.labels, label_values)), value
+
+
+class Histogram(Metric):
+    """
+    Observations counted into fixed buckets per combination of label values.
+    Each observation is one bisect and three additions, cumulative bucket
+    counts are only worked out at scrape time.
+    """
+
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, labels=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(buckets)
+        # label values -> [count per bucket and +Inf, sum, count]
+        self._series = {}
+
+    def observe(self, value: float, *label_values):
+        series = self._series.get(label_values)
+        if series is None:
+            series = self._series[label_values] = [
+                [0] * (len(self.buckets) + 1),
+                0.0,
+                0,
+            ]
+        series[0][bisect.bisect_left(self.buckets, value)] += 1
+        series[1] += value
+        series[2] += 1
+
+    def samples(self):
+        bounds = [repr(float(bound)) for bound in self.buckets] + ["+Inf"]
+        for label_values, (counts, total, count) in self._series.items():
+            labels = dict(zip(self.labels, label_values))
+            cumulative = 0
+            for bound, bucket in zip(bounds, counts):
+                cumulative += bucket
+                yield self.name + "_bucket", {**labels, "le": bound}, cumulative
+            yield self.name + "_sum", labels, total
+            yield self.name + "_count", labels, count
+
+
+class Registry:
+    """
+    The metrics of one process or component. collect() returns plain tuples,
+    so families can be sent between processes and merged before rendering.
+    """
+
+    def __init__(self):
+        self._metrics = []
+
+    def register(self, metric: Metric):
+        self._metrics.append(metric)
+        return metric
+
+    def counter(self, name: str, help: str, labels=()):
+        return self.register(Counter(name, help, labels))
+
+    def gauge(self, name: str, help: str, labels=(), collect=None, kind=None):
+        return self.register(Gauge(name, help, labels, collect, kind))
+
+    def histogram(self, name: str, help: str, labels=(), buckets=LATENCY_BUCKETS):
+        return self.register(Histogram(name, help, labels, buckets))
+
+    def collect(self):
+        return [metric.family() for metric in self._metrics]
+
+
+def with_labels(families, **labels):
+    # Families with labels added to every sample, e.g. the shard it came from
+    return [
+        (
+            name,
+            kind,
+            help,
+            [
+                (sample, {**labels, **values}, value)
+                for sample, values, value in samples
+            ],
+        )
+        for name, kind, help, samples in families
+    ]
+
+
+def _escape(value: str):
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def render(families):
+    """
+    Prometheus text exposition of families. Families with the same name, from
+    different registries, are written as one.
+    """
+    merged = {}
+    for name, kind, help, samples in families:
+        if name in merged:
+            merged[name][2].extend(samples)
+        else:
+            merged[name] = (kind, help, list(samples))
+
+    lines = []
+    for name, (kind, help, samples) in merged.items():
+        lines.append(f"# HELP {name} {_escape(help)}")
+        lines.append(f"# TYPE {name} {kind}")
+        for sample, labels, value in samples:
+            if labels:
+                pairs = ",".join(
+                    f'{key}="{_escape(str(label))}"' for key, label in labels.items()
+                )
+                sample = f"{sample}{{{pairs}}}"
+            lines.append(f"{sample} {float(value)!r}")
+    return "\n".join(lines) + "\n"
+
+
+class LoopLagMonitor:
+    """
+    Measures how late a timer on loop fires, every interval seconds. A busy
+    loop shows up as lag, which is also how late every stanza and HTTP
+    request waiting on it is.
+    """
+
+    def __init__(self, loop, registry: Registry, name: str, interval: float = 0.5):
+        self.loop = loop
+        self.name = name
+        self.interval = interval
+        self.lag = registry.gauge(
+            "rwa_event_loop_lag_seconds",
+            "How late the last event loop timer fired",
+            ("loop",),
+        )
+        self.lags = registry.histogram(
+            "rwa_event_loop_lag_distribution_seconds",
+            "How late event loop timers fired",
+            ("loop",),
+        )
+        self._handle = None
+
+    def start(self):
+        self._expected = self.loop.time() + self.interval
+        self._handle = self.loop.call_at(self._expected, self._tick)
+
+    def stop(self):
+        if self._handle is not None:
+            self._handle.cancel()
+            self._handle = None
+
+    def _tick(self):
+        now = self.loop.time()
+        lag = max(0.0, now - self._expected)
+        self.lag.set(lag, self.name)
+        self.lags.observe(lag, self.name)
+        self._expected = now + self.interval
+        self._handle = self.loop.call_at(self._expected, self._tick)
+
+
+def track_outbound(registry: Registry, outbound):
+    # Exposes an OutboundQueue's own counters, read at scrape time
+    stats = outbound.stats
+    for key, name, kind, help in (
+        ("sent", "rwa_outbound_sent_total", "counter", "Chat messages sent"),
+        (
+            "dropped",
+            "rwa_outbound_dropped_total",
+            "counter",
+            "Chat messages dropped because the outbound queue was full",
+        ),
+        (
+            "pending",
+            "rwa_outbound_pending",
+            "gauge",
+            "Chat messages waiting to be sent",
+        ),
+        (
+            "oldest_wait",
+            "rwa_outbound_oldest_wait_seconds",
+            "gauge",
+            "Time the oldest waiting chat message has been queued",
+        ),
+        (
+            "max_delay",
+            "rwa_outbound_max_delay_seconds",
+            "gauge",
+            "Longest a chat message has waited in the queue",
+        ),
+    ):
+        registry.gauge(name, help, collect=lambda key=key: stats()[key], kind=kind)
+
+
+def track_sessions(registry: Registry, sessions):
+    # Health of a SessionPool's XMPP accounts, read at scrape time
+    registry.gauge(
+        "rwa_xmpp_session_up",
+        "Whether an XMPP account is connected and answering pings",
+        ("account",),
+        sessions.sessions_up,
+    )
+    registry.gauge(
+        "rwa_xmpp_failovers_total",
+        "Contacts moved to another account because theirs went down",
+        collect=lambda: sessions.failovers,
+        kind="counter",
+    )
+
+
+class HTTPMetrics:
+    """
+    ASGI middleware counting requests and timing them by endpoint function,
+    method and status.
+    """
+
+    def __init__(self, app, registry: Registry):
+        self.app = app
+        self.requests = registry.counter(
+            "rwa_http_requests_total",
+            "HTTP requests by endpoint, method and status",
+            ("endpoint", "method", "status"),
+        )
+        self.latency = registry.histogram(
+            "rwa_http_request_seconds",
+            "Time from an HTTP request arriving to its response being sent",
+            ("endpoint",),
+        )
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        started = time.perf_counter()
+        status = 500
+
+        async def send_with_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            # The router puts the matched endpoint into scope
+            endpoint = getattr(scope.get("endpoint"), "__name__", "unmatched")
+            self.requests.inc(endpoint, scope["method"], str(status))
+            self.latency.observe(time.perf_counter() - started, endpoint)
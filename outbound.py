@@ -0,0 +1,199 @@
+#!/usr/bin/env python3
+
+import asyncio
+import logging
+import time
+from collections import deque
+from typing import Deque, Dict
+
+from logs import log_event
+
+
+class OutboundQueue:
+    """
+    Queue for outgoing chat messages. Messages to one recipient go out in
+    the order they were queued, recipients with pending messages take turns,
+    and a global token bucket caps the send rate. Once max_pending messages
+    are waiting, new droppable ones (broadcast notices) are dropped, logged
+    and counted. Others, such as assignments and replies, are always queued,
+    as an auditor who misses one is left idle.
+    """
+
+    def __init__(
+        self,
+        send,
+        rate: float = 50.0,
+        burst: int = 100,
+        max_pending: int = 100000,
+        batch: int = 32,
+    ):
+        # send(mto, mbody, mtype) puts one message on the wire
+        self.send = send
+        self.rate = rate
+        self.burst = burst
+        self.max_pending = max_pending
+        self.batch = batch
+
+        self._queues: Dict[str, Deque] = {}
+        self._turns: Deque[str] = deque()
+        self._pending = 0
+        self._tokens = float(burst)
+        self._refilled = time.monotonic()
+        self._wakeup = asyncio.Event()
+        self._task = None
+
+        self.sent = 0
+        self.dropped = 0
+        self.high_watermark = 0
+        self.max_delay = 0.0
+
+    def put(self, mto: str, mbody: str, mtype: str = "chat", droppable=False):
+        if droppable and self._pending >= self.max_pending:
+            self.dropped += 1
+            log_event(
+                "outbound_dropped",
+                "Outbound queue full, message dropped",
+                logging.WARNING,
+                to=mto,
+                pending=self._pending,
+                dropped=self.dropped,
+            )
+            return False
+
+        queue = self._queues.get(mto)
+        if queue is None:
+            queue = self._queues[mto] = deque()
+            self._turns.append(mto)
+        queue.append((mbody, mtype, droppable, time.monotonic()))
+        self._pending += 1
+        self.high_watermark = max(self.high_watermark, self._pending)
+        self._wakeup.set()
+        return True
+
+    def pending(self):
+        return self._pending
+
+    def stats(self):
+        oldest = 0.0
+        if self._turns:
+            now = time.monotonic()
+            oldest = max(now - self._queues[mto][0][3] for mto in self._turns)
+        return {
+            "pending": self._pending,
+            "recipients": len(self._turns),
+            "sent": self.sent,
+            "dropped": self.dropped,
+            "high_watermark": self.high_watermark,
+            "oldest_wait": oldest,
+            "max_delay": self.max_delay,
+        }
+
+    def start(self, loop):
+        if self._task is None or self._task.done():
+            self._task = loop.create_task(self.run())
+
+    def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    def drain(self):
+        # Takes out every waiting message, in order per recipient, so they can
+        # be sent some other way
+        messages = [
+            (mto, mbody, mtype, droppable)
+            for mto in self._turns
+            for mbody, mtype, droppable, _ in self._queues[mto]
+        ]
+        self._queues.clear()
+        self._turns.clear()
+        self._pending = 0
+        return messages
+
+    def _refill(self):
+        now = time.monotonic()
+        if self.rate > 0:
+            self._tokens = min(
+                self.burst, self._tokens + (now - self._refilled) * self.rate
+            )
+        else:
+            self._tokens = float(self.batch)
+        self._refilled = now
+
+    def _send_next(self):
+        # Next recipient's turn, then to the back of the line if it has more
+        mto = self._turns.popleft()
+        queue = self._queues[mto]
+        mbody, mtype, _, queued = queue.popleft()
+        if queue:
+            self._turns.append(mto)
+        else:
+            del self._queues[mto]
+        self._pending -= 1
+        self.max_delay = max(self.max_delay, time.monotonic() - queued)
+        try:
+            self.send(mto, mbody, mtype)
+            self.sent += 1
+        except Exception:
+            logging.exception("Failed to send message to %s", mto)
+
+    async def run(self):
+        while True:
+            if self._pending == 0:
+                self._wakeup.clear()
+                await self._wakeup.wait()
+                continue
+
+            self._refill()
+            if self._tokens < 1:
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+                continue
+
+            for _ in range(min(int(self._tokens), self._pending, self.batch)):
+                self._send_next()
+                self._tokens -= 1
+
+            # Let inbound stanzas in between batches
+            await asyncio.sleep(0)
+
+
+class Reply:
+    """
+    Collects the lines replied to one inbound message and sends them as one
+    message, or as a few when they pass max_length characters.
+    """
+
+    def __init__(self, send, mto: str, mtype: str = "chat", max_length: int = 4000):
+        # send(mto, mbody, mtype) is normally RWABot.send_message
+        self.send = send
+        self.mto = mto
+        self.mtype = mtype
+        self.max_length = max_length
+        self.lines = []
+
+    def __call__(self, line):
+        self.lines.append(str(line))
+
+    def chunks(self):
+        chunk = []
+        length = 0
+        for line in self.lines:
+            # Lines longer than a whole message are cut up
+            while len(line) > self.max_length:
+                if chunk:
+                    yield "\n".join(chunk)
+                    chunk, length = [], 0
+                yield line[: self.max_length]
+                line = line[self.max_length :]
+            if chunk and length + 1 + len(line) > self.max_length:
+                yield "\n".join(chunk)
+                chunk, length = [], 0
+            length += len(line) + (1 if chunk else 0)
+            chunk.append(line)
+        if chunk:
+            yield "\n".join(chunk)
+
+    def flush(self):
+        for chunk in self.chunks():
+            self.send(mto=self.mto, mbody=chunk, mtype=self.mtype)
+        self.lines = []
@@ -0,0 +1,131 @@
+#!/usr/bin/env python3
+
+import cProfile
+import logging
+import os
+import sys
+import threading
+import time
+from collections import Counter
+
+PROFILE_MODES = ("sampling", "deterministic")
+DEFAULT_PROFILE_SECONDS = 30.0
+MAX_PROFILE_SECONDS = 300.0
+
+
+class Profiler:
+    """
+    Profiles the bot for a bounded window, turned on at runtime.
+
+    sampling       a thread records the stack of every other thread each
+                   interval seconds, written as collapsed stacks
+                   ("thread;outer;inner count" lines, as flamegraph tools take)
+    deterministic  cProfile around each call handed to call(), which the bot
+                   uses for stanza handlers and adapter calls, written as a
+                   pstats file
+
+    When off, the only cost to callers is checking active.
+    """
+
+    def __init__(self, loop, directory: str = ".", interval: float = 0.005):
+        self.loop = loop
+        self.directory = directory
+        self.interval = interval
+
+        # True while deterministic profiling is on
+        self.active = False
+        self.mode = None
+        self.path = None
+        self._profile = None
+        self._sampler = None
+        self._stopping = None
+        self._stacks = Counter()
+        self._stop_handle = None
+        self._done = None
+
+    def start(self, mode: str, seconds: float, done=None):
+        """
+        Starts profiling for seconds, after which the output is written and
+        done(path) is called. Returns the path it will be written to.
+        """
+        if self.mode is not None:
+            raise ValueError(f"Already profiling ({self.mode}) into {self.path}")
+        if mode not in PROFILE_MODES:
+            raise ValueError(f"Mode must be one of {', '.join(PROFILE_MODES)}")
+        if not 0 < seconds <= MAX_PROFILE_SECONDS:
+            raise ValueError(f"Seconds must be between 0 and {MAX_PROFILE_SECONDS}")
+
+        extension = "collapsed" if mode == "sampling" else "pstats"
+        stamp = time.strftime("%Y%m%d-%H%M%S")
+        self.path = os.path.join(
+            self.directory, f"rwa-{mode}-{os.getpid()}-{stamp}.{extension}"
+        )
+        self.mode = mode
+        self._done = done
+
+        if mode == "sampling":
+            self._stacks = Counter()
+            self._stopping = threading.Event()
+            self._sampler = threading.Thread(
+                target=self._sample, name="rwa-profiler", daemon=True
+            )
+            self._sampler.start()
+        else:
+            self._profile = cProfile.Profile()
+            self.active = True
+        self._stop_handle = self.loop.call_later(seconds, self.stop)
+        return self.path
+
+    def call(self, function, *args):
+        return self._profile.runcall(function, *args)
+
+    def stop(self):
+        # Ends the window early or on time, returns the path written or None
+        if self.mode is None:
+            return None
+        if self._stop_handle is not None:
+            self._stop_handle.cancel()
+            self._stop_handle = None
+
+        path, done = self.path, self._done
+        try:
+            if self.mode == "sampling":
+                self._stopping.set()
+                self._sampler.join()
+                self._sampler = None
+                with open(path, "w") as output:
+                    for stack, count in self._stacks.most_common():
+                        output.write(f"{stack} {count}\n")
+            else:
+                self.active = False
+                self._profile.dump_stats(path)
+                self._profile = None
+        except OSError:
+            logging.exception("Could not write profile to %s", path)
+            path = None
+        finally:
+            self.mode = None
+            self.path = None
+            self._done = None
+
+        if done is not None:
+            done(path)
+        return path
+
+    def _sample(self):
+        own = threading.get_ident()
+        while not self._stopping.wait(self.interval):
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident == own:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(
+                        f"{code.co_name} ({os.path.basename(code.co_filename)}"
+                        f":{code.co_firstlineno})"
+                    )
+                    frame = frame.f_back
+                stack.append(names.get(ident, str(ident)))
+                self._stacks[";".join(reversed(stack))] += 1
@@ -2,18 +2,36 @@
 
 
 import json
-from eth_abi import encode_abi
-from fastapi import FastAPI, Body
+from fastapi import FastAPI, Body, HTTPException
+from fastapi.responses import PlainTextResponse
+from typing import Optional
 import logging
 import asyncio
+import threading
 
 # import uvicorn
 from uvicorn import Config, Server
 
-from audit import Audits, Audit, AuditInit, Auditor, DataDumpRequest
+from audit import (
+    Audits,
+    Audit,
+    AuditInit,
+    Auditor,
+    DataDumpRequest,
+    PAGE_LIMIT,
+    encode_settlement,
+)
+from storage import SQLiteAuditStore
 from getpass import getpass
 from argparse import ArgumentParser
 from xmpp_interface import RWABot
+from adapter import LocalAdapter, ThreadedAdapter
+from jobs import SettlementJobs
+from profiling import DEFAULT_PROFILE_SECONDS
+from logs import log_event, setup_logging
+from metrics import CONTENT_TYPE, HTTPMetrics, LoopLagMonitor, Registry, render
+from sessions import read_accounts
+from shards import ShardRouter
 
 
 # from xmpp_interface import *
@@ -21,49 +39,251 @@ from xmpp_interface import RWABot
 
 app = FastAPI()
 
+# Metrics of the HTTP side, the bot keeps its own
+http_metrics = Registry()
+app.add_middleware(HTTPMetrics, registry=http_metrics)
+
+EMPTY_SETTLEMENT = "0x" + encode_settlement([], []).hex()
+
+# Set with --callback-url, see jobs.py
+jobs = None
+
 
 @app.post("/register_audit/")
 async def register_audit(payload: dict = Body(...)):
     audit_init = payload["data"]
-    print("Data unit stuff audit init")
-    print(audit_init)
-    audit = Audit(
-        name=audit_init["name"],
-        admin_jid=audit_init["admin_jid"],
-        bond=audit_init["bond"],
+    log_event(
+        "register_audit",
+        "Audit registration requested",
+        name=audit_init.get("name"),
+        admin_jid=audit_init.get("admin_jid"),
+        bond=audit_init.get("bond"),
+    )
+    return await adapter.register_audit(
+        {
+            "name": audit_init["name"],
+            "admin_jid": audit_init["admin_jid"],
+            "bond": audit_init["bond"],
+        }
+    )
+
+
+@app.post("/register_audits/")
+async def register_audits(payload: dict = Body(...)):
+    # {"data": {"audits": [{"name", "admin_jid", "bond", "items",
+    #   "number_of_audits_per_item", "slashing_ratio"}, ...]}}
+    batch = payload["data"]["audits"]
+    return {"data": {"results": await adapter.register_audits(batch)}}
+
+
+@app.get("/audits/{name}/items/")
+async def audit_items(name: str, cursor: int = 0, limit: int = PAGE_LIMIT):
+    page = await adapter.call(name, "items_page", name, cursor, limit)
+    if page is None:
+        raise HTTPException(status_code=404, detail="Audit not found")
+    return page
+
+
+@app.get("/audits/{name}/outstanding/")
+async def audit_outstanding(
+    name: str,
+    cursor: int = 0,
+    limit: int = PAGE_LIMIT,
+    auditor: Optional[str] = None,
+    item: Optional[int] = None,
+):
+    page = await adapter.call(
+        name, "outstanding_page", name, cursor, limit, auditor, item
     )
-    return xmpp.add_audit(audit)
+    if page is None:
+        raise HTTPException(status_code=404, detail="Audit not found")
+    return page
 
 
 @app.get("/clear_audits/")
 async def clear_audits():
-    xmpp.audits.clear()
+    await adapter.clear_audits()
+
+
+@app.get("/metrics")
+async def metrics():
+    # Prometheus text format, for scraping
+    families = http_metrics.collect() + await adapter.collect_metrics()
+    return PlainTextResponse(render(families), media_type=CONTENT_TYPE)
+
+
+@app.post("/profile/")
+async def profile(payload: dict = Body(...)):
+    # {"data": {"mode": "sampling"|"deterministic", "seconds": 30}}, every bot
+    # writes its own file and returns its path
+    request = payload["data"]
+    results = await adapter.start_profile(
+        request.get("mode", "sampling"),
+        request.get("seconds", DEFAULT_PROFILE_SECONDS),
+    )
+    return {"data": {"results": results}}
+
+
+@app.post("/profile/stop/")
+async def profile_stop():
+    return {"data": {"results": await adapter.stop_profile()}}
 
 
 @app.post("/data_dump/")
 async def data_dump(payload: dict = Body(...)):
     data_request = payload["data"]
-    addresses, amounts = xmpp.get_audit_outcome(data_request["name"])
+    name = data_request["name"]
+    job_id = payload.get("id")
 
-    bytedata = "0x" + encode_abi(["address[]", "uint16[]"], [addresses, amounts]).hex()
-    http_conclude_response = {"data": {"response": bytedata}}
+    # Job runs for audits that are not settled yet are answered pending and
+    # completed by a callback. The run is queued before asking, so a
+    # settlement landing meanwhile is not missed. Runs for audits the bot
+    # does not know would never be called back, so they are refused.
+    if jobs is not None and job_id is not None:
+        if not await adapter.has_audit(name):
+            raise HTTPException(status_code=404, detail="Audit not found")
+        jobs.add(name, job_id)
+    settlement = await adapter.get_settlement(name)
 
-    return http_conclude_response
+    if settlement is None:
+        if jobs is not None and job_id is not None:
+            return {"jobRunID": job_id, "pending": True}
+        # Without a callback, empty arrays as before
+        return {"data": {"response": EMPTY_SETTLEMENT}}
+    if jobs is not None and job_id is not None and not jobs.take(name, job_id):
+        # Already being sent to the callback
+        return {"jobRunID": job_id, "pending": True}
+    return {"data": settlement}
+
+
+@app.post("/data_dump/ack/")
+async def data_dump_ack(payload: dict = Body(...)):
+    # Called once the settlement has been delivered on chain, marks the audit
+    # COMPLETE. "hash" is optional and must match the served settlement.
+    data_request = payload["data"]
+    acknowledged = await adapter.acknowledge_settlement(
+        data_request["name"], data_request.get("hash")
+    )
+    return {"data": {"acknowledged": acknowledged}}
 
 
 if __name__ == "__main__":
 
-    logging.basicConfig(level=logging.INFO, format="%(levelname)-8s %(message)s")
+    parser = ArgumentParser(description="RWA External Adapter")
+    parser.add_argument(
+        "--db",
+        dest="db",
+        help="SQLite database to keep audits in across restarts",
+    )
+    parser.add_argument(
+        "--send-rate",
+        dest="send_rate",
+        type=float,
+        default=50.0,
+        help="Outgoing messages per second, 0 for no limit",
+    )
+    parser.add_argument(
+        "--send-burst",
+        dest="send_burst",
+        type=int,
+        default=100,
+        help="Outgoing messages that may be sent back to back",
+    )
+    parser.add_argument(
+        "--shards",
+        dest="shards",
+        type=int,
+        default=0,
+        help="Worker processes to spread audits over, 0 to run in this process",
+    )
+    parser.add_argument(
+        "--http-thread",
+        dest="http_thread",
+        action="store_true",
+        help="Run the bot on its own event loop in a second thread",
+    )
+    parser.add_argument(
+        "--profile-dir",
+        dest="profile_dir",
+        default=".",
+        help="Where profiles started with /profile/ or `profile` are written",
+    )
+    parser.add_argument(
+        "--accounts",
+        dest="accounts",
+        help="Extra bot accounts to spread chats over, one 'jid password' a line",
+    )
+    parser.add_argument(
+        "--callback-url",
+        dest="callback_url",
+        help="Where settlements of /data_dump/ job runs answered pending are POSTed",
+    )
+    options = parser.parse_args()
+
+    # JSON lines written by a background thread, see logs.py
+    log_listener = setup_logging(logging.INFO)
 
     args = {}
     args["jid"] = "botty@foxhole"
     args["password"] = "botty"
+    accounts = read_accounts(options.accounts) if options.accounts else ()
 
-    xmpp = RWABot(args["jid"], args["password"])
+    store = None
+    if options.shards > 0:
+        # Each worker keeps its own database, named after options.db
+        xmpp = adapter = ShardRouter(
+            args["jid"],
+            args["password"],
+            options.shards,
+            db=options.db,
+            send_rate=options.send_rate,
+            send_burst=options.send_burst,
+            profile_dir=options.profile_dir,
+            accounts=accounts,
+        )
+    else:
+        store = SQLiteAuditStore(options.db) if options.db else None
+        xmpp = RWABot(
+            args["jid"],
+            args["password"],
+            store=store,
+            send_rate=options.send_rate,
+            send_burst=options.send_burst,
+            profile_dir=options.profile_dir,
+            accounts=accounts,
+        )
+        adapter = LocalAdapter(xmpp)
 
     xmpp.connect()
 
-    config = Config(app=app, loop=xmpp.loop, port=8080)
+    if options.http_thread:
+        # HTTP requests are parsed and encoded on this thread's loop, only the
+        # Audits calls themselves run on the bot's loop
+        adapter = ThreadedAdapter(adapter, xmpp.loop)
+        bot_thread = threading.Thread(target=xmpp.loop.run_forever, daemon=True)
+        bot_thread.start()
+        http_loop = asyncio.new_event_loop()
+        LoopLagMonitor(http_loop, http_metrics, "http").start()
+    else:
+        http_loop = xmpp.loop
+
+    if options.callback_url:
+        jobs = SettlementJobs(http_loop, options.callback_url)
+        adapter.on_settled(jobs.settled)
+
+    config = Config(app=app, port=8080)
     server = Server(config)
 
-    xmpp.loop.run_until_complete(server.serve())
+    http_loop.run_until_complete(server.serve())
+    if jobs is not None:
+        http_loop.run_until_complete(jobs.close())
+
+    if options.http_thread:
+        xmpp.loop.call_soon_threadsafe(xmpp.loop.stop)
+        bot_thread.join()
+
+    if store is not None:
+        store.close()
+    if options.shards > 0:
+        xmpp.stop_workers()
+    log_listener.stop()
@@ -95,69 +95,64 @@ contract rwa is Ownable {
         bool answer;
     }
 
-    mapping(uint => CheckerItemReport[]) public itemToCheckers;
+    // Checks are handed out round robin: check number item * checksPerItem +
+    // slot goes to the next checker in checkerList. Nothing is stored when
+    // the project starts, the checker of a check is worked out when needed
+    // and only the responses are stored.
+    struct Response {
+        bool responded;
+        bool answer;
+    }
 
-    // event ItemCounterEvent(uint itemCounter);
-    // event ItemCheckIteratorEvent(uint itemCheckIterator);
-    // event CheckerIteratorEvent(uint checkerIterator);
-    event CIAssignment(uint item, uint itemSpot, uint checkerId);
+    mapping(uint => mapping(uint => Response)) responses;
+    uint public responseCount;
+
+    function checkerFor(uint _item, uint _slot) public view returns (uint) {
+        require(_item < numItems && _slot < checksPerItem, "No such check");
+        return (_item * checksPerItem + _slot) % checkerCounter;
+    }
+
+    // Same getter as when the reports were kept in an array per item
+    function itemToCheckers(uint _item, uint _slot)
+        external
+        view
+        returns (uint checkerId, bool responded, bool answer)
+    {
+        Response memory response = responses[_item][_slot];
+        return (checkerFor(_item, _slot), response.responded, response.answer);
+    }
 
     function startProject() external requireState(projectStatus.NotStarted) onlyOwner {
+        require(checkerCounter > 0, "No checkers applied");
         status = projectStatus.Running;
-        uint itemCounter;
-        uint checkerIterator;
-        uint itemCheckIterator;
-        CheckerItemReport memory tmp;
-        // Assign items to checkers
-        for (itemCounter = 0; itemCounter < numItems; itemCounter++ ) {
-            for (itemCheckIterator = 0; itemCheckIterator < checksPerItem; itemCheckIterator++ ){
-                tmp.checkerId = checkerIterator;
-                itemToCheckers[itemCounter].push(tmp);
-                emit CIAssignment(itemCounter, itemCheckIterator, checkerIterator);
-                checkerIterator += 1;
-                if (checkerIterator == checkerCounter) {
-                    checkerIterator = 0;
-                    }
-            }
-        }
         emit StatusChanged(status);
     }
 
     event itemStatusReported(CheckerItemReport item);
 
-    function report(uint _item, bool correct) external {
-        CheckerItemReport[] memory localCheckers = itemToCheckers[_item];
-        uint id = 0;
+    function report(uint _item, bool correct) external requireState(projectStatus.Running) {
+        require(walletPresent(msg.sender), "Checker not assigned to item");
+        uint checkerId = checkerToIdMap[msg.sender];
+        uint slot;
         bool found = false;
-        for (id = 0; id < localCheckers.length; id++){
-           if (checkerList[localCheckers[id].checkerId] == msg.sender) {
-               itemToCheckers[_item][id].responded = true;
-               itemToCheckers[_item][id].answer = correct;
-               found = true;
-               emit itemStatusReported(itemToCheckers[_item][id]);
+        for (slot = 0; slot < checksPerItem; slot++) {
+            if (checkerFor(_item, slot) == checkerId) {
+                Response storage response = responses[_item][slot];
+                if (!response.responded) {
+                    response.responded = true;
+                    responseCount += 1;
+                }
+                response.answer = correct;
+                found = true;
+                emit itemStatusReported(CheckerItemReport(checkerId, true, correct));
             }
         }
         require(found, "Checker not assigned to item");
     }
 
-
-    event MissingReport (CheckerItemReport item);
-
     function stopProject() external requireState(projectStatus.Running) onlyOwner {
-        uint itemIterator;
-        uint checkIterator;
-        bool cleared = true;
-        for (itemIterator=0; itemIterator < numItems && cleared; itemIterator++ ) {
-            for (checkIterator=0; checkIterator < checksPerItem  && cleared; checkIterator++) {
-                cleared = itemToCheckers[itemIterator][checkIterator].responded;
-                if (!cleared) {
-                    emit MissingReport(itemToCheckers[itemIterator][checkIterator]);
-                    require(cleared, "Report missing");
-                }
-            }
-        }
         // Check who needs to be paid how much and pay them
-        require(cleared, "Not all checks have been completed");
+        require(responseCount == numItems * checksPerItem, "Not all checks have been completed");
         status = projectStatus.Stopped;
         emit StatusChanged(status);
     }
@@ -175,7 +170,7 @@ contract rwa is Ownable {
         for (itemIterator=0; itemIterator < numItems; itemIterator++ ) {
             trueCount = 0;
             for (checkIterator=0; checkIterator < checksPerItem; checkIterator++) {
-                if (itemToCheckers[itemIterator][checkIterator].answer) {
+                if (responses[itemIterator][checkIterator].answer) {
                     trueCount += 1;
                 }
                 else {
@@ -207,8 +202,8 @@ contract rwa is Ownable {
 
         for (itemIterator=0; itemIterator < numItems; itemIterator++ ) {
             for (checkIterator=0; checkIterator < checksPerItem; checkIterator++) {
-                checkerId = itemToCheckers[itemIterator][checkIterator].checkerId;
-                answer = itemToCheckers[itemIterator][checkIterator].answer;
+                checkerId = checkerFor(itemIterator, checkIterator);
+                answer = responses[itemIterator][checkIterator].answer;
                 correct = (answer == itemOutcomes[itemIterator]);
                 checkerNumChecksTemp[checkerId] = checkerNumChecksTemp[checkerId] + 1;
                 if (correct) {
@@ -0,0 +1,368 @@
+import asyncio
+import json
+import sqlite3
+
+from scripts.event_stream import EventStream
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS sync (
+    contract TEXT PRIMARY KEY,
+    next_block INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS events (
+    contract TEXT NOT NULL,
+    block INTEGER NOT NULL,
+    log_index INTEGER NOT NULL,
+    tx_hash TEXT NOT NULL,
+    name TEXT NOT NULL,
+    args TEXT NOT NULL,
+    PRIMARY KEY (contract, block, log_index)
+);
+CREATE TABLE IF NOT EXISTS checkers (
+    contract TEXT NOT NULL,
+    block INTEGER NOT NULL,
+    log_index INTEGER NOT NULL,
+    checker_id INTEGER NOT NULL,
+    address TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS assignments (
+    contract TEXT NOT NULL,
+    block INTEGER NOT NULL,
+    log_index INTEGER NOT NULL,
+    item INTEGER NOT NULL,
+    slot INTEGER NOT NULL,
+    checker_id INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS reports (
+    contract TEXT NOT NULL,
+    block INTEGER NOT NULL,
+    log_index INTEGER NOT NULL,
+    item INTEGER,
+    checker_id INTEGER NOT NULL,
+    answer INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS statuses (
+    contract TEXT NOT NULL,
+    block INTEGER NOT NULL,
+    log_index INTEGER NOT NULL,
+    status INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS item_outcomes (
+    contract TEXT NOT NULL,
+    block INTEGER NOT NULL,
+    log_index INTEGER NOT NULL,
+    item INTEGER NOT NULL,
+    outcome INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS checker_outcomes (
+    contract TEXT NOT NULL,
+    block INTEGER NOT NULL,
+    log_index INTEGER NOT NULL,
+    item INTEGER NOT NULL,
+    checker_id INTEGER NOT NULL,
+    correct INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS events_by_name ON events (contract, name);
+CREATE INDEX IF NOT EXISTS checkers_by_id ON checkers (contract, checker_id);
+CREATE INDEX IF NOT EXISTS checkers_by_address ON checkers (contract, address);
+CREATE INDEX IF NOT EXISTS assignments_by_item ON assignments (contract, item);
+CREATE INDEX IF NOT EXISTS assignments_by_checker
+    ON assignments (contract, checker_id);
+CREATE INDEX IF NOT EXISTS reports_by_item ON reports (contract, item);
+CREATE INDEX IF NOT EXISTS reports_by_checker ON reports (contract, checker_id);
+CREATE INDEX IF NOT EXISTS statuses_by_block ON statuses (contract, block);
+CREATE INDEX IF NOT EXISTS statuses_by_status ON statuses (status);
+CREATE INDEX IF NOT EXISTS item_outcomes_by_item ON item_outcomes (contract, item);
+CREATE INDEX IF NOT EXISTS checker_outcomes_by_checker
+    ON checker_outcomes (contract, checker_id);
+"""
+
+# Tables that hold rows derived from events, dropped from a block on reorg
+TABLES = (
+    "events",
+    "checkers",
+    "assignments",
+    "reports",
+    "statuses",
+    "item_outcomes",
+    "checker_outcomes",
+)
+
+STATUS_NAMES = ("NotStarted", "Running", "Stopped", "Completed")
+
+
+class EventIndex:
+    """Keeps the events of an rwa contract in a local SQLite database.
+
+    Every event is stored as it was logged, and the ones that describe the
+    project are also written to tables indexed by item, checker and status,
+    so questions like "who checks item 7" or "how did checker 3 do" are local
+    queries rather than one view call per array element.
+
+    sync() reads from where the last run stopped up to the confirmed head.
+    Each block range is written in one transaction together with the block
+    to resume from, so an interrupted run neither skips nor repeats events.
+    """
+
+    def __init__(self, path, w3, contract, from_block=0, **stream_options):
+        self.w3 = w3
+        self.address = w3.toChecksumAddress(contract.address)
+        self.contract = w3.eth.contract(address=self.address, abi=contract.abi)
+        self.db = sqlite3.connect(path)
+        self.db.executescript(SCHEMA)
+
+        row = self.db.execute(
+            "SELECT next_block FROM sync WHERE contract = ?", (self.address,)
+        ).fetchone()
+        next_block = row[0] if row else from_block
+        self.stream = EventStream(w3, from_block=next_block, **stream_options)
+        self.stream.watch(contract)
+
+    def close(self):
+        self.db.close()
+
+    async def sync(self):
+        """Indexes everything up to the confirmed head, returns the number of
+        events stored"""
+        stored = 0
+        behind = True
+        while behind:
+            events, behind = await self.stream.poll(self.rewind)
+            await self.store(events)
+            stored += len(events)
+        return stored
+
+    async def follow(self):
+        """Keeps indexing as new blocks are confirmed, until stream.stop()"""
+        async for events in self.stream.batches(self.rewind):
+            await self.store(events)
+
+    def rewind(self, block):
+        # The chain reorganised, forget what was read from block on
+        with self.db:
+            for table in TABLES:
+                self.db.execute(
+                    f"DELETE FROM {table} WHERE contract = ? AND block >= ?",
+                    (self.address, block),
+                )
+            self.save_position(block)
+
+    def save_position(self, next_block):
+        self.db.execute(
+            "INSERT INTO sync (contract, next_block) VALUES (?, ?)"
+            " ON CONFLICT (contract) DO UPDATE SET next_block = excluded.next_block",
+            (self.address, next_block),
+        )
+
+    async def report_items(self, events):
+        # itemStatusReported does not say which item, report(_item, ...) does
+        loop = asyncio.get_running_loop()
+        items = {}
+        for event in events:
+            if event.event != "itemStatusReported":
+                continue
+            tx_hash = event.transactionHash
+            if tx_hash in items:
+                continue
+            tx = await loop.run_in_executor(None, self.w3.eth.get_transaction, tx_hash)
+            try:
+                _, params = self.contract.decode_function_input(tx["input"])
+                items[tx_hash] = params.get("_item")
+            except ValueError:
+                items[tx_hash] = None
+        return items
+
+    async def project_shape(self, events):
+        # (numItems, checksPerItem, checkerCounter) if the project started in
+        # these events. They cannot change once it has, so reading them at
+        # the head is the same as at the start.
+        if not any(
+            event.event == "StatusChanged" and event.args.newStatus == 1
+            for event in events
+        ) or any(event.event == "CIAssignment" for event in events):
+            return None
+        loop = asyncio.get_running_loop()
+        functions = self.contract.functions
+        return tuple(
+            [
+                await loop.run_in_executor(None, function().call)
+                for function in (
+                    functions.numItems,
+                    functions.checksPerItem,
+                    functions.checkerCounter,
+                )
+            ]
+        )
+
+    async def store(self, events):
+        items = await self.report_items(events)
+        shape = await self.project_shape(events)
+        # ItemOutcomeEvent is emitted once per item in item order
+        outcomes_in_tx = {}
+        with self.db:
+            for event in events:
+                self.store_event(event, items, outcomes_in_tx, shape)
+            self.save_position(self.stream.next_block)
+
+    def store_assignments(self, key, shape):
+        # The contract works out the checker of each check from its position
+        # instead of logging CIAssignment, the same round robin is stored here
+        num_items, checks_per_item, checker_counter = shape
+        self.db.executemany(
+            "INSERT INTO assignments VALUES (?, ?, ?, ?, ?, ?)",
+            (
+                key + (item, slot, (item * checks_per_item + slot) % checker_counter)
+                for item in range(num_items)
+                for slot in range(checks_per_item)
+            ),
+        )
+
+    def store_event(self, event, items, outcomes_in_tx, shape=None):
+        key = (self.address, event.blockNumber, event.logIndex)
+        args = event.args
+        self.db.execute(
+            "INSERT OR REPLACE INTO events VALUES (?, ?, ?, ?, ?, ?)",
+            key
+            + (
+                event.transactionHash.hex(),
+                event.event,
+                json.dumps(dict(args), default=str),
+            ),
+        )
+
+        if event.event == "CheckerApplied":
+            # checkerCounter has already been incremented for this checker
+            self.db.execute(
+                "INSERT INTO checkers VALUES (?, ?, ?, ?, ?)",
+                key + (args.checkerCounter - 1, args.checker),
+            )
+        elif event.event == "CIAssignment":
+            self.db.execute(
+                "INSERT INTO assignments VALUES (?, ?, ?, ?, ?, ?)",
+                key + (args.item, args.itemSpot, args.checkerId),
+            )
+        elif event.event == "itemStatusReported":
+            checker_id, _, answer = args.item
+            self.db.execute(
+                "INSERT INTO reports VALUES (?, ?, ?, ?, ?, ?)",
+                key + (items.get(event.transactionHash), checker_id, int(answer)),
+            )
+        elif event.event == "StatusChanged":
+            self.db.execute(
+                "INSERT INTO statuses VALUES (?, ?, ?, ?)", key + (args.newStatus,)
+            )
+            # Deployments from before checkerFor logged their assignments
+            logged = self.db.execute(
+                "SELECT 1 FROM assignments WHERE contract = ? LIMIT 1",
+                (self.address,),
+            ).fetchone()
+            if args.newStatus == 1 and shape is not None and logged is None:
+                self.store_assignments(key, shape)
+        elif event.event == "ItemOutcomeEvent":
+            item = outcomes_in_tx.get(event.transactionHash, 0)
+            outcomes_in_tx[event.transactionHash] = item + 1
+            self.db.execute(
+                "INSERT INTO item_outcomes VALUES (?, ?, ?, ?, ?)",
+                key + (item, int(args.itemOutcome)),
+            )
+        elif event.event == "CheckerOutcomeEvent":
+            self.db.execute(
+                "INSERT INTO checker_outcomes VALUES (?, ?, ?, ?, ?, ?)",
+                key + (args.itemId, args.checkerId, int(args.correct)),
+            )
+
+    def status(self):
+        row = self.db.execute(
+            "SELECT status FROM statuses WHERE contract = ?"
+            " ORDER BY block DESC, log_index DESC LIMIT 1",
+            (self.address,),
+        ).fetchone()
+        return STATUS_NAMES[row[0] if row else 0]
+
+    def checkers(self):
+        return self.db.execute(
+            "SELECT checker_id, address FROM checkers WHERE contract = ?"
+            " ORDER BY checker_id",
+            (self.address,),
+        ).fetchall()
+
+    def item_checks(self, item):
+        # (slot, checker id, address, last answer or None) for one item
+        return self.db.execute(
+            "SELECT a.slot, a.checker_id, c.address, (SELECT r.answer FROM reports r"
+            " WHERE r.contract = a.contract AND r.item = a.item"
+            " AND r.checker_id = a.checker_id"
+            " ORDER BY r.block DESC, r.log_index DESC LIMIT 1)"
+            " FROM assignments a LEFT JOIN checkers c"
+            " ON c.contract = a.contract AND c.checker_id = a.checker_id"
+            " WHERE a.contract = ? AND a.item = ? ORDER BY a.slot",
+            (self.address, item),
+        ).fetchall()
+
+    def checker_items(self, checker_id):
+        return [
+            item
+            for (item,) in self.db.execute(
+                "SELECT item FROM assignments WHERE contract = ? AND checker_id = ?"
+                " ORDER BY item, slot",
+                (self.address, checker_id),
+            )
+        ]
+
+    def missing_reports(self):
+        # (item, checker id) assigned but not reported yet
+        return self.db.execute(
+            "SELECT a.item, a.checker_id FROM assignments a"
+            " WHERE a.contract = ? AND NOT EXISTS (SELECT 1 FROM reports r"
+            " WHERE r.contract = a.contract AND r.item = a.item"
+            " AND r.checker_id = a.checker_id)"
+            " ORDER BY a.item, a.slot",
+            (self.address,),
+        ).fetchall()
+
+    def last_run(self, table):
+        # The results processing functions may be called more than once, only
+        # the rows of the last call count
+        row = self.db.execute(
+            f"SELECT MAX(block) FROM {table} WHERE contract = ?", (self.address,)
+        ).fetchone()
+        return row[0] if row[0] is not None else -1
+
+    def item_outcomes(self):
+        return [
+            bool(outcome)
+            for (outcome,) in self.db.execute(
+                "SELECT outcome FROM item_outcomes WHERE contract = ? AND block = ?"
+                " ORDER BY item",
+                (self.address, self.last_run("item_outcomes")),
+            )
+        ]
+
+    def checker_results(self):
+        # address -> (checks, correct), as audit_count and audits_aligned are
+        # kept per auditor in audit.py
+        return {
+            address: (checks, correct)
+            for address, checks, correct in self.db.execute(
+                "SELECT c.address, COUNT(o.item), COALESCE(SUM(o.correct), 0)"
+                " FROM checkers c LEFT JOIN checker_outcomes o"
+                " ON o.contract = c.contract AND o.checker_id = c.checker_id"
+                " AND o.block = ?"
+                " WHERE c.contract = ? GROUP BY c.checker_id ORDER BY c.checker_id",
+                (self.last_run("checker_outcomes"), self.address),
+            )
+        }
+
+
+def main():
+    from brownie import rwa, web3
+
+    contract = rwa[-1]
+    index = EventIndex("rwa_events.db", web3, contract, contract.tx.block_number)
+    stored = asyncio.run(index.sync())
+    print(f"Indexed {stored} events of {contract.address}, status {index.status()}")
+    for item, outcome in enumerate(index.item_outcomes()):
+        print(f"Item {item}: {outcome}")
+    for address, (checks, correct) in index.checker_results().items():
+        print(f"Checker {address}: {correct} of {checks} correct")
+    index.close()
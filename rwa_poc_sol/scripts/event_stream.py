@@ -0,0 +1,184 @@
+import asyncio
+import logging
+from collections import OrderedDict
+
+from eth_utils import event_abi_to_log_topic
+from web3.exceptions import BlockNotFound
+
+
+class EventStream:
+    """Follow events of several contracts over one shared log query.
+
+    Every poll asks the node for the logs of all watched contracts and events
+    in one eth_getLogs call over a range of at most batch_size blocks, so
+    catching up on history and following the head cost the same few requests
+    however many events are watched.
+
+    Only blocks at least `confirmations` deep are read. The hash of the last
+    block read is kept, and if the node later reports a different hash for it
+    the stream walks back to the last block that still matches, calls
+    on_reorg(first_block) and reads again from there, so consumers can drop
+    what they stored from that block on.
+
+    The poll interval starts at min_interval, doubles up to max_interval while
+    nothing new is found, and drops back as soon as events arrive or the
+    stream is behind the head.
+
+    Node calls are made from a worker thread, so other tasks on the event loop
+    keep running while they wait.
+    """
+
+    def __init__(
+        self,
+        w3,
+        confirmations=0,
+        batch_size=2000,
+        min_interval=0.5,
+        max_interval=8.0,
+        from_block=None,
+        history=64,
+    ):
+        self.w3 = w3
+        self.confirmations = confirmations
+        self.batch_size = batch_size
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.interval = min_interval
+        # None starts from the confirmed head at the first poll
+        self.next_block = from_block
+        self.history = history
+
+        # (address, topic) -> web3 ContractEvent used to decode the log
+        self._decoders = {}
+        # Last block of each range read -> (first block, hash of last block)
+        self._ranges = OrderedDict()
+        self._stopped = False
+
+    def watch(self, contract, *event_names):
+        """Watch events of a brownie or web3 contract, all of them if no names
+        are given"""
+        address = self.w3.toChecksumAddress(contract.address)
+        web3_contract = self.w3.eth.contract(address=address, abi=contract.abi)
+        for abi in web3_contract.abi:
+            if abi.get("type") != "event" or abi.get("anonymous"):
+                continue
+            if event_names and abi["name"] not in event_names:
+                continue
+            topic = event_abi_to_log_topic(abi)
+            self._decoders[(address, topic)] = web3_contract.events[abi["name"]]()
+        return self
+
+    def stop(self):
+        self._stopped = True
+
+    async def _call(self, function, *args):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(None, function, *args)
+
+    async def _block_hash(self, number):
+        # None once the chain no longer reaches the block, e.g. after a revert
+        try:
+            block = await self._call(self.w3.eth.get_block, number)
+        except BlockNotFound:
+            return None
+        return bytes(block["hash"])
+
+    async def _check_reorg(self, on_reorg):
+        # Walk back over the ranges read until one still ends in the same block
+        rewound = None
+        while self._ranges:
+            last, (first, block_hash) = next(reversed(self._ranges.items()))
+            if await self._block_hash(last) == block_hash:
+                break
+            self._ranges.popitem()
+            rewound = first
+        if rewound is None:
+            return
+        self.next_block = rewound
+        logging.warning(
+            "Chain reorganised, reading again from block %s", self.next_block
+        )
+        if on_reorg is not None:
+            on_reorg(self.next_block)
+
+    async def poll(self, on_reorg=None):
+        """Reads the next range of confirmed blocks. Returns the decoded events
+        in chain order and whether the stream is still behind the head."""
+        head = await self._call(lambda: self.w3.eth.block_number)
+        confirmed = head - self.confirmations
+        if self.next_block is None:
+            self.next_block = max(confirmed + 1, 0)
+        # Checked even when the height has not moved, a block can be replaced
+        # by another at the same height
+        await self._check_reorg(on_reorg)
+        if confirmed < self.next_block or not self._decoders:
+            return [], False
+
+        to_block = min(confirmed, self.next_block + self.batch_size - 1)
+        addresses = sorted({address for address, _ in self._decoders})
+        topics = sorted({topic for _, topic in self._decoders})
+        logs = await self._call(
+            self.w3.eth.get_logs,
+            {
+                "fromBlock": self.next_block,
+                "toBlock": to_block,
+                "address": addresses,
+                "topics": [["0x" + topic.hex() for topic in topics]],
+            },
+        )
+
+        events = []
+        for log in logs:
+            decoder = self._decoders.get((log["address"], bytes(log["topics"][0])))
+            if decoder is not None:
+                events.append(decoder.processLog(log))
+
+        self._ranges[to_block] = (self.next_block, await self._block_hash(to_block))
+        while len(self._ranges) > self.history:
+            self._ranges.popitem(last=False)
+        self.next_block = to_block + 1
+        return events, to_block < confirmed
+
+    async def batches(self, on_reorg=None):
+        """Yields the events of each poll, possibly none, until stop() is
+        called"""
+        while not self._stopped:
+            events, behind = await self.poll(on_reorg)
+            yield events
+            if behind:
+                self.interval = self.min_interval
+                continue
+            if events:
+                self.interval = self.min_interval
+            else:
+                self.interval = min(self.interval * 2, self.max_interval)
+            await asyncio.sleep(self.interval)
+
+    async def events(self, on_reorg=None):
+        """Yields events as they are confirmed until stop() is called"""
+        async for events in self.batches(on_reorg):
+            for event in events:
+                yield event
+
+    async def run(self, handler, on_reorg=None):
+        """Calls handler(event) for every event, awaiting it if it is a
+        coroutine function"""
+        async for event in self.events(on_reorg):
+            result = handler(event)
+            if asyncio.iscoroutine(result):
+                await result
+
+
+async def wait_for_event(brownie_contract, event, w3, timeout=200, **options):
+    """Waits for the next `event` from a contract, or returns None after
+    timeout seconds"""
+    stream = EventStream(w3, **options).watch(brownie_contract, event)
+
+    async def first():
+        async for event_response in stream.events():
+            return event_response
+
+    try:
+        return await asyncio.wait_for(first(), timeout)
+    except asyncio.TimeoutError:
+        return None
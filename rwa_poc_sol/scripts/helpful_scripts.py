@@ -9,7 +9,9 @@ from brownie import (
     Contract,
     web3,
 )
-import time
+import asyncio
+
+from scripts.event_stream import wait_for_event
 
 NON_FORKED_LOCAL_BLOCKCHAIN_ENVIRONMENTS = ["hardhat", "development", "ganache"]
 LOCAL_BLOCKCHAIN_ENVIRONMENTS = NON_FORKED_LOCAL_BLOCKCHAIN_ENVIRONMENTS + [
@@ -119,9 +121,12 @@ def deploy_mocks(decimals=DECIMALS, initial_value=INITIAL_VALUE):
     print("Mocks Deployed!")
 
 
-def listen_for_event(brownie_contract, event, timeout=200, poll_interval=2):
+def listen_for_event(
+    brownie_contract, event, timeout=200, poll_interval=2, confirmations=0
+):
     """Listen for an event to be fired from a contract.
     We are waiting for the event to return, so this function is blocking.
+    To follow several events without blocking, use scripts.event_stream.
 
     Args:
         brownie_contract ([brownie.network.contract.ProjectContract]):
@@ -132,21 +137,26 @@ def listen_for_event(brownie_contract, event, timeout=200, poll_interval=2):
         timeout (int, optional): The max amount in seconds you'd like to
         wait for that event to fire. Defaults to 200 seconds.
 
-        poll_interval ([int]): How often to call your node to check for events.
+        poll_interval ([int]): How often to call your node to check for events
+        while they keep coming. Backs off while nothing happens.
         Defaults to 2 seconds.
+
+        confirmations (int, optional): How many blocks deep the event must be.
+        Defaults to 0, as local chains only mine when sent a transaction.
     """
-    web3_contract = web3.eth.contract(
-        address=brownie_contract.address, abi=brownie_contract.abi
+    event_response = asyncio.run(
+        wait_for_event(
+            brownie_contract,
+            event,
+            web3,
+            timeout=timeout,
+            min_interval=poll_interval,
+            max_interval=max(poll_interval, 8),
+            confirmations=confirmations,
+        )
     )
-    start_time = time.time()
-    current_time = time.time()
-    event_filter = web3_contract.events[event].createFilter(fromBlock="latest")
-    while current_time - start_time < timeout:
-        for event_response in event_filter.get_new_entries():
-            if event in event_response.event:
-                print("Found event!")
-                return event_response
-        time.sleep(poll_interval)
-        current_time = time.time()
-    print("Timeout reached, no event found.")
-    return {"event": None}
+    if event_response is None:
+        print("Timeout reached, no event found.")
+        return {"event": None}
+    print("Found event!")
+    return event_response
@@ -1,6 +1,7 @@
+import asyncio
 import time
 import pytest
-from brownie import VRFConsumer, convert, network, config, exceptions
+from brownie import VRFConsumer, chain, convert, network, config, exceptions, web3
 from scripts.helpful_scripts import (
     get_account,
     get_contract,
@@ -8,7 +9,15 @@ from scripts.helpful_scripts import (
     fund_with_link,
     listen_for_event,
 )
-from scripts.deploy import deploy_contract, deploy_with_users, do_reports
+from scripts.deploy import (
+    add_checkers,
+    cycle,
+    deploy_contract,
+    deploy_with_users,
+    do_reports,
+)
+from scripts.event_index import EventIndex
+from scripts.event_stream import EventStream
 import pytest
 
 
@@ -97,3 +106,173 @@ def test_stopping_project_with_repots_done():
     tx = contract.stopProject()
     # Assert
     assert contract.status() == 2
+
+
+def test_checkers_assigned_round_robin():
+    # Arrange
+    contract = deploy_with_users()
+    checks = config["checks_per_item"]
+    # Act
+    contract.startProject()
+    # Assert
+    for item in range(contract.numItems()):
+        for slot in range(checks):
+            assert contract.checkerFor(item, slot) == (item * checks + slot) % 3
+    with pytest.raises(exceptions.VirtualMachineError):
+        contract.checkerFor(contract.numItems(), 0)
+
+
+def test_start_project_cost_does_not_grow_with_items():
+    # Arrange
+    small = deploy_contract()
+    add_checkers(small)
+    small.setItems(3)
+    large = deploy_contract()
+    add_checkers(large)
+    large.setItems(100000)
+    # Act
+    small_tx = small.startProject()
+    large_tx = large.startProject()
+    # Assert
+    assert large_tx.gas_used == small_tx.gas_used
+
+
+def test_report_from_checker_not_assigned_to_item():
+    # Arrange
+    contract = deploy_contract()
+    add_checkers(contract, 4)
+    contract.setItems(1)
+    contract.startProject()
+    # Act
+    # Assert, item 0 is checked by checkers 0, 1 and 2
+    with pytest.raises(exceptions.VirtualMachineError):
+        contract.report(0, True, {"from": get_account(4)})
+
+
+def test_report_covers_every_slot_of_a_checker():
+    # Arrange, two checkers share the three checks of each item
+    contract = deploy_contract()
+    add_checkers(contract, 2)
+    contract.setItems(1)
+    contract.startProject()
+    # Act
+    contract.report(0, True, {"from": get_account(1)})
+    # Assert
+    assert contract.itemToCheckers(0, 0) == (0, True, True)
+    assert contract.itemToCheckers(0, 1) == (1, False, False)
+    assert contract.itemToCheckers(0, 2) == (0, True, True)
+    assert contract.responseCount() == 2
+    with pytest.raises(exceptions.VirtualMachineError):
+        contract.stopProject()
+    contract.report(0, False, {"from": get_account(2)})
+    contract.stopProject()
+    assert contract.status() == 2
+
+
+def test_event_stream_reads_events_of_several_kinds_in_order():
+    # Arrange
+    contract = deploy_contract()
+    first_block = contract.tx.block_number
+    add_checkers(contract)
+    contract.setItems(3)
+    contract.startProject()
+    do_reports(contract, True)
+    stream = EventStream(web3, from_block=first_block, batch_size=2).watch(
+        contract, "CheckerApplied", "itemStatusReported", "StatusChanged"
+    )
+
+    # Act
+    async def read_all():
+        events = []
+        behind = True
+        while behind:
+            batch, behind = await stream.poll()
+            events.extend(batch)
+        return events
+
+    events = asyncio.run(read_all())
+
+    # Assert
+    names = [event.event for event in events]
+    assert names[:4] == ["CheckerApplied"] * 3 + ["StatusChanged"]
+    assert names[4:] == ["itemStatusReported"] * 3 * config["checks_per_item"]
+    assert events[0].args.checker == get_account(1)
+
+
+def test_event_stream_notices_a_reorg_at_the_same_height():
+    # Arrange
+    contract = deploy_contract()
+    stream = EventStream(web3, from_block=contract.tx.block_number).watch(contract)
+    reorgs = []
+    chain.snapshot()
+    chain.mine()
+    asyncio.run(stream.poll(reorgs.append))
+    height = web3.eth.block_number
+
+    # Act: the last block read is replaced by another one at the same height
+    chain.revert()
+    chain.mine(timestamp=chain.time() + 60)
+    assert web3.eth.block_number == height
+    asyncio.run(stream.poll(reorgs.append))
+
+    # Assert
+    assert reorgs == [contract.tx.block_number]
+    assert stream.next_block == height + 1
+
+
+def test_event_stream_rewinds_when_the_chain_gets_shorter():
+    # Arrange
+    contract = deploy_contract()
+    stream = EventStream(web3, from_block=contract.tx.block_number).watch(contract)
+    reorgs = []
+    chain.snapshot()
+    chain.mine(2)
+    asyncio.run(stream.poll(reorgs.append))
+
+    # Act: the blocks read are gone and the head is below them
+    chain.revert()
+    asyncio.run(stream.poll(reorgs.append))
+
+    # Assert
+    assert reorgs == [contract.tx.block_number]
+    assert stream.next_block == web3.eth.block_number + 1
+
+
+def test_event_index_matches_contract_state(tmp_path):
+    # Arrange
+    contract, tx = cycle()
+    path = tmp_path / "events.db"
+    index = EventIndex(path, web3, contract, contract.tx.block_number)
+
+    # Act
+    asyncio.run(index.sync())
+
+    # Assert
+    assert index.status() == "Stopped"
+    assert [address for _, address in index.checkers()] == [
+        contract.checkerList(i) for i in range(contract.checkerCounter())
+    ]
+    for item in range(contract.numItems()):
+        checks = index.item_checks(item)
+        for slot, checker_id, _, answer in checks:
+            assert (checker_id, True, bool(answer)) == contract.itemToCheckers(
+                item, slot
+            )
+    assert index.missing_reports() == []
+    assert index.item_outcomes() == [
+        contract.itemOutcomes(item) for item in range(contract.numItems())
+    ]
+    results = index.checker_results()
+    for checker_id, address in index.checkers():
+        assert results[address] == (
+            contract.checkerNumChecks(checker_id),
+            contract.checkerScore(checker_id),
+        )
+    index.close()
+
+    # Resumes where it stopped
+    contract.completeProject()
+    index = EventIndex(path, web3, contract, contract.tx.block_number)
+    assert asyncio.run(index.sync()) == 1
+    assert index.status() == "Completed"
+    index.close()
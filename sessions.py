@@ -0,0 +1,212 @@
+#!/usr/bin/env python3
+
+import asyncio
+import logging
+from typing import Dict
+
+import slixmpp
+from slixmpp.exceptions import IqError, IqTimeout
+
+from hashring import HashRing
+from logs import log_event
+from outbound import OutboundQueue
+
+
+def read_accounts(path: str):
+    # "jid password" per line, blank lines and # comments skipped
+    accounts = []
+    with open(path) as lines:
+        for line in lines:
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+            jid, _, password = line.partition(" ")
+            accounts.append((jid, password.strip()))
+    return accounts
+
+
+class PoolSession(slixmpp.ClientXMPP):
+    """An extra bot account, its stanzas are handled by the pool's owner"""
+
+    def __init__(self, jid, password, loop):
+        slixmpp.ClientXMPP.__init__(self, jid, password)
+        self.loop = loop
+        self.add_event_handler("session_start", self.start)
+
+    async def start(self, event):
+        self.send_presence()
+        await self.get_roster()
+
+    def send_now(self, mto, mbody, mtype):
+        self.send_message(mto=mto, mbody=mbody, mtype=mtype)
+
+
+class SessionPool:
+    """
+    Bot accounts sharing the chat traffic. Each has its own outbound queue,
+    as servers rate limit per account. A contact is sent to from the account
+    their jid hashes to on the ring, or the one they last wrote to, and stays
+    on it so a conversation keeps one account.
+
+    Accounts are pinged every check_interval seconds. One that disconnects or
+    does not answer is taken out of use and reconnected, its waiting messages
+    and contacts move to the next live account on the ring.
+    """
+
+    def __init__(
+        self,
+        handler,
+        rate: float = 50.0,
+        burst: int = 100,
+        max_pending: int = 100000,
+        check_interval: float = 30.0,
+        ping_timeout: float = 10.0,
+        retry_delay: float = 5.0,
+    ):
+        # handler(msg) for inbound stanzas on every account
+        self.handler = handler
+        self.rate = rate
+        self.burst = burst
+        self.max_pending = max_pending
+        self.check_interval = check_interval
+        self.ping_timeout = ping_timeout
+        self.retry_delay = retry_delay
+
+        self.sessions: Dict[str, slixmpp.ClientXMPP] = {}
+        self.queues: Dict[str, OutboundQueue] = {}
+        self.ring = HashRing(())
+        # Contact jid -> account jid
+        self.sticky: Dict[str, str] = {}
+        self.up = set()
+        self.failovers = 0
+        self.closing = False
+        self._checker = None
+
+    def add(self, session, queue: OutboundQueue = None):
+        """
+        Adds an account, sending through queue if given. Returns its queue.
+        The first account added is the owner's own session.
+        """
+        account = session.boundjid.bare
+        if queue is None:
+            queue = OutboundQueue(
+                session.send_now,
+                rate=self.rate,
+                burst=self.burst,
+                max_pending=self.max_pending,
+            )
+        self.sessions[account] = session
+        self.queues[account] = queue
+        self.ring = HashRing(self.sessions)
+
+        session.register_plugin("xep_0199")
+        session.add_event_handler("message", lambda msg: self.received(account, msg))
+        session.add_event_handler("session_start", lambda _: self.mark_up(account))
+        session.add_event_handler("disconnected", lambda _: self.disconnected(account))
+        return queue
+
+    def connect(self, *args, **kwargs):
+        # Every account but the first, which connects itself
+        for session in list(self.sessions.values())[1:]:
+            session.connect(*args, **kwargs)
+
+    def stop(self):
+        self.closing = True
+        if self._checker is not None:
+            self._checker.cancel()
+            self._checker = None
+        for queue in self.queues.values():
+            queue.stop()
+
+    def received(self, account: str, msg):
+        if msg["type"] in ("chat", "normal"):
+            # Replies go out from the account the contact wrote to
+            self.sticky[msg["from"].bare] = account
+        self.handler(msg)
+
+    def session_for(self, jid: str):
+        account = self.sticky.get(jid)
+        if account in self.up:
+            return account
+        live = next((node for node in self.ring.walk(jid) if node in self.up), None)
+        if live is None:
+            # Nothing connected, wait on the account the contact had
+            return account or self.ring.lookup(jid)
+        if account is not None:
+            self.failovers += 1
+        self.sticky[jid] = live
+        return live
+
+    def put(self, mto: str, mbody: str, mtype: str = "chat", droppable=False):
+        queue = self.queues[self.session_for(mto)]
+        return queue.put(mto, mbody, mtype, droppable)
+
+    def mark_up(self, account: str):
+        self.up.add(account)
+        queue = self.queues[account]
+        queue.start(self.sessions[account].loop)
+        if self._checker is None:
+            self._checker = self.sessions[account].loop.create_task(self.check())
+        log_event("xmpp_session_up", "XMPP account connected", account=account)
+
+    def mark_down(self, account: str, reason: str):
+        # Returns whether the account was up
+        if account not in self.up:
+            return False
+        self.up.discard(account)
+        queue = self.queues[account]
+        queue.stop()
+        log_event(
+            "xmpp_session_down",
+            "XMPP account lost",
+            logging.WARNING,
+            account=account,
+            reason=reason,
+            pending=queue.pending(),
+        )
+        if self.up:
+            for message in queue.drain():
+                self.put(*message)
+        return True
+
+    def disconnected(self, account: str):
+        # Accounts taken down by a failed ping are already reconnecting
+        if not self.mark_down(account, "disconnected") or self.closing:
+            return
+        session = self.sessions[account]
+        session.loop.call_later(self.retry_delay, session.connect)
+
+    async def check(self):
+        while True:
+            await asyncio.sleep(self.check_interval)
+            await asyncio.gather(*(self.ping(account) for account in list(self.up)))
+
+    async def ping(self, account: str):
+        session = self.sessions[account]
+        try:
+            await session.plugin["xep_0199"].ping(timeout=self.ping_timeout)
+        except (IqError, IqTimeout):
+            if self.mark_down(account, "ping timeout"):
+                session.reconnect(0.0, "Ping timeout")
+
+    def stats(self):
+        # The outbound queues of all accounts together, see OutboundQueue.stats
+        totals = {
+            "pending": 0,
+            "recipients": 0,
+            "sent": 0,
+            "dropped": 0,
+            "high_watermark": 0,
+            "oldest_wait": 0.0,
+            "max_delay": 0.0,
+        }
+        for queue in self.queues.values():
+            for key, value in queue.stats().items():
+                if key in ("high_watermark", "oldest_wait", "max_delay"):
+                    totals[key] = max(totals[key], value)
+                else:
+                    totals[key] += value
+        return totals
+
+    def sessions_up(self):
+        return {(account,): int(account in self.up) for account in self.sessions}
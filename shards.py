@@ -0,0 +1,292 @@
+#!/usr/bin/env python3
+
+import asyncio
+import itertools
+import logging
+import multiprocessing
+import time
+
+import slixmpp
+
+from adapter import AuditsAdapter
+from hashring import HashRing
+from logs import setup_logging
+from metrics import (
+    LoopLagMonitor,
+    Registry,
+    track_outbound,
+    track_sessions,
+    with_labels,
+)
+from outbound import OutboundQueue
+from sessions import PoolSession, SessionPool
+from storage import SQLiteAuditStore
+from xmpp_interface import RWABot
+
+
+class ShardBot(RWABot):
+    """
+    RWABot running in a worker process. It has no XMPP session of its own:
+    stanzas arrive from the router over conn and outgoing messages go back
+    the same way. Audit names and the jids that become routable to this shard
+    are reported so the router can send their later stanzas here.
+    """
+
+    def __init__(self, jid, conn, store=None, profile_dir="."):
+        RWABot.__init__(self, jid, "", store=store, profile_dir=profile_dir)
+        self.conn = conn
+
+    def track_outbound_metrics(self):
+        # Messages go out through the router's queue, which it reports itself
+        pass
+
+    def send_message(
+        self, mto, mbody, msubject=None, mtype=None, droppable=False, **kwargs
+    ):
+        self.conn.send(("send", str(mto), mbody, mtype or "chat", droppable))
+
+    def add_audit(self, audit):
+        result = RWABot.add_audit(self, audit)
+        if result == 200:
+            self.conn.send(("audit", audit.name))
+            self.conn.send(("route", audit.admin_jid))
+        return result
+
+    def register_auditor(self, audit, auditor):
+        RWABot.register_auditor(self, audit, auditor)
+        self.conn.send(("route", auditor.jid))
+
+    def settlement_ready(self, audit):
+        settlement = {"response": audit.settlement, "hash": audit.settlement_hash}
+        self.conn.send(("settled", audit.name, settlement))
+
+    def report_routes(self):
+        # Loaded audits, and active ones still only in the store
+        for name in itertools.chain(self.audits, getattr(self.audits, "stored", ())):
+            self.conn.send(("audit", name))
+        for jid in itertools.chain(self._admin_index, self._jid_index):
+            self.conn.send(("route", jid))
+
+    def receive(self):
+        while self.conn.poll():
+            kind, *args = self.conn.recv()
+            match kind:
+                case "stop":
+                    # run_worker closes the store once the loop is stopped
+                    self.loop.stop()
+                    return
+                case "stanza":
+                    jid, body, mtype = args
+                    msg = self.make_message(
+                        mto=self.bot_jid, mbody=body, mtype=mtype, mfrom=jid
+                    )
+                    self.message(msg)
+                case "call":
+                    request, method, method_args = args
+                    try:
+                        result = self.profiled(method, *method_args)
+                        self.conn.send(("result", request, True, result))
+                    except Exception as error:
+                        logging.exception("Shard call %s failed", method)
+                        self.conn.send(("result", request, False, repr(error)))
+
+
+def run_worker(conn, shard: int, jid: str, db=None, profile_dir="."):
+    log_listener = setup_logging(logging.INFO, shard=shard)
+    asyncio.set_event_loop(asyncio.new_event_loop())
+    store = SQLiteAuditStore(db) if db else None
+    bot = ShardBot(jid, conn, store=store, profile_dir=profile_dir)
+    bot.report_routes()
+    bot.loop.add_reader(conn.fileno(), bot.receive)
+    try:
+        bot.loop.run_forever()
+    finally:
+        if store is not None:
+            store.close()
+        log_listener.stop()
+
+
+class ShardRouter(AuditsAdapter, slixmpp.ClientXMPP):
+    """
+    Owns the XMPP session and hands each audit to one of a number of worker
+    processes, picked by consistent hashing of the audit name. An inbound
+    stanza whose body names an audit goes to that audit's shard. Any other
+    goes to every shard the sender is known in, or by the body for jids not
+    seen before. Outgoing messages from all shards share the router's
+    outbound queues, one per bot account.
+    """
+
+    def __init__(
+        self,
+        jid,
+        password,
+        shards: int,
+        db=None,
+        send_rate=50.0,
+        send_burst=100,
+        max_outbound=100000,
+        profile_dir=".",
+        accounts=(),
+    ):
+        slixmpp.ClientXMPP.__init__(self, jid, password)
+        self.add_event_handler("session_start", self.start)
+
+        self.outbound = OutboundQueue(
+            self.send_now,
+            rate=send_rate,
+            burst=send_burst,
+            max_pending=max_outbound,
+        )
+        # Extra accounts, as in RWABot
+        self.sessions = SessionPool(
+            self.message, rate=send_rate, burst=send_burst, max_pending=max_outbound
+        )
+        self.sessions.add(self, self.outbound)
+        for account_jid, account_password in accounts:
+            self.sessions.add(PoolSession(account_jid, account_password, self.loop))
+
+        self.metrics = Registry()
+        track_outbound(self.metrics, self.sessions)
+        track_sessions(self.metrics, self.sessions)
+        self.loop_lag = LoopLagMonitor(self.loop, self.metrics, "router")
+        self.loop_lag.start()
+
+        self.ring = HashRing(range(shards))
+        self.settlement_callbacks = []
+        # Jid -> shards where it is an admin or auditor
+        self.routes = {}
+        self.audit_names = set()
+        self._requests = {}
+        self._request_ids = itertools.count()
+
+        context = multiprocessing.get_context("spawn")
+        self.workers = []
+        for shard in range(shards):
+            conn, child = context.Pipe()
+            process = context.Process(
+                target=run_worker,
+                args=(
+                    child,
+                    shard,
+                    jid,
+                    f"{db}.{shard}" if db else None,
+                    profile_dir,
+                ),
+                daemon=True,
+            )
+            process.start()
+            self.loop.add_reader(conn.fileno(), self.receive, shard)
+            self.workers.append((process, conn))
+
+    async def start(self, event):
+        self.send_presence()
+        await self.get_roster()
+
+    def connect(self, *args, **kwargs):
+        self.sessions.connect(*args, **kwargs)
+        return slixmpp.ClientXMPP.connect(self, *args, **kwargs)
+
+    def send_now(self, mto, mbody, mtype):
+        slixmpp.ClientXMPP.send_message(self, mto=mto, mbody=mbody, mtype=mtype)
+
+    def shards_for_jid(self, jid: str, body: str):
+        if body in self.audit_names:
+            # Joining an audit, wherever else the jid is known
+            return [self.ring.lookup(body)]
+        shards = self.routes.get(jid)
+        if shards:
+            return sorted(shards)
+        # New user, the body should name the audit they want to join
+        return [self.ring.lookup(body)]
+
+    def message(self, msg):
+        if msg["type"] in ("chat", "normal"):
+            jid = msg["from"].bare
+            for shard in self.shards_for_jid(jid, msg["body"].strip()):
+                self.workers[shard][1].send(("stanza", jid, msg["body"], msg["type"]))
+
+    def receive(self, shard: int):
+        conn = self.workers[shard][1]
+        while conn.poll():
+            kind, *args = conn.recv()
+            match kind:
+                case "send":
+                    self.sessions.put(*args)
+                case "audit":
+                    self.audit_names.add(args[0])
+                case "route":
+                    self.routes.setdefault(args[0], set()).add(shard)
+                case "settled":
+                    for callback in self.settlement_callbacks:
+                        callback(*args)
+                case "result":
+                    request, ok, value = args
+                    future = self._requests.pop(request, None)
+                    if future is None or future.done():
+                        continue
+                    if ok:
+                        future.set_result(value)
+                    else:
+                        future.set_exception(RuntimeError(value))
+
+    async def request(self, shard: int, method: str, *args):
+        request = next(self._request_ids)
+        future = self.loop.create_future()
+        self._requests[request] = future
+        self.workers[shard][1].send(("call", request, method, args))
+        return await future
+
+    async def call(self, audit_name: str, method: str, *args):
+        return await self.request(self.ring.lookup(audit_name), method, *args)
+
+    async def broadcast(self, method: str, *args):
+        return await asyncio.gather(
+            *(self.request(shard, method, *args) for shard in range(len(self.workers)))
+        )
+
+    async def scatter(self, audit_names, method: str, rows: list):
+        groups = {}
+        for row, name in enumerate(audit_names):
+            groups.setdefault(self.ring.lookup(name), []).append(row)
+        replies = await asyncio.gather(
+            *(
+                self.request(shard, method, [rows[row] for row in group])
+                for shard, group in groups.items()
+            )
+        )
+        results = [None] * len(rows)
+        for group, reply in zip(groups.values(), replies):
+            for row, result in zip(group, reply):
+                results[row] = result
+        return results
+
+    def on_settled(self, callback):
+        self.settlement_callbacks.append(callback)
+
+    async def collect_metrics(self):
+        families = self.metrics.collect()
+        for shard, shard_families in enumerate(await self.broadcast("collect_metrics")):
+            families.extend(with_labels(shard_families, shard=str(shard)))
+        return families
+
+    async def clear_audits(self):
+        await self.broadcast("clear_audits")
+        self.routes.clear()
+        self.audit_names.clear()
+
+    def stop_workers(self, timeout: float = 10.0):
+        # Workers write out their group commits before exiting, those that
+        # do not exit within timeout seconds are killed
+        for process, conn in self.workers:
+            self.loop.remove_reader(conn.fileno())
+            try:
+                conn.send(("stop",))
+            except OSError:
+                pass
+        deadline = time.monotonic() + timeout
+        for process, conn in self.workers:
+            process.join(max(0.0, deadline - time.monotonic()))
+            if process.is_alive():
+                logging.warning("Shard worker %s did not stop, killing it", process.pid)
+                process.terminate()
+                process.join()
@@ -0,0 +1,511 @@
+#!/usr/bin/env python3
+
+import logging
+import sqlite3
+from typing import Dict, Optional
+
+import numpy as np
+
+from audit import State, AuditorState, AssignmentMode, Auditor, Audit
+
+
+class AuditStore:
+    """
+    Storage backend for Audits. This base class keeps nothing, so audits only
+    live in memory. Durable backends override the methods below.
+    """
+
+    def attach(self, loop):
+        # Event loop used to schedule group commits
+        pass
+
+    def registry(self):
+        return AuditRegistry(self)
+
+    def active_audits(self):
+        # Names of stored audits that are not COMPLETE
+        return set()
+
+    def load_routes(self):
+        # (jid -> audit name, admin_jid -> audit name) for active audits
+        return {}, {}
+
+    def pending_assignment(self):
+        # Names of stored audits whose inspections were still being built
+        return set()
+
+    def timed_audits(self):
+        # Names of stored AUDITING audits with an inspection timeout
+        return set()
+
+    def load_audit(self, name: str) -> Optional[Audit]:
+        return None
+
+    def has_audit(self, name: str):
+        # Whether an audit of this name is stored, COMPLETE or not
+        return False
+
+    def load_settlement(self, name: str):
+        # Settlement of an audit that is not loaded, see Audits.get_settlement
+        return None
+
+    def settled(self, name: str, settlement_hash=None):
+        # Whether a stored audit is COMPLETE, with this settlement if given
+        return False
+
+    def track(self, audit: Audit):
+        # Start tracking a new audit, everything in it counts as unsaved
+        pass
+
+    def save(self, audit: Audit):
+        pass
+
+    def delete_all(self):
+        pass
+
+    def flush(self):
+        pass
+
+    def close(self):
+        pass
+
+
+class AuditRegistry(dict):
+    """
+    Audits by name. Active audits in the store are only read from disk the
+    first time they are looked up, so iterating only covers loaded audits.
+    """
+
+    def __init__(self, store: AuditStore):
+        super().__init__()
+        self.store = store
+        self.stored = store.active_audits()
+        # Called with every audit read from the store
+        self.loaded = None
+
+    def __missing__(self, name):
+        audit = self.store.load_audit(name) if name in self.stored else None
+        if audit is None:
+            raise KeyError(name)
+        self.stored.discard(name)
+        self[name] = audit
+        if self.loaded is not None:
+            self.loaded(audit)
+        return audit
+
+    def __contains__(self, name):
+        return dict.__contains__(self, name) or name in self.stored
+
+    def get(self, name, default=None):
+        try:
+            return self[name]
+        except KeyError:
+            return default
+
+    def clear(self):
+        super().clear()
+        self.stored.clear()
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS audits (
+    name TEXT PRIMARY KEY,
+    admin_jid TEXT NOT NULL,
+    bond REAL NOT NULL,
+    inspection_reward REAL NOT NULL,
+    number_of_audits_per_item INTEGER NOT NULL,
+    slashing_ratio REAL NOT NULL,
+    state INTEGER NOT NULL,
+    assignment INTEGER NOT NULL DEFAULT 0,
+    assignment_pending INTEGER NOT NULL DEFAULT 0,
+    inspection_timeout REAL NOT NULL DEFAULT 0,
+    settlement TEXT,
+    settlement_hash TEXT
+);
+CREATE INDEX IF NOT EXISTS audits_by_state ON audits (state);
+
+CREATE TABLE IF NOT EXISTS items (
+    audit TEXT NOT NULL,
+    number INTEGER NOT NULL,
+    description TEXT NOT NULL,
+    PRIMARY KEY (audit, number)
+) WITHOUT ROWID;
+
+CREATE TABLE IF NOT EXISTS auditors (
+    audit TEXT NOT NULL,
+    jid TEXT NOT NULL,
+    addr TEXT NOT NULL,
+    state INTEGER NOT NULL,
+    current_inspection INTEGER,
+    audit_count INTEGER NOT NULL,
+    audits_aligned INTEGER NOT NULL,
+    compensation REAL NOT NULL,
+    timeouts INTEGER NOT NULL DEFAULT 0,
+    answer_time REAL,
+    parked INTEGER NOT NULL DEFAULT 0,
+    UNIQUE (audit, jid)
+);
+CREATE INDEX IF NOT EXISTS auditors_by_jid ON auditors (jid);
+
+CREATE TABLE IF NOT EXISTS inspections (
+    audit TEXT NOT NULL,
+    inspection_id INTEGER NOT NULL,
+    auditor INTEGER NOT NULL,
+    item INTEGER NOT NULL,
+    completed INTEGER NOT NULL,
+    finding INTEGER NOT NULL,
+    PRIMARY KEY (audit, inspection_id)
+) WITHOUT ROWID;
+
+CREATE TABLE IF NOT EXISTS timed_out (
+    audit TEXT NOT NULL,
+    jid TEXT NOT NULL,
+    item INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS timed_out_by_audit ON timed_out (audit);
+"""
+
+
+class SQLiteAuditStore(AuditStore):
+    """
+    Keeps audits in an SQLite database in WAL mode. Changes are collected per
+    audit and written in one transaction per group commit, either after
+    commit_interval seconds on the attached loop or once max_batch audits are
+    waiting. Without a loop every save is committed straight away.
+    """
+
+    def __init__(self, path: str, commit_interval: float = 0.05, max_batch: int = 256):
+        self.commit_interval = commit_interval
+        self.max_batch = max_batch
+        self.loop = None
+        self._dirty: Dict[str, Audit] = {}
+        self._commit_handle = None
+
+        # Only used from one thread at a time, but with --http-thread that is
+        # not the thread that opened it
+        self.db = sqlite3.connect(path, isolation_level=None, check_same_thread=False)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.executescript(SCHEMA)
+
+    def attach(self, loop):
+        self.loop = loop
+
+    def active_audits(self):
+        rows = self.db.execute(
+            "SELECT name FROM audits WHERE state != ?", (State.COMPLETE.value,)
+        )
+        return {name for (name,) in rows}
+
+    def pending_assignment(self):
+        rows = self.db.execute(
+            "SELECT name FROM audits WHERE assignment_pending AND state = ?",
+            (State.AUDITING.value,),
+        )
+        return {name for (name,) in rows}
+
+    def timed_audits(self):
+        rows = self.db.execute(
+            "SELECT name FROM audits WHERE inspection_timeout > 0 AND state = ?",
+            (State.AUDITING.value,),
+        )
+        return {name for (name,) in rows}
+
+    def load_routes(self):
+        jid_index = {}
+        admin_index = {}
+        rows = self.db.execute(
+            "SELECT admin_jid, name FROM audits WHERE state != ? ORDER BY rowid",
+            (State.COMPLETE.value,),
+        )
+        for admin_jid, name in rows:
+            admin_index.setdefault(admin_jid, name)
+        rows = self.db.execute(
+            "SELECT auditors.jid, auditors.audit FROM auditors"
+            " JOIN audits ON audits.name = auditors.audit"
+            " WHERE audits.state != ? ORDER BY auditors.rowid",
+            (State.COMPLETE.value,),
+        )
+        for jid, name in rows:
+            jid_index.setdefault(jid, name)
+        return jid_index, admin_index
+
+    def has_audit(self, name: str):
+        row = self.db.execute("SELECT 1 FROM audits WHERE name = ?", (name,))
+        return row.fetchone() is not None
+
+    def load_settlement(self, name: str):
+        self.flush()
+        row = self.db.execute(
+            "SELECT settlement, settlement_hash FROM audits"
+            " WHERE name = ? AND settlement IS NOT NULL",
+            (name,),
+        ).fetchone()
+        if row is None:
+            return None
+        return {"response": row[0], "hash": row[1]}
+
+    def settled(self, name: str, settlement_hash=None):
+        self.flush()
+        row = self.db.execute(
+            "SELECT settlement_hash FROM audits WHERE name = ? AND state = ?",
+            (name, State.COMPLETE.value),
+        ).fetchone()
+        return row is not None and settlement_hash in (None, row[0])
+
+    def load_audit(self, name: str) -> Optional[Audit]:
+        self.flush()
+        row = self.db.execute(
+            "SELECT admin_jid, bond, inspection_reward, number_of_audits_per_item,"
+            " slashing_ratio, state, assignment, assignment_pending, inspection_timeout,"
+            " settlement, settlement_hash FROM audits"
+            " WHERE name = ?",
+            (name,),
+        ).fetchone()
+        if row is None:
+            return None
+
+        admin_jid, bond, reward, per_item, slashing_ratio, state = row[:6]
+        audit = Audit(
+            name=name,
+            admin_jid=admin_jid,
+            bond=bond,
+            inspection_reward=reward,
+            number_of_audits_per_item=per_item,
+            slashing_ratio=slashing_ratio,
+            state=State(state),
+            assignment=AssignmentMode(row[6]),
+            assignment_pending=bool(row[7]),
+            inspection_timeout=row[8],
+            settlement=row[9],
+            settlement_hash=row[10],
+        )
+        audit.items = [
+            description
+            for (description,) in self.db.execute(
+                "SELECT description FROM items WHERE audit = ? ORDER BY number",
+                (name,),
+            )
+        ]
+        rows = self.db.execute(
+            "SELECT jid, addr, state, current_inspection, audit_count,"
+            " audits_aligned, compensation, timeouts, answer_time, parked"
+            " FROM auditors WHERE audit = ? ORDER BY rowid",
+            (name,),
+        ).fetchall()
+        for row in rows:
+            jid, addr, auditor_state, current, count, aligned, compensation = row[:7]
+            audit.auditors[jid] = Auditor(
+                jid=jid,
+                addr=addr,
+                state=AuditorState(auditor_state),
+                audit=name,
+                current_inspection=current,
+                audit_count=count,
+                audits_aligned=aligned,
+                compensation=compensation,
+                timeouts=row[7],
+            )
+
+        columns = self.db.execute(
+            "SELECT auditor, item, completed, finding FROM inspections"
+            " WHERE audit = ? ORDER BY inspection_id",
+            (name,),
+        ).fetchall()
+        if columns:
+            columns = np.array(columns, dtype=np.int64)
+            audit.load_inspections(
+                columns[:, 0],
+                columns[:, 1],
+                columns[:, 2].astype(bool),
+                columns[:, 3].astype(bool),
+            )
+        if audit.assignment == AssignmentMode.DYNAMIC:
+            audit.load_assignment_history(
+                self.db.execute(
+                    "SELECT jid, item FROM timed_out WHERE audit = ?", (name,)
+                ),
+                {row[0]: row[8] for row in rows if row[8] is not None},
+                [row[0] for row in rows if row[9]],
+            )
+
+        audit._track_changes = True
+        return audit
+
+    def track(self, audit: Audit):
+        audit._track_changes = True
+        audit._items_dirty = True
+        audit.touch_all_auditors()
+        audit._inspections_saved = 0
+        audit._dirty_inspections = {}
+
+    def save(self, audit: Audit):
+        self._dirty[audit.name] = audit
+        if self.loop is None or len(self._dirty) >= self.max_batch:
+            self.flush()
+        elif self._commit_handle is None:
+            self._commit_handle = self.loop.call_later(self.commit_interval, self.flush)
+
+    def delete_all(self):
+        self._dirty.clear()
+        self.db.execute("BEGIN")
+        for table in ("audits", "items", "auditors", "inspections", "timed_out"):
+            self.db.execute(f"DELETE FROM {table}")
+        self.db.execute("COMMIT")
+
+    def flush(self):
+        if self._commit_handle is not None:
+            self._commit_handle.cancel()
+            self._commit_handle = None
+        if not self._dirty:
+            return
+        dirty, self._dirty = self._dirty, {}
+
+        # Each audit is written under its own savepoint, so one that fails is
+        # rolled back and kept for the next flush without taking the rest of
+        # the group with it. Nothing is marked saved until COMMIT succeeds.
+        written = []
+        self.db.execute("BEGIN")
+        try:
+            for audit in dirty.values():
+                self.db.execute("SAVEPOINT audit")
+                try:
+                    self._write_audit(audit)
+                except Exception:
+                    self.db.execute("ROLLBACK TO SAVEPOINT audit")
+                    logging.exception("Failed to save audit %s", audit.name)
+                    self._dirty.setdefault(audit.name, audit)
+                else:
+                    written.append(audit)
+                self.db.execute("RELEASE SAVEPOINT audit")
+            self.db.execute("COMMIT")
+        except BaseException:
+            if self.db.in_transaction:
+                self.db.execute("ROLLBACK")
+            # None of the group reached disk, it is all written next time
+            for name, audit in dirty.items():
+                self._dirty.setdefault(name, audit)
+            raise
+        for audit in written:
+            self._mark_saved(audit)
+
+    def _mark_saved(self, audit: Audit):
+        audit._items_dirty = False
+        audit._dirty_auditors = {}
+        audit._dirty_inspections = {}
+        audit._dirty_timed_out = []
+        audit._inspections_saved = audit._inspections.size
+
+    def _write_audit(self, audit: Audit):
+        name = audit.name
+        self.db.execute(
+            "INSERT INTO audits VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)"
+            " ON CONFLICT (name) DO UPDATE"
+            " SET admin_jid = excluded.admin_jid, bond = excluded.bond,"
+            " inspection_reward = excluded.inspection_reward,"
+            " number_of_audits_per_item = excluded.number_of_audits_per_item,"
+            " slashing_ratio = excluded.slashing_ratio, state = excluded.state,"
+            " assignment = excluded.assignment,"
+            " assignment_pending = excluded.assignment_pending,"
+            " inspection_timeout = excluded.inspection_timeout,"
+            " settlement = excluded.settlement,"
+            " settlement_hash = excluded.settlement_hash",
+            (
+                name,
+                audit.admin_jid,
+                float(audit.bond),
+                float(audit.inspection_reward),
+                int(audit.number_of_audits_per_item),
+                float(audit.slashing_ratio),
+                audit.state.value,
+                audit.assignment.value,
+                audit.assignment_pending,
+                float(audit.inspection_timeout),
+                audit.settlement,
+                audit.settlement_hash,
+            ),
+        )
+
+        if audit._items_dirty:
+            self.db.execute("DELETE FROM items WHERE audit = ?", (name,))
+            self.db.executemany(
+                "INSERT INTO items VALUES (?, ?, ?)",
+                ((name, number, item) for number, item in enumerate(audit.items)),
+            )
+
+        if audit._dirty_auditors:
+            auditors = [audit.auditors[jid] for jid in audit._dirty_auditors]
+            self.db.executemany(
+                "INSERT INTO auditors VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)"
+                " ON CONFLICT (audit, jid) DO UPDATE SET addr = excluded.addr,"
+                " state = excluded.state,"
+                " current_inspection = excluded.current_inspection,"
+                " audit_count = excluded.audit_count,"
+                " audits_aligned = excluded.audits_aligned,"
+                " compensation = excluded.compensation,"
+                " timeouts = excluded.timeouts, answer_time = excluded.answer_time,"
+                " parked = excluded.parked",
+                (
+                    (
+                        name,
+                        auditor.jid,
+                        auditor.addr,
+                        auditor.state.value,
+                        auditor.current_inspection,
+                        auditor.audit_count,
+                        auditor.audits_aligned,
+                        auditor.compensation,
+                        auditor.timeouts,
+                        audit._answer_time.get(auditor.jid),
+                        auditor.jid in audit._parked,
+                    )
+                    for auditor in auditors
+                ),
+            )
+
+        # Rows added since the last commit are inserted whole, completions
+        # and DYNAMIC hand-outs of older rows are updated in place
+        inspections = audit._inspections
+        saved = audit._inspections_saved
+        if saved == 0:
+            # Nothing saved yet, or a failed start was rolled back
+            self.db.execute("DELETE FROM inspections WHERE audit = ?", (name,))
+            self.db.execute("DELETE FROM timed_out WHERE audit = ?", (name,))
+        if inspections.size > saved:
+            self.db.executemany(
+                "INSERT OR REPLACE INTO inspections VALUES (?, ?, ?, ?, ?, ?)",
+                zip(
+                    [name] * (inspections.size - saved),
+                    range(saved, inspections.size),
+                    inspections.auditor[saved:].tolist(),
+                    inspections.item[saved:].tolist(),
+                    inspections.completed[saved:].tolist(),
+                    inspections.finding[saved:].tolist(),
+                ),
+            )
+        if audit._dirty_inspections:
+            ids = [i for i in audit._dirty_inspections if i < saved]
+            self.db.executemany(
+                "UPDATE inspections SET auditor = ?, completed = ?, finding = ?"
+                " WHERE audit = ? AND inspection_id = ?",
+                (
+                    (
+                        int(inspections._auditor[i]),
+                        bool(inspections._completed[i]),
+                        bool(inspections._finding[i]),
+                        name,
+                        i,
+                    )
+                    for i in ids
+                ),
+            )
+
+        if audit._dirty_timed_out:
+            self.db.executemany(
+                "INSERT INTO timed_out VALUES (?, ?, ?)",
+                ((name, jid, item) for jid, item in audit._dirty_timed_out),
+            )
+
+    def close(self):
+        self.flush()
+        self.db.close()
@@ -0,0 +1,5 @@
+curl -X 'POST' \
+  'http://127.0.0.1:8080/data_dump/ack/' \
+  -H 'accept: application/json' \
+  -H 'Content-Type: application/json' \
+  -d '{"data":{"name":"Demo Project A"}}'
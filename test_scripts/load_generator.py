@@ -0,0 +1,368 @@
+#!/usr/bin/env python3
+
+"""
+Drives many full audit lifecycles against the bot at once, from open through
+stop, over sessions that stay connected for the whole run.
+
+Every audit gets an admin session and its own auditor sessions. The
+auditors register with a fresh Ethereum address and answer each inspection
+as soon as it is assigned. The time from an answer to the next assignment
+(or to the "all done" reply) is reported as p50/p99 latency, together with
+answer throughput.
+
+Two transports are available:
+  local  runs an RWABot in this process and delivers stanzas in memory, so no
+         XMPP server is needed
+  xmpp   logs in to a real server, one session per simulated user. Accounts
+         <prefix>admin<a> and <prefix>auditor<a>_<m> must exist, with the
+         local part as the password unless --password is given. Audits are
+         registered through the adapter's /register_audits/ endpoint.
+
+    python load_generator.py --audits 50 --auditors 20 --items 100
+    python load_generator.py --transport xmpp --domain foxhole --audits 5
+"""
+
+import asyncio
+import json
+import os
+import sys
+import time
+from argparse import ArgumentParser
+from random import choice, random
+
+import numpy as np
+from eth_utils import to_checksum_address
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+# Fragments of the bot's replies the simulated users wait for
+ADDR_REQUEST = "Enter your Ethereum address"
+ADDR_ACCEPTED = "Address Accepted"
+ASSIGNMENT = "You have been assigned the following inspection"
+AUDITOR_COMPLETE = "You have complete all your tasks"
+
+
+class Session:
+    """One simulated user. Stanzas from the bot arrive on inbox."""
+
+    def __init__(self, jid):
+        self.jid = jid
+        self.inbox = asyncio.Queue()
+
+    def say(self, body):
+        raise NotImplementedError
+
+    async def expect(self, *fragments, timeout=60.0):
+        # Wait for a stanza containing any of fragments, dropping the others
+        deadline = time.monotonic() + timeout
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise TimeoutError(f"{self.jid} waited for {fragments}")
+            body = await asyncio.wait_for(self.inbox.get(), remaining)
+            if any(fragment in body for fragment in fragments):
+                return body
+
+
+class LocalTransport:
+    """An in-process RWABot, its outbound queue feeds the sessions' inboxes"""
+
+    def __init__(self, send_rate=0.0, send_burst=100):
+        from xmpp_interface import RWABot
+
+        self.bot = RWABot(
+            "botty@loadgen", "", send_rate=send_rate, send_burst=send_burst
+        )
+        self.bot.outbound.send = self.deliver
+        self.sessions = {}
+
+    async def start(self):
+        self.bot.outbound.start(self.bot.loop)
+
+    def deliver(self, mto, mbody, mtype):
+        session = self.sessions.get(mto)
+        if session is not None:
+            session.inbox.put_nowait(mbody)
+
+    async def open_session(self, jid):
+        session = LocalSession(jid, self.bot)
+        self.sessions[jid] = session
+        return session
+
+    async def register_audits(self, batch):
+        return self.bot.register_audits(batch)
+
+    async def close(self):
+        self.bot.outbound.stop()
+
+
+class LocalSession(Session):
+    def __init__(self, jid, bot):
+        super().__init__(jid)
+        self.bot = bot
+
+    def say(self, body):
+        msg = self.bot.make_message(
+            mto=self.bot.bot_jid, mbody=body, mtype="chat", mfrom=self.jid
+        )
+        self.bot.loop.call_soon(self.bot.message, msg)
+
+
+class XMPPTransport:
+    """One logged in slixmpp client per session, kept open for the whole run"""
+
+    def __init__(self, bot_jid, http, password=None, host=None, logins=50):
+        self.bot_jid = bot_jid
+        self.http = http
+        self.password = password
+        self.host = host
+        self.sessions = []
+        # Logins in flight at once, to not flood the server's auth
+        self.logins = asyncio.Semaphore(logins)
+
+    async def start(self):
+        pass
+
+    async def open_session(self, jid):
+        password = self.password or jid.split("@")[0]
+        session = XMPPSession(jid, password, self.bot_jid)
+        async with self.logins:
+            if self.host:
+                host, _, port = self.host.partition(":")
+                session.client.connect((host, int(port or 5222)))
+            else:
+                session.client.connect()
+            await asyncio.wait_for(session.ready.wait(), 30)
+        self.sessions.append(session)
+        return session
+
+    async def register_audits(self, batch):
+        import aiohttp
+
+        async with aiohttp.ClientSession() as http:
+            async with http.post(
+                self.http + "/register_audits/", json={"data": {"audits": batch}}
+            ) as response:
+                return (await response.json())["data"]["results"]
+
+    async def close(self):
+        for session in self.sessions:
+            session.client.disconnect()
+
+
+class XMPPSession(Session):
+    def __init__(self, jid, password, bot_jid):
+        import slixmpp
+
+        super().__init__(jid)
+        self.bot_jid = bot_jid
+        self.ready = asyncio.Event()
+        self.client = slixmpp.ClientXMPP(jid, password)
+        self.client.add_event_handler("session_start", self.start)
+        self.client.add_event_handler("message", self.received)
+
+    async def start(self, event):
+        self.client.send_presence()
+        await self.client.get_roster()
+        self.ready.set()
+
+    def received(self, msg):
+        if msg["type"] in ("chat", "normal"):
+            self.inbox.put_nowait(msg["body"])
+
+    def say(self, body):
+        self.client.send_message(mto=self.bot_jid, mbody=body, mtype="chat")
+
+
+class Stats:
+    def __init__(self):
+        self.latencies = []
+        self.answers = 0
+        self.lifecycles = []
+        self.failures = []
+
+
+async def run_auditor(session, audit_name, registered, started, stats, think):
+    session.say(audit_name)
+    await session.expect(ADDR_REQUEST)
+    session.say(to_checksum_address(os.urandom(20)))
+    await session.expect(ADDR_ACCEPTED)
+    registered.set()
+
+    await started.wait()
+    body = await session.expect(ASSIGNMENT, AUDITOR_COMPLETE, timeout=120)
+    while AUDITOR_COMPLETE not in body:
+        if think:
+            await asyncio.sleep(think * random())
+        answered = time.perf_counter()
+        session.say(choice(["y", "n"]))
+        stats.answers += 1
+        body = await session.expect(ASSIGNMENT, AUDITOR_COMPLETE)
+        stats.latencies.append(time.perf_counter() - answered)
+
+
+async def open_audit_sessions(transport, number, options):
+    name = f"{options.prefix}audit{number}"
+    admin = await transport.open_session(
+        f"{options.prefix}admin{number}@{options.domain}"
+    )
+    auditors = await asyncio.gather(
+        *(
+            transport.open_session(
+                f"{options.prefix}auditor{number}_{m}@{options.domain}"
+            )
+            for m in range(options.auditors)
+        )
+    )
+    return name, admin, auditors
+
+
+def think_times(options):
+    # The first slow_fraction of each audit's auditors take slow_factor longer
+    slow = round(options.auditors * options.slow_fraction)
+    return [
+        options.think * (options.slow_factor if m < slow else 1)
+        for m in range(options.auditors)
+    ]
+
+
+async def drive_audit(name, admin, auditors, options, stats):
+    began = time.perf_counter()
+    admin.say("open")
+    await admin.expect("opened for auditors")
+
+    registered = [asyncio.Event() for _ in auditors]
+    started = asyncio.Event()
+    answering = [
+        asyncio.ensure_future(run_auditor(session, name, event, started, stats, think))
+        for session, event, think in zip(auditors, registered, think_times(options))
+    ]
+    await asyncio.gather(*(event.wait() for event in registered))
+
+    admin.say("close")
+    await admin.expect("closed for registration")
+    admin.say("start")
+    await admin.expect("started")
+    started.set()
+    await asyncio.gather(*answering)
+
+    admin.say("stop")
+    await admin.expect("stopped")
+    stats.lifecycles.append(time.perf_counter() - began)
+
+
+async def main(options):
+    if options.transport == "local":
+        transport = LocalTransport(send_rate=options.send_rate)
+    else:
+        transport = XMPPTransport(
+            options.bot, options.http, password=options.password, host=options.host
+        )
+    await transport.start()
+    stats = Stats()
+
+    connecting = time.perf_counter()
+    audits = await asyncio.gather(
+        *(
+            open_audit_sessions(transport, number, options)
+            for number in range(options.audits)
+        )
+    )
+    connected = time.perf_counter() - connecting
+
+    results = await transport.register_audits(
+        [
+            {
+                "name": name,
+                "admin_jid": admin.jid,
+                "bond": options.bond,
+                "number_of_audits_per_item": options.per_item,
+                "assignment": options.assignment,
+                "items": [f"Room {item}" for item in range(options.items)],
+            }
+            for name, admin, _ in audits
+        ]
+    )
+    rejected = [result for result in results if result["status"] != 200]
+    if rejected:
+        raise RuntimeError(f"Audits not registered: {rejected[:5]}")
+
+    began = time.perf_counter()
+    outcomes = await asyncio.gather(
+        *(drive_audit(*audit, options, stats) for audit in audits),
+        return_exceptions=True,
+    )
+    elapsed = time.perf_counter() - began
+    stats.failures = [repr(outcome) for outcome in outcomes if outcome is not None]
+    await transport.close()
+
+    latencies = np.array(stats.latencies) * 1000
+    lifecycles = np.array(stats.lifecycles)
+    report = {
+        "transport": options.transport,
+        "audits": options.audits,
+        "auditors_per_audit": options.auditors,
+        "items_per_audit": options.items,
+        "sessions": options.audits * (options.auditors + 1),
+        "connect_seconds": connected,
+        "run_seconds": elapsed,
+        "answers": stats.answers,
+        "answers_per_second": stats.answers / elapsed if elapsed else 0.0,
+        "latency_ms": {
+            "p50": float(np.percentile(latencies, 50)) if len(latencies) else None,
+            "p99": float(np.percentile(latencies, 99)) if len(latencies) else None,
+            "max": float(latencies.max()) if len(latencies) else None,
+        },
+        "lifecycle_seconds": {
+            "p50": float(np.percentile(lifecycles, 50)) if len(lifecycles) else None,
+            "max": float(lifecycles.max()) if len(lifecycles) else None,
+        },
+        "failures": stats.failures[:10],
+        "failed_audits": len(stats.failures),
+    }
+    return report
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser(description="RWA bot load generator")
+    parser.add_argument("--transport", choices=("local", "xmpp"), default="local")
+    parser.add_argument("--audits", type=int, default=10)
+    parser.add_argument("--auditors", type=int, default=10, help="Per audit")
+    parser.add_argument("--items", type=int, default=50, help="Per audit")
+    parser.add_argument("--per-item", dest="per_item", type=int, default=3)
+    parser.add_argument("--bond", type=float, default=1000)
+    parser.add_argument(
+        "--think", type=float, default=0.0, help="Most seconds to wait before answering"
+    )
+    parser.add_argument(
+        "--slow-fraction",
+        dest="slow_fraction",
+        type=float,
+        default=0.0,
+        help="Share of each audit's auditors that think slow_factor times longer",
+    )
+    parser.add_argument("--slow-factor", dest="slow_factor", type=float, default=10.0)
+    parser.add_argument("--assignment", choices=("static", "dynamic"), default="static")
+    parser.add_argument("--prefix", default="load_", help="Account and audit prefix")
+    parser.add_argument("--domain", default="foxhole")
+    parser.add_argument("--bot", default="botty@foxhole", help="Bot jid (xmpp)")
+    parser.add_argument("--host", help="XMPP server host[:port] if not from DNS (xmpp)")
+    parser.add_argument("--password", help="Password of every account (xmpp)")
+    parser.add_argument(
+        "--http", default="http://127.0.0.1:8080", help="Adapter (xmpp)"
+    )
+    parser.add_argument(
+        "--send-rate",
+        dest="send_rate",
+        type=float,
+        default=0.0,
+        help="Bot outgoing messages per second, 0 for no limit (local)",
+    )
+    parser.add_argument("--json", dest="json_path", help="Also write the report here")
+    options = parser.parse_args()
+
+    report = asyncio.run(main(options))
+    print(json.dumps(report, indent=2))
+    if options.json_path:
+        with open(options.json_path, "w") as output:
+            json.dump(report, output, indent=2)
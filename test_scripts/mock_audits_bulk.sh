@@ -0,0 +1,9 @@
+# Instantiate audits, with their items, in one request
+echo "Instantiating Audits"
+echo "================================================================================"
+
+curl -X 'POST' \
+  'http://127.0.0.1:8080/register_audits/' \
+  -H 'accept: application/json' \
+  -H 'Content-Type: application/json' \
+  -d '{"data":{"audits":[{"admin_jid":"audit_admin_a@foxhole","bond":100,"name":"Demo Project A","number_of_audits_per_item":3,"slashing_ratio":0.5,"items":["Room 1","Room 2","Room 3","Room 4","Room 5"]},{"admin_jid":"audit_admin_b@foxhole","bond":100,"name":"Demo Project B","number_of_audits_per_item":2,"items":["Room 1","Room 2"]}]}}'
@@ -0,0 +1,46 @@
+import asyncio
+
+import pytest
+
+
+@pytest.fixture
+def make_bot():
+    # RWABots that are never connected, their messages stay in bot.outbound
+    from xmpp_interface import RWABot
+
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    bots = []
+
+    def make(**options):
+        bots.append(RWABot("bot@test", "", send_rate=0, **options))
+        return bots[-1]
+
+    yield make
+    for bot in bots:
+        bot.loop_lag.stop()
+        bot.deadlines.clear()
+    for task in asyncio.all_tasks(loop):
+        task.cancel()
+    loop.run_until_complete(asyncio.sleep(0))
+    loop.close()
+    asyncio.set_event_loop(None)
+
+
+@pytest.fixture
+def bot(make_bot):
+    return make_bot()
+
+
+@pytest.fixture
+def client(bot, monkeypatch):
+    # The HTTP endpoints of rwa.py, in front of bot
+    from fastapi.testclient import TestClient
+
+    import rwa
+    from adapter import LocalAdapter
+
+    monkeypatch.setattr(rwa, "adapter", LocalAdapter(bot), raising=False)
+    monkeypatch.setattr(rwa, "jobs", None)
+    with TestClient(rwa.app) as client:
+        yield client
@@ -0,0 +1,48 @@
+from audit import Audit, Auditor, AuditorState, State
+
+
+def address(n: int):
+    return "0x" + f"{n + 1:040x}"
+
+
+def make_audit(auditors=3, items=4, per_item=3, name="audit", **fields):
+    # An audit in AUDITOR_REGISTRATION with its items and READY auditors
+    audit = Audit(
+        name=name,
+        admin_jid=fields.pop("admin_jid", f"admin@{name}"),
+        bond=fields.pop("bond", 120),
+        number_of_audits_per_item=per_item,
+        **fields,
+    )
+    audit.add_items([f"item {n}" for n in range(items)])
+    audit.calculate_inspection_reward()
+    audit.state = State.AUDITOR_REGISTRATION
+    for n in range(auditors):
+        audit.register_auditor(
+            Auditor(
+                jid=f"auditor{n}@{name}",
+                addr=address(n),
+                audit=name,
+                state=AuditorState.READY,
+            )
+        )
+    return audit
+
+
+def started_audit(*args, **kwargs):
+    # make_audit, with its inspections assigned and auditing under way
+    audit = make_audit(*args, **kwargs)
+    audit.state = State.AUDITING
+    audit.assign_auditors_to_items()
+    audit.assign_all_current_inspection()
+    return audit
+
+
+def chat(bot, jid, body):
+    # Hands the bot a chat message from jid
+    bot.message(bot.make_message(mto=bot.bot_jid, mbody=body, mtype="chat", mfrom=jid))
+
+
+def sent(bot):
+    # (recipient, body) of every message the bot has queued since last asked
+    return [(mto, mbody) for mto, mbody, _, _ in bot.outbound.drain()]
@@ -0,0 +1,51 @@
+import asyncio
+import threading
+
+import pytest
+
+from adapter import LocalAdapter, ThreadedAdapter
+
+
+def test_threaded_adapter_runs_audits_calls_on_the_bot_thread(bot):
+    threads = []
+    create_audit = bot.create_audit
+
+    def record(fields):
+        threads.append(threading.get_ident())
+        return create_audit(fields)
+
+    bot.create_audit = record
+    bot_thread = threading.Thread(target=bot.loop.run_forever)
+    bot_thread.start()
+    try:
+        adapter = ThreadedAdapter(LocalAdapter(bot), bot.loop)
+
+        async def requests():
+            created = await adapter.register_audit(
+                {"name": "audit", "admin_jid": "admin@test", "bond": 10}
+            )
+            page = await adapter.call("audit", "items_page", "audit")
+            families = await adapter.collect_metrics()
+            return created, page, families
+
+        created, page, families = asyncio.run(requests())
+    finally:
+        bot.loop.call_soon_threadsafe(bot.loop.stop)
+        bot_thread.join()
+
+    assert created == 200
+    assert page == {"items": [], "next_cursor": None}
+    assert threads == [bot_thread.ident]
+    assert "rwa_audits" in [family[0] for family in families]
+
+
+def test_threaded_adapter_passes_errors_back(bot):
+    bot_thread = threading.Thread(target=bot.loop.run_forever)
+    bot_thread.start()
+    try:
+        adapter = ThreadedAdapter(LocalAdapter(bot), bot.loop)
+        with pytest.raises(AttributeError, match="no_such_method"):
+            asyncio.run(adapter.call("audit", "no_such_method"))
+    finally:
+        bot.loop.call_soon_threadsafe(bot.loop.stop)
+        bot_thread.join()
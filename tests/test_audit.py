@@ -0,0 +1,369 @@
+import pytest
+
+from audit import (
+    AssignmentMode,
+    Auditor,
+    AuditorState,
+    Audits,
+    InspectionStore,
+    SettlementError,
+    State,
+    encode_settlement,
+)
+from helpers import make_audit, started_audit
+
+
+def scan(audit, **match):
+    # The inspections a full scan would find, to check the indexes against
+    return [
+        inspection.inspection_id
+        for inspection in audit.get_inspections(range(audit.number_of_inspections()))
+        if all(getattr(inspection, key) == value for key, value in match.items())
+    ]
+
+
+def test_auditor_and_item_indexes_match_a_scan():
+    audit = started_audit(auditors=4, items=5, per_item=3)
+    assert audit.number_of_inspections() == 15
+    for auditor in audit.auditors.values():
+        ids = [i.inspection_id for i in audit.get_auditor_audits(auditor)]
+        assert ids == scan(audit, auditor=auditor.jid)
+        assert audit.auditor_remaining(auditor) == len(ids)
+    for item in range(5):
+        ids = [i.inspection_id for i in audit.get_item_audits(item)]
+        assert ids == scan(audit, item=item)
+        # Each of an item's inspections goes to a different auditor
+        assert len({i.auditor for i in audit.get_item_audits(item)}) == 3
+
+
+def test_completing_an_inspection_leaves_the_outstanding_pool():
+    audit = started_audit(auditors=3, items=4, per_item=3)
+    auditor = audit.auditors["auditor0@audit"]
+    before = audit.auditor_remaining(auditor)
+    current = auditor.current_inspection
+    assert current in [
+        i.inspection_id for i in audit.get_outstanding_auditor_audits(auditor)
+    ]
+
+    audit.set_audit_by_audit(current, True)
+
+    outstanding = [
+        i.inspection_id for i in audit.get_outstanding_auditor_audits(auditor)
+    ]
+    assert current not in outstanding
+    assert sorted(outstanding) == scan(audit, auditor=auditor.jid, completed=False)
+    assert audit.auditor_remaining(auditor) == before - 1
+    item = audit.get_inspection(current).item
+    assert current not in [
+        i.inspection_id for i in audit.get_outstanding_item_audits(item)
+    ]
+
+
+def test_set_audit_finds_the_auditors_inspection_of_an_item():
+    audit = started_audit(auditors=3, items=2, per_item=3)
+    auditor = audit.auditors["auditor1@audit"]
+    item = audit.get_auditor_audits(auditor)[0].item
+    assert audit.set_audit(auditor, item, True)
+    assert scan(audit, auditor=auditor.jid, item=item, completed=True, finding=True)
+    # An item the auditor was not given
+    audit = started_audit(auditors=6, items=2, per_item=1)
+    assert not audit.set_audit(audit.auditors["auditor5@audit"], 0, True)
+
+
+def test_auditor_is_done_once_their_pool_is_empty():
+    audit = started_audit(auditors=2, items=3, per_item=2)
+    auditor = audit.auditors["auditor0@audit"]
+    while audit.auditor_remaining(auditor):
+        assert not audit.auditor_done(auditor)
+        audit.set_audit_by_audit(auditor.current_inspection, False)
+        audit.assign_current_inspection(auditor)
+    assert auditor.current_inspection is None
+    assert audit.auditor_done(auditor)
+    assert not audit.auditor_done(audit.auditors["auditor1@audit"])
+
+
+def test_inspection_store_grows_and_keeps_rows():
+    store = InspectionStore()
+    assert store.append([1, 2], [0, 0]).tolist() == [0, 1]
+    store.completed[1] = True
+    assert store.append([3, 4, 5], [1, 1, 2]).tolist() == [2, 3, 4]
+    assert len(store) == 5
+    assert store.auditor.tolist() == [1, 2, 3, 4, 5]
+    assert store.item.tolist() == [0, 0, 1, 1, 2]
+    assert store.completed.tolist() == [False, True, False, False, False]
+
+
+def finish(audit, findings):
+    # Answers every inspection with findings[(auditor, item)] and scores it
+    for inspection in audit.get_outstanding_audits():
+        audit.set_audit_by_audit(
+            inspection.inspection_id, findings(inspection.auditor, inspection.item)
+        )
+    audit.state = State.AUDITING_FINISHED
+    audit.calculate_item_results()
+    audit.calculate_audit_results()
+    audit.calculate_auditor_results()
+    audit.calculate_auditor_compensation()
+
+
+def test_scoring_pipeline_matches_per_inspection_arithmetic():
+    audit = started_audit(auditors=3, items=4, per_item=3, bond=1200)
+    # auditor2 disagrees with the others on every item
+    finish(audit, lambda jid, item: (item % 2 == 0) != (jid == "auditor2@audit"))
+
+    assert audit._item_results.tolist() == [True, False, True, False]
+    aligned = audit.get_inspections(range(audit.number_of_inspections()))
+    assert all(i.aligned == (i.auditor != "auditor2@audit") for i in aligned)
+    reward = audit.inspection_reward
+    assert reward == 100
+    for jid, auditor in audit.auditors.items():
+        assert auditor.audit_count == 4
+        if jid == "auditor2@audit":
+            assert auditor.audits_aligned == 0
+            assert auditor.compensation == 0
+        else:
+            assert auditor.audits_aligned == 4
+            assert auditor.compensation == 4 * reward
+    assert audit.state == State.WAITING_FOR_CONTRACT
+
+
+def test_slashing_is_taken_off_aligned_answers():
+    audit = started_audit(auditors=3, items=4, per_item=3, bond=1200)
+    # auditor2 is wrong on item 0 only
+    finish(audit, lambda jid, item: item == 0 and jid == "auditor2@audit")
+    auditor = audit.auditors["auditor2@audit"]
+    assert (auditor.audit_count, auditor.audits_aligned) == (4, 3)
+    assert auditor.compensation == (3 - 0.5 * 1) * 100
+
+
+def test_jids_route_to_the_first_audit_they_joined():
+    audits = Audits()
+    first = make_audit(auditors=2, name="first")
+    second = make_audit(auditors=0, name="second", admin_jid="admin@first")
+    audits.add_audit(first)
+    assert audits.add_audit(second) == 200
+    assert audits.add_audit(make_audit(name="first")) == "9"
+    audits.register_auditor(second, Auditor(jid="auditor0@first"))
+    audits.register_auditor(second, Auditor(jid="late@test"))
+
+    assert audits.jid_in_admin("admin@first") is first
+    assert audits.jid_in_admin("nobody@test") is None
+    audit, auditor, state = audits.jid_in_audit("auditor0@first")
+    assert audit is first and auditor is first.auditors["auditor0@first"]
+    assert state == AuditorState.READY
+    assert audits.jid_in_audit("late@test")[0] is second
+    assert audits.jid_in_audit("nobody@test") == (None, None, None)
+    assert audits.jid_to_auditor("auditor1@first") is first.auditors["auditor1@first"]
+
+    audits.clear_audits()
+    assert audits.jid_in_admin("admin@first") is None
+    assert audits.jid_to_auditor("auditor0@first") is None
+
+
+def test_tallies_follow_each_answer():
+    audit = started_audit(auditors=3, items=2, per_item=3)
+    assert audit.outstanding_count() == 6
+    ids = [i.inspection_id for i in audit.get_item_audits(0)]
+
+    audit.set_audit_by_audit(ids[0], True)
+    audit.set_audit_by_audit(ids[1], False)
+    assert audit.outstanding_count() == 4
+    assert audit.get_item_result(0) is None
+    audit.set_audit_by_audit(ids[2], True)
+    assert audit.get_item_result(0) is True
+    assert audit.get_item_result(1) is None
+
+    # Changing an answer moves its vote without counting it twice
+    audit.set_audit_by_audit(ids[0], False)
+    assert audit.get_item_result(0) is False
+    assert audit.outstanding_count() == 3
+    assert not audit.check_if_audit_complete()
+
+    for inspection in audit.get_item_audits(1):
+        audit.set_audit_by_audit(inspection.inspection_id, True)
+    assert audit.check_if_audit_complete()
+    assert (audit._item_true_votes + audit._item_false_votes).tolist() == [3, 3]
+
+
+def test_tallies_are_rebuilt_from_saved_columns():
+    audit = started_audit(auditors=3, items=2, per_item=3)
+    for inspection_id, finding in ((0, True), (1, True), (2, False), (3, False)):
+        audit.set_audit_by_audit(inspection_id, finding)
+    store = audit._inspections
+    loaded = make_audit(auditors=3, items=2, per_item=3)
+    loaded.state = State.AUDITING
+    loaded.load_inspections(
+        store.auditor.copy(),
+        store.item.copy(),
+        store.completed.copy(),
+        store.finding.copy(),
+    )
+    assert loaded.outstanding_count() == 2
+    assert loaded.get_item_result(0) is True
+    assert loaded.get_item_result(1) is None
+    for jid in audit.auditors:
+        assert loaded.auditor_remaining(
+            loaded.auditors[jid]
+        ) == audit.auditor_remaining(audit.auditors[jid])
+
+
+def test_bulk_registration_checks_each_entry_on_its_own():
+    audits = Audits()
+    audits.add_audit(make_audit(name="taken"))
+    good = {"name": "good", "admin_jid": "a@test", "bond": 10, "items": ["x", "y"]}
+    results = audits.register_audits(
+        [
+            good,
+            {"name": "", "admin_jid": "a@test", "bond": 10},
+            {"name": "no bond", "admin_jid": "a@test"},
+            {"name": "ratio", "admin_jid": "a@test", "bond": 1, "slashing_ratio": 2},
+            {
+                "name": "per item",
+                "admin_jid": "a@test",
+                "bond": 1,
+                "number_of_audits_per_item": 1.5,
+            },
+            {"name": "items", "admin_jid": "a@test", "bond": 1, "items": [1]},
+            {"name": "mode", "admin_jid": "a@test", "bond": 1, "assignment": "fifo"},
+            {"name": "good", "admin_jid": "a@test", "bond": 10},
+            {"name": "taken", "admin_jid": "a@test", "bond": 10},
+            {
+                "name": "dynamic",
+                "admin_jid": "a@test",
+                "bond": 1,
+                "assignment": "dynamic",
+                "inspection_timeout": 30,
+            },
+        ]
+    )
+    statuses = [result["status"] for result in results]
+    assert statuses == [200] + [400] * 6 + [409, 409, 200]
+    assert results[0] == {"name": "good", "status": 200, "items": 2}
+    assert results[2]["error"] == "bond must be a positive number"
+    assert results[7]["error"] == "name appears more than once in the request"
+    assert results[8]["error"] == "audit already exists"
+    assert audits.audits["good"].items == ["x", "y"]
+    assert audits.audits["good"].admin_jid == "a@test"
+    dynamic = audits.audits["dynamic"]
+    assert dynamic.assignment == AssignmentMode.DYNAMIC
+    assert dynamic.inspection_timeout == 30
+    assert set(audits.audits) == {"taken", "good", "dynamic"}
+
+
+def all_pages(page, limit, **filters):
+    # Follows next cursors from the start, returns the pages' contents
+    pages, cursor = [], 0
+    while cursor is not None:
+        ids, cursor = page(cursor, limit, **filters)
+        assert len(ids) <= limit
+        pages.append(ids)
+    return pages
+
+
+def test_item_pages_cover_every_item_once():
+    audit = make_audit(items=7)
+    pages = all_pages(audit.page_items, 3)
+    assert [len(page) for page in pages] == [3, 3, 1]
+    assert [number for page in pages for number, _ in page] == list(range(7))
+    assert audit.page_items(7, 3) == ([], None)
+    assert audit.items_page_for_print(0, 3).splitlines()[-1] == "More: items 3 3"
+
+
+def test_outstanding_pages_match_a_scan_with_and_without_filters():
+    audit = started_audit(auditors=4, items=30, per_item=3)
+    for inspection_id in range(0, 90, 4):
+        audit.set_audit_by_audit(inspection_id, True)
+
+    pages = all_pages(audit.page_outstanding, 7)
+    assert [i for page in pages for i in page] == scan(audit, completed=False)
+    jid = "auditor2@audit"
+    pages = all_pages(audit.page_outstanding, 5, auditor=jid)
+    assert [i for page in pages for i in page] == scan(
+        audit, auditor=jid, completed=False
+    )
+    pages = all_pages(audit.page_outstanding, 1, item=4)
+    assert [i for page in pages for i in page] == scan(audit, item=4, completed=False)
+    pages = all_pages(audit.page_outstanding, 2, auditor=jid, item=4)
+    assert [i for page in pages for i in page] == scan(
+        audit, auditor=jid, item=4, completed=False
+    )
+    assert audit.page_outstanding(0, 5, item=99) == ([], None)
+
+    text = audit.outstanding_page_for_print(0, 2, auditor=jid)
+    assert text.splitlines()[-1].endswith(f" 2 auditor={jid}")
+
+
+def answered_audit(**kwargs):
+    # A started audit with every inspection answered True
+    audit = started_audit(**kwargs)
+    for inspection_id in range(audit.number_of_inspections()):
+        audit.set_audit_by_audit(inspection_id, True)
+    return audit
+
+
+def test_settlement_is_cached_with_its_hash():
+    audit = answered_audit(auditors=3, items=2, per_item=3, bond=60)
+    audit.calculate_results()
+    assert audit.state == State.WAITING_FOR_CONTRACT
+    payload = encode_settlement(*audit.get_outcome())
+    assert audit.get_outcome()[1] == [20, 20, 20]
+    assert audit.settlement == "0x" + payload.hex()
+    audits = Audits()
+    audits.add_audit(audit)
+    served = audits.get_settlement("audit")
+    assert served == audits.get_settlement("audit")
+    assert served["hash"] == audit.settlement_hash
+    assert not audits.acknowledge_settlement("audit", "0xwrong")
+    assert audits.acknowledge_settlement("audit", audit.settlement_hash)
+    assert audit.state == State.COMPLETE
+    assert audits.get_settlement("audit") == served
+
+
+def test_compensation_over_uint16_leaves_the_audit_auditing():
+    audit = answered_audit(auditors=3, items=1, per_item=3, bond=1e6)
+    with pytest.raises(SettlementError, match="333333 for auditor0@audit"):
+        audit.calculate_results()
+    assert audit.state == State.AUDITING
+    assert audit.settlement is None
+    assert all(auditor.compensation == 0 for auditor in audit.auditors.values())
+
+    # Once the reward fits, stopping again works
+    audit.inspection_reward = 1000
+    audit.calculate_results()
+    assert audit.state == State.WAITING_FOR_CONTRACT
+    assert audit.get_outcome()[1] == [1000, 1000, 1000]
+
+
+def test_auditor_without_an_address_cannot_be_settled():
+    audit = answered_audit(auditors=3, items=1, per_item=3)
+    audit.auditors["auditor1@audit"].addr = ""
+    with pytest.raises(SettlementError, match="auditor1@audit has no Ethereum address"):
+        audit.calculate_results()
+    assert audit.state == State.AUDITING
+    with pytest.raises(SettlementError):
+        encode_settlement([""], [1])
+
+
+def test_dynamic_audit_needs_an_auditor_per_slot_of_an_item():
+    audit = make_audit(auditors=2, per_item=3, assignment=AssignmentMode.DYNAMIC)
+    assert audit.auditors_needed() == 1
+    audit.assignment = AssignmentMode.STATIC
+    assert audit.auditors_needed() == 0
+    audit = make_audit(auditors=3, per_item=3, assignment=AssignmentMode.DYNAMIC)
+    assert audit.auditors_needed() == 0
+
+
+def test_timed_out_item_is_not_handed_back_to_its_auditor():
+    audit = started_audit(
+        auditors=4, items=2, per_item=2, assignment=AssignmentMode.DYNAMIC
+    )
+    auditor = audit.auditors["auditor0@audit"]
+    inspection_id = auditor.current_inspection
+    item = audit.get_inspection(inspection_id).item
+
+    original, assigned = audit.expire_inspection(inspection_id)
+    assert original is auditor and assigned == []
+    assert audit.get_inspection(inspection_id).auditor == ""
+    # The slot is free again, but not for the auditor who let it lapse
+    assert not audit.request_inspection(auditor)
+    assert item in audit._auditor_items[auditor.jid]
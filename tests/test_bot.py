@@ -0,0 +1,174 @@
+import asyncio
+
+from audit import AssignmentMode, Audit, Audits, State
+from helpers import chat, make_audit, sent, started_audit
+from storage import SQLiteAuditStore
+
+
+def test_stop_reports_a_payout_that_cannot_be_settled(bot):
+    audit = started_audit(auditors=3, items=1, per_item=3, bond=1e6)
+    bot.add_audit(audit)
+    for inspection_id in range(3):
+        audit.set_audit_by_audit(inspection_id, True)
+    settled = []
+    bot.settlement_callbacks.append(lambda name, settlement: settled.append(name))
+    sent(bot)
+
+    chat(bot, "admin@audit", "stop")
+    assert sent(bot) == [
+        (
+            "admin@audit",
+            "Audit for project audit not stopped.\nThe payout cannot be settled:"
+            " compensation 333333 for auditor0@audit is over the contract's"
+            " limit of 65535",
+        )
+    ]
+    assert audit.state == State.AUDITING
+    assert settled == []
+
+    audit.inspection_reward = 100
+    chat(bot, "admin@audit", "stop")
+    assert audit.state == State.WAITING_FOR_CONTRACT
+    assert settled == ["audit"]
+    messages = sent(bot)
+    assert ("admin@audit", "Audit for project audit stopped.") in messages
+    # Every auditor is told the audit stopped and what they are owed
+    assert len(messages) == 1 + 2 * 3
+
+
+def test_dynamic_audit_without_enough_auditors_is_not_started(bot):
+    audit = make_audit(auditors=2, per_item=3, assignment=AssignmentMode.DYNAMIC)
+    audit.state = State.AUDITOR_REGISTRATION_COMPLETE
+    bot.add_audit(audit)
+    sent(bot)
+
+    chat(bot, "admin@audit", "start")
+    assert sent(bot) == [
+        (
+            "admin@audit",
+            "A dynamic audit needs at least 3 auditors, 2 registered."
+            " Use 'mode static' to start it with these auditors.",
+        )
+    ]
+    assert audit.state == State.AUDITOR_REGISTRATION_COMPLETE
+
+
+def test_timeout_set_mid_audit_arms_the_current_inspections(bot):
+    audit = started_audit(auditors=3, items=2, per_item=2)
+    bot.add_audit(audit)
+    keys = {("audit", a.current_inspection) for a in audit.auditors.values()}
+
+    chat(bot, "admin@audit", "timeout 5")
+    assert all(key in bot.deadlines for key in keys)
+    assert len(bot.deadlines) == 3
+
+    chat(bot, "admin@audit", "timeout 0")
+    assert len(bot.deadlines) == 0
+
+
+def test_expired_inspection_moves_to_another_auditor(bot):
+    audit = started_audit(auditors=3, items=1, per_item=2, inspection_timeout=5)
+    bot.add_audit(audit)
+    late = audit.auditors["auditor0@audit"]
+    inspection_id = late.current_inspection
+    sent(bot)
+
+    bot.inspection_expired(("audit", inspection_id))
+    assert audit.get_inspection(inspection_id).auditor == "auditor2@audit"
+    assert audit.auditors["auditor2@audit"].current_inspection == inspection_id
+    assert ("audit", inspection_id) in bot.deadlines
+    messages = sent(bot)
+    assert ("auditor0@audit", audit.messages["inspection_timeout"]) in messages
+    assert [mto for mto, _ in messages].count("auditor2@audit") == 1
+
+
+def test_audit_reloaded_mid_start_is_resumed_and_its_auditors_told(make_bot, tmp_path):
+    path = str(tmp_path / "audits.db")
+    store = SQLiteAuditStore(path)
+    audits = Audits(store)
+    audit = make_audit(auditors=3, items=4, per_item=3)
+    audit.state = State.AUDITING
+    audits.add_audit(audit)
+    # Stopped after the first chunk, which covers only auditor0
+    first = next(audit.assign_auditors_in_chunks(3))
+    assert [auditor.jid for auditor in first] == ["auditor0@audit"]
+    audit.assign_current_inspection(first[0])
+    audits.persist(audit)
+    store.close()
+
+    bot = make_bot(store=SQLiteAuditStore(path))
+    bot.loop.run_until_complete(asyncio.gather(*bot._starting))
+    loaded = bot.audits["audit"]
+    assert not loaded.assignment_pending
+    assert all(a.current_inspection is not None for a in loaded.auditors.values())
+    messages = sent(bot)
+    told = [mto for mto, mbody in messages if mbody.startswith("You have been")]
+    assert told == ["auditor1@audit", "auditor2@audit"]
+    assert ("admin@audit", "All inspections for project audit assigned.") in messages
+    assert not [m for m in messages if m[1] == audit.messages["start_message"]]
+    bot.store.close()
+
+
+def test_deadlines_are_armed_again_after_a_restart(make_bot, tmp_path):
+    path = str(tmp_path / "audits.db")
+    bot = make_bot(store=SQLiteAuditStore(path))
+    bot.add_audit(started_audit(auditors=3, items=2, per_item=2))
+    bot.add_audit(started_audit(name="untimed"))
+    chat(bot, "admin@audit", "timeout 5")
+    assert len(bot.deadlines) == 3
+    bot.store.close()
+
+    bot = make_bot(store=SQLiteAuditStore(path))
+    audit = dict.get(bot.audits, "audit")
+    assert audit is not None and dict.get(bot.audits, "untimed") is None
+    assert {key for key in bot.deadlines._where} == {
+        ("audit", auditor.current_inspection) for auditor in audit.auditors.values()
+    }
+    bot.store.close()
+
+
+def test_audit_without_auditors_is_not_started(bot):
+    audit = make_audit(auditors=0)
+    audit.state = State.AUDITOR_REGISTRATION_COMPLETE
+    bot.add_audit(audit)
+
+    chat(bot, "admin@audit", "start")
+    assert sent(bot) == [("admin@audit", "No auditors registered for project audit.")]
+    assert audit.state == State.AUDITOR_REGISTRATION_COMPLETE
+
+
+def test_failed_start_is_rolled_back(make_bot, tmp_path, monkeypatch):
+    bot = make_bot(store=SQLiteAuditStore(str(tmp_path / "audits.db")))
+    audit = make_audit(auditors=3, items=4, per_item=3)
+    audit.state = State.AUDITOR_REGISTRATION_COMPLETE
+    bot.add_audit(audit)
+    build = Audit.assign_auditors_in_chunks
+
+    def fail_part_way(self, chunk_size=0):
+        chunks = build(self, chunk_size)
+        yield next(chunks)
+        raise RuntimeError("build failed")
+
+    monkeypatch.setattr(Audit, "assign_auditors_in_chunks", fail_part_way)
+    chat(bot, "admin@audit", "start")
+    bot.loop.run_until_complete(asyncio.gather(*bot._starting, return_exceptions=True))
+    assert audit.state == State.AUDITOR_REGISTRATION_COMPLETE
+    assert not audit.assignment_pending
+    assert audit.number_of_inspections() == 0
+    assert all(a.current_inspection is None for a in audit.auditors.values())
+    assert len(bot.deadlines) == 0
+    assert (
+        "admin@audit",
+        "Audit for project audit could not be started: RuntimeError('build failed')",
+    ) in sent(bot)
+
+    # Nothing of the failed start is left in the store
+    bot.store.flush()
+    assert bot.store.pending_assignment() == set()
+    assert bot.store.load_audit("audit").number_of_inspections() == 0
+
+    monkeypatch.setattr(Audit, "assign_auditors_in_chunks", build)
+    chat(bot, "admin@audit", "start")
+    bot.loop.run_until_complete(asyncio.gather(*bot._starting))
+    assert audit.number_of_inspections() == 12
+    bot.store.close()
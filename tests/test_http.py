@@ -0,0 +1,84 @@
+from helpers import started_audit
+
+
+def test_register_audits_endpoint(client, bot):
+    reply = client.post(
+        "/register_audits/",
+        json={
+            "data": {
+                "audits": [
+                    {"name": "one", "admin_jid": "a@test", "bond": 5, "items": ["x"]},
+                    {"name": "two", "admin_jid": "a@test", "bond": -5},
+                ]
+            }
+        },
+    )
+    assert reply.status_code == 200
+    results = reply.json()["data"]["results"]
+    assert [result["status"] for result in results] == [200, 400]
+    assert bot.audits["one"].items == ["x"]
+    assert "two" not in bot.audits
+
+
+def test_register_audit_endpoint(client, bot):
+    reply = client.post(
+        "/register_audit/",
+        json={"data": {"name": "one", "admin_jid": "a@test", "bond": 5}},
+    )
+    assert reply.json() == 200
+    assert bot.jid_in_admin("a@test").name == "one"
+
+
+def test_item_and_outstanding_pages(client, bot):
+    audit = started_audit(auditors=2, items=5, per_item=2)
+    bot.add_audit(audit)
+    reply = client.get("/audits/audit/items/", params={"cursor": 3, "limit": 10})
+    assert reply.json() == {
+        "items": [
+            {"number": 3, "description": "item 3"},
+            {"number": 4, "description": "item 4"},
+        ],
+        "next_cursor": None,
+    }
+    reply = client.get(
+        "/audits/audit/outstanding/", params={"limit": 2, "item": 1}
+    ).json()
+    assert [i["inspection_id"] for i in reply["inspections"]] == [2, 3]
+    assert reply["next_cursor"] is None
+    reply = client.get("/audits/audit/outstanding/", params={"limit": 4}).json()
+    assert reply["next_cursor"] == 4
+    assert client.get("/audits/missing/items/").status_code == 404
+    assert client.get("/audits/missing/outstanding/").status_code == 404
+
+
+def test_data_dump_job_runs(client, bot, monkeypatch):
+    import rwa
+    from jobs import SettlementJobs
+
+    jobs = SettlementJobs(bot.loop, "http://node.test/resume")
+    monkeypatch.setattr(rwa, "jobs", jobs)
+    audit = started_audit(auditors=3, items=1, per_item=3)
+    bot.add_audit(audit)
+
+    def data_dump(name, job_id):
+        return client.post("/data_dump/", json={"id": job_id, "data": {"name": name}})
+
+    reply = data_dump("unknown", "run0")
+    assert reply.status_code == 404
+    assert jobs.pending == {}
+
+    assert data_dump("audit", "run1").json() == {"jobRunID": "run1", "pending": True}
+    assert data_dump("audit", "run1").json() == {"jobRunID": "run1", "pending": True}
+    assert list(jobs.pending["audit"]) == ["run1"]
+
+    for inspection_id in range(3):
+        audit.set_audit_by_audit(inspection_id, True)
+    audit.calculate_results()
+    settlement = {"response": audit.settlement, "hash": audit.settlement_hash}
+    # Settled before the callback went out, so it is answered here instead
+    assert data_dump("audit", "run1").json() == {"data": settlement}
+    assert jobs.pending == {}
+
+    reply = client.post("/data_dump/ack/", json={"data": {"name": "audit"}})
+    assert reply.json() == {"data": {"acknowledged": True}}
+    assert data_dump("audit", "run2").json() == {"data": settlement}
@@ -0,0 +1,55 @@
+import asyncio
+
+import pytest
+
+from jobs import SettlementJobs
+
+
+@pytest.fixture
+def jobs():
+    loop = asyncio.new_event_loop()
+    jobs = SettlementJobs(loop, "http://node.test/resume")
+    posted = []
+
+    async def post(job_id, settlement):
+        posted.append((job_id, settlement))
+        return True
+
+    jobs.post = post
+    jobs.posted = posted
+    yield jobs
+    loop.close()
+
+
+def test_a_run_asked_about_twice_is_called_back_once(jobs):
+    assert jobs.add("audit", "run1")
+    assert not jobs.add("audit", "run1")
+    assert jobs.add("audit", "run2")
+    jobs.settled("audit", {"response": "0x", "hash": "0x01"})
+    jobs.loop.run_until_complete(asyncio.sleep(0.01))
+    assert sorted(job_id for job_id, _ in jobs.posted) == ["run1", "run2"]
+    assert jobs.pending == {}
+
+
+def test_taken_runs_are_not_called_back(jobs):
+    jobs.add("audit", "run1")
+    assert jobs.take("audit", "run1")
+    assert not jobs.take("audit", "run1")
+    jobs.settled("audit", {"response": "0x", "hash": "0x01"})
+    jobs.loop.run_until_complete(asyncio.sleep(0.01))
+    assert jobs.posted == []
+
+
+def test_runs_left_waiting_expire(jobs, monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr("jobs.time.monotonic", lambda: now[0])
+    jobs.max_age = 60
+    jobs.add("old", "run1")
+    jobs.add("audit", "run2")
+    jobs.take("audit", "run2")
+    now[0] += 30
+    jobs.add("audit", "run2")
+    now[0] += 31
+    jobs.expire()
+    # run2 was added again since, so only its first entry has expired
+    assert jobs.pending == {"audit": {"run2": 1030.0}}
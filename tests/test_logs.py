@@ -0,0 +1,72 @@
+import io
+import json
+import logging
+import queue
+
+import pytest
+
+import logs
+from logs import DroppingQueueHandler, JSONFormatter, log_event, setup_logging
+
+
+@pytest.fixture
+def root():
+    # Puts the root logger back as it was after setup_logging replaced it
+    root = logging.getLogger()
+    handlers, level = list(root.handlers), root.level
+    yield root
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    for handler in handlers:
+        root.addHandler(handler)
+    root.setLevel(level)
+
+
+def record(message="message", **extra):
+    record = logging.LogRecord("rwa", logging.INFO, __file__, 1, message, (), None)
+    record.__dict__.update(extra)
+    return record
+
+
+def test_json_lines_cap_large_fields():
+    formatter = JSONFormatter({"shard": 2}, max_length=5, max_items=2)
+    fields = {"addresses": ["0xaaaaaaaa", "0xb", "0xc"], "count": 3}
+    entry = json.loads(
+        formatter.format(record("x" * 8, event="outcome", fields=fields, sampled=1))
+    )
+    assert entry["message"] == "xxxxx... (8 chars)"
+    assert entry["shard"] == 2 and entry["event"] == "outcome"
+    assert entry["addresses"] == ["0xaaa... (10 chars)", "0xb", "... (3 items)"]
+    assert entry["count"] == 3
+    assert "sampled" not in entry
+
+
+def test_full_queue_drops_and_the_next_record_says_so():
+    handler = DroppingQueueHandler(queue.Queue(1))
+    handler.handle(record("kept"))
+    handler.handle(record("lost"))
+    handler.handle(record("lost"))
+    assert handler.dropped == 2
+    handler.queue.get_nowait()
+    handler.handle(record("after"))
+    assert handler.queue.get_nowait().dropped_before == 2
+
+
+def test_sampled_events_are_counted_but_only_some_logged(root, monkeypatch):
+    stream = io.StringIO()
+    listener = setup_logging(stream=stream, bot="bot@test")
+    monkeypatch.setitem(logs.SAMPLE_EVERY, "stanza", 3)
+    monkeypatch.setattr(logs, "_seen", {})
+    for n in range(5):
+        log_event("stanza", "Stanza handled", handler="admin_command", n=n)
+    log_event("done", "Finished", logging.WARNING)
+    listener.stop()
+
+    entries = [json.loads(line) for line in stream.getvalue().splitlines()]
+    assert [(entry["event"], entry.get("n")) for entry in entries] == [
+        ("stanza", 0),
+        ("stanza", 3),
+        ("done", None),
+    ]
+    assert entries[0]["sampled"] == 3 and entries[0]["bot"] == "bot@test"
+    assert entries[2]["level"] == "WARNING"
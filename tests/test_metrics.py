@@ -0,0 +1,52 @@
+from helpers import chat, started_audit
+from metrics import Registry, render, with_labels
+
+
+def test_render_merges_families_and_escapes_labels():
+    one, two = Registry(), Registry()
+    one.counter("requests_total", "Requests", ("path",)).inc('a"b')
+    two.counter("requests_total", "Requests", ("path",)).inc("c", amount=2)
+    two.gauge("pending", "Waiting", collect=lambda: 3)
+
+    text = render(one.collect() + with_labels(two.collect(), shard=1))
+    assert text == (
+        "# HELP requests_total Requests\n"
+        "# TYPE requests_total counter\n"
+        'requests_total{path="a\\"b"} 1.0\n'
+        'requests_total{shard="1",path="c"} 2.0\n'
+        "# HELP pending Waiting\n"
+        "# TYPE pending gauge\n"
+        'pending{shard="1"} 3.0\n'
+    )
+
+
+def test_histogram_buckets_are_cumulative():
+    registry = Registry()
+    latency = registry.histogram("seconds", "Latency", ("handler",), (0.1, 1.0))
+    for value in (0.05, 0.1, 0.5, 2.0):
+        latency.observe(value, "admin")
+    ((_, _, _, samples),) = registry.collect()
+    assert [(name, labels.get("le"), value) for name, labels, value in samples] == [
+        ("seconds_bucket", "0.1", 2),
+        ("seconds_bucket", "1.0", 3),
+        ("seconds_bucket", "+Inf", 4),
+        ("seconds_sum", None, 2.65),
+        ("seconds_count", None, 4),
+    ]
+
+
+def test_metrics_endpoint_shows_bot_and_http_series(bot, client):
+    bot.add_audit(started_audit())
+    chat(bot, "admin@audit", "help")
+    client.get("/metrics")
+
+    reply = client.get("/metrics")
+    assert reply.headers["content-type"].startswith("text/plain; version=0.0.4")
+    text = reply.text
+    assert 'rwa_stanzas_total{handler="admin_command"} 1.0' in text
+    assert 'rwa_audits{state="AUDITING"} 1.0' in text
+    assert "rwa_outstanding_inspections 12.0" in text
+    assert (
+        'rwa_http_requests_total{endpoint="metrics",method="GET",status="200"} 1.0'
+        in text
+    )
@@ -0,0 +1,147 @@
+import asyncio
+import logging
+
+from helpers import chat, sent, started_audit
+from outbound import OutboundQueue, Reply
+
+
+def sent_by(queue, seconds=0.05):
+    # Runs the queue on a fresh loop for a while, returns what it sent
+    sent = []
+    queue.send = lambda mto, mbody, mtype: sent.append((mto, mbody))
+    loop = asyncio.new_event_loop()
+    queue.start(loop)
+    loop.run_until_complete(asyncio.sleep(seconds))
+    queue.stop()
+    loop.run_until_complete(asyncio.sleep(0))
+    loop.close()
+    return sent
+
+
+def test_recipients_take_turns_and_keep_their_order():
+    queue = OutboundQueue(None, rate=0)
+    for n in range(3):
+        queue.put("a@test", f"a{n}")
+    queue.put("b@test", "b0")
+    queue.put("b@test", "b1")
+    assert sent_by(queue) == [
+        ("a@test", "a0"),
+        ("b@test", "b0"),
+        ("a@test", "a1"),
+        ("b@test", "b1"),
+        ("a@test", "a2"),
+    ]
+    assert queue.stats()["sent"] == 5
+    assert queue.pending() == 0
+
+
+def test_send_rate_is_capped_by_the_token_bucket():
+    queue = OutboundQueue(None, rate=20, burst=5)
+    for n in range(50):
+        queue.put(f"{n}@test", "hello")
+    sent = sent_by(queue, 0.25)
+    # The burst, then about 20 a second
+    assert 5 <= len(sent) <= 12
+    assert queue.pending() == 50 - len(sent)
+
+
+def test_full_queue_drops_only_droppable_messages(caplog):
+    queue = OutboundQueue(None, max_pending=2)
+    assert queue.put("a@test", "one")
+    assert queue.put("b@test", "two", droppable=True)
+    with caplog.at_level(logging.WARNING):
+        assert not queue.put("c@test", "notice", droppable=True)
+        assert not queue.put("d@test", "notice", droppable=True)
+    # Every drop is logged and counted
+    assert [record.fields["to"] for record in caplog.records] == ["c@test", "d@test"]
+    assert queue.stats()["dropped"] == 2
+
+    # Assignments and replies are queued past the limit
+    assert queue.put("c@test", "assignment")
+    assert queue.pending() == 3
+    assert sent_by(queue) == [
+        ("a@test", "one"),
+        ("b@test", "two"),
+        ("c@test", "assignment"),
+    ]
+
+
+def test_drain_hands_back_waiting_messages_in_order():
+    queue = OutboundQueue(None)
+    queue.put("a@test", "a0")
+    queue.put("b@test", "b0", "normal", droppable=True)
+    queue.put("a@test", "a1")
+    assert queue.drain() == [
+        ("a@test", "a0", "chat", False),
+        ("a@test", "a1", "chat", False),
+        ("b@test", "b0", "normal", True),
+    ]
+    assert queue.pending() == 0
+    assert queue.stats()["recipients"] == 0
+
+
+def test_failed_send_does_not_stop_the_queue():
+    queue = OutboundQueue(None, rate=0)
+    queue.put("a@test", "boom")
+    queue.put("b@test", "fine")
+    sent = []
+
+    def send(mto, mbody, mtype):
+        if mbody == "boom":
+            raise ConnectionError("gone")
+        sent.append(mto)
+
+    queue.send = send
+    loop = asyncio.new_event_loop()
+    queue.start(loop)
+    loop.run_until_complete(asyncio.sleep(0.02))
+    queue.stop()
+    loop.run_until_complete(asyncio.sleep(0))
+    loop.close()
+    assert sent == ["b@test"]
+
+
+def test_bot_drops_broadcast_notices_but_not_assignments(bot):
+    audit = started_audit(auditors=3, items=2, per_item=3)
+    bot.add_audit(audit)
+    bot.outbound.max_pending = 0
+
+    bot.notify_auditors(audit, "notice")
+    assert sent(bot) == []
+    assert bot.outbound.dropped == 3
+    bot.notify_all_auditors_of_current_inspection(audit)
+    assert [mto for mto, _ in sent(bot)] == list(audit.auditors)
+
+
+def reply_chunks(lines, max_length):
+    reply = Reply(None, "a@test", max_length=max_length)
+    for line in lines:
+        reply(line)
+    return list(reply.chunks())
+
+
+def test_reply_joins_lines_into_one_message():
+    messages = []
+    reply = Reply(lambda **message: messages.append(message), "a@test")
+    reply("one")
+    reply(2)
+    reply.flush()
+    reply.flush()
+    assert messages == [{"mto": "a@test", "mbody": "one\n2", "mtype": "chat"}]
+
+
+def test_reply_splits_at_max_length():
+    assert reply_chunks(["aaaa", "bbbb", "cc"], 9) == ["aaaa\nbbbb", "cc"]
+    # A line longer than a message is cut up
+    assert reply_chunks(["a", "b" * 12, "c"], 5) == ["a", "bbbbb", "bbbbb", "bb\nc"]
+    assert all(len(chunk) <= 7 for chunk in reply_chunks(["x" * 3] * 20, 7))
+
+
+def test_bot_answers_one_message_with_one_stanza(bot):
+    bot.create_audit({"name": "audit", "admin_jid": "admin@test", "bond": 10})
+    chat(bot, "admin@test", "help")
+    messages = sent(bot)
+    assert len(messages) == 1
+    mto, body = messages[0]
+    assert mto == "admin@test"
+    assert "Command not found" in body and "open : Allows auditors to register" in body
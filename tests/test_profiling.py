@@ -0,0 +1,87 @@
+import asyncio
+import os
+import pstats
+import time
+
+import pytest
+
+from helpers import chat, sent, started_audit
+from profiling import Profiler
+
+
+@pytest.fixture
+def loop():
+    loop = asyncio.new_event_loop()
+    yield loop
+    loop.close()
+
+
+def test_profiler_refuses_bad_windows_and_overlaps(loop, tmp_path):
+    profiler = Profiler(loop, str(tmp_path))
+    with pytest.raises(ValueError):
+        profiler.start("tracing", 5)
+    with pytest.raises(ValueError):
+        profiler.start("sampling", 0)
+    profiler.start("deterministic", 5)
+    with pytest.raises(ValueError):
+        profiler.start("sampling", 5)
+    profiler.stop()
+    assert profiler.stop() is None
+
+
+def test_deterministic_window_writes_pstats(loop, tmp_path):
+    profiler = Profiler(loop, str(tmp_path))
+    written = []
+    path = profiler.start("deterministic", 5, written.append)
+    assert profiler.active
+    assert profiler.call(sorted, [3, 1, 2]) == [1, 2, 3]
+    assert profiler.stop() == path
+    assert written == [path] and not profiler.active
+    assert any("sorted" in name for _, _, name in pstats.Stats(path).stats)
+
+
+def test_sampling_window_ends_on_its_own(loop, tmp_path):
+    profiler = Profiler(loop, str(tmp_path), interval=0.001)
+    written = []
+    path = profiler.start("sampling", 0.05, written.append)
+    # The main thread is busy here, so it shows up in the samples
+    loop.call_soon(time.sleep, 0.02)
+    loop.run_until_complete(asyncio.sleep(0.1))
+    assert written == [path] and profiler.mode is None
+    with open(path) as output:
+        assert "MainThread;" in output.read()
+
+
+def test_admin_profiles_the_bot(bot, tmp_path):
+    bot.profiler.directory = str(tmp_path)
+    bot.add_audit(started_audit())
+    sent(bot)
+
+    chat(bot, "admin@audit", "profile deterministic 5")
+    assert bot.profiler.active
+    chat(bot, "admin@audit", "help")
+    chat(bot, "admin@audit", "profile stop")
+    (path,) = os.listdir(tmp_path)
+    assert (
+        "admin@audit",
+        f"Profile written to {os.path.join(str(tmp_path), path)}",
+    ) in sent(bot)
+    assert any(
+        name == "admin_command"
+        for _, _, name in pstats.Stats(str(tmp_path / path)).stats
+    )
+
+
+def test_profile_endpoints(bot, client, tmp_path):
+    bot.profiler.directory = str(tmp_path)
+    reply = client.post("/profile/", json={"data": {"mode": "sampling", "seconds": 5}})
+    (started,) = reply.json()["data"]["results"]
+    assert started["mode"] == "sampling"
+    assert started["path"].startswith(str(tmp_path))
+
+    reply = client.post("/profile/", json={"data": {"mode": "sampling"}})
+    assert "Already profiling" in reply.json()["data"]["results"][0]["error"]
+
+    reply = client.post("/profile/stop/")
+    assert reply.json()["data"]["results"] == [{"path": started["path"]}]
+    assert os.path.exists(started["path"])
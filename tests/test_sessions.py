@@ -0,0 +1,97 @@
+import asyncio
+
+import pytest
+from slixmpp import JID
+
+from sessions import SessionPool, read_accounts
+
+
+class Session:
+    # Stands in for a slixmpp client, recording what it is asked to do
+    def __init__(self, jid, loop):
+        self.boundjid = JID(jid)
+        self.loop = loop
+        self.handlers = {}
+        self.connects = 0
+
+    def register_plugin(self, name):
+        pass
+
+    def add_event_handler(self, event, handler):
+        self.handlers[event] = handler
+
+    def send_now(self, mto, mbody, mtype):
+        pass
+
+    def connect(self):
+        self.connects += 1
+
+
+@pytest.fixture
+def pool():
+    loop = asyncio.new_event_loop()
+    pool = SessionPool(lambda msg: None, rate=0, retry_delay=0)
+    for n in range(3):
+        session = Session(f"bot{n}@test", loop)
+        pool.add(session)
+        session.handlers["session_start"](None)
+    yield pool
+    pool.stop()
+    loop.run_until_complete(asyncio.sleep(0))
+    loop.close()
+
+
+def stanza(sender, mtype="chat"):
+    return {"from": JID(sender), "type": mtype}
+
+
+def test_contacts_keep_the_account_they_wrote_to(pool):
+    owner = pool.session_for("auditor@test")
+    assert owner == pool.ring.lookup("auditor@test")
+    other = next(account for account in pool.sessions if account != owner)
+    pool.sessions[other].handlers["message"](stanza("auditor@test"))
+    assert pool.session_for("auditor@test") == other
+    # Group chat does not move anyone
+    pool.sessions[owner].handlers["message"](stanza("auditor@test", "groupchat"))
+    assert pool.session_for("auditor@test") == other
+
+
+def test_lost_account_hands_its_messages_to_the_next(pool):
+    account = pool.session_for("auditor@test")
+    pool.sticky["auditor@test"] = account
+    pool.put("auditor@test", "assignment")
+    pool.put("auditor@test", "notice", droppable=True)
+
+    session = pool.sessions[account]
+    session.handlers["disconnected"](None)
+    assert account not in pool.up and pool.queues[account].pending() == 0
+    live = pool.session_for("auditor@test")
+    assert live != account and pool.failovers == 1
+    assert pool.queues[live].drain() == [
+        ("auditor@test", "assignment", "chat", False),
+        ("auditor@test", "notice", "chat", True),
+    ]
+    assert pool.sessions_up()[(account,)] == 0
+
+    # It reconnects after retry_delay and is used again
+    session.loop.run_until_complete(asyncio.sleep(0.01))
+    assert session.connects == 1
+    session.handlers["session_start"](None)
+    assert pool.sessions_up()[(account,)] == 1
+
+
+def test_stats_add_up_over_accounts(pool):
+    for n in range(10):
+        pool.put(f"auditor{n}@test", "hello")
+    stats = pool.stats()
+    assert stats["pending"] == 10
+    assert stats["recipients"] == 10
+
+
+def test_accounts_file_skips_comments_and_blank_lines(tmp_path):
+    path = tmp_path / "accounts"
+    path.write_text("# extra bots\nbot1@test secret\n\nbot2@test two words\n")
+    assert read_accounts(str(path)) == [
+        ("bot1@test", "secret"),
+        ("bot2@test", "two words"),
+    ]
@@ -0,0 +1,172 @@
+import asyncio
+import multiprocessing
+from collections import Counter
+
+import pytest
+
+from hashring import HashRing
+from helpers import make_audit
+
+
+def test_ring_spreads_keys_and_moves_few_when_a_node_is_added():
+    keys = [f"audit {n}" for n in range(3000)]
+    ring = HashRing(range(4))
+    owners = {key: ring.lookup(key) for key in keys}
+    assert owners == {key: HashRing(range(4)).lookup(key) for key in keys}
+    counts = Counter(owners.values())
+    assert set(counts) == {0, 1, 2, 3}
+    assert min(counts.values()) > 3000 / 4 / 2
+
+    grown = HashRing(range(5))
+    moved = [key for key in keys if grown.lookup(key) != owners[key]]
+    # Only keys taken by the new node move
+    assert all(grown.lookup(key) == 4 for key in moved)
+    assert len(moved) < 3000 / 5 * 1.5
+
+
+def test_ring_walk_starts_at_the_owner_and_visits_every_node_once():
+    ring = HashRing(["a", "b", "c"])
+    for key in ("x", "y", "z"):
+        walk = list(ring.walk(key))
+        assert walk[0] == ring.lookup(key)
+        assert sorted(walk) == ["a", "b", "c"]
+
+
+@pytest.fixture
+def loop():
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    yield loop
+    for task in asyncio.all_tasks(loop):
+        task.cancel()
+    loop.run_until_complete(asyncio.sleep(0))
+    loop.close()
+    asyncio.set_event_loop(None)
+
+
+class Worker:
+    # Stands in for a worker process's end of the pipe
+    def __init__(self):
+        self.received = []
+
+    def send(self, message):
+        self.received.append(message)
+
+
+@pytest.fixture
+def router(loop):
+    from shards import ShardRouter
+
+    router = ShardRouter("bot@test", "", 0)
+    router.loop_lag.stop()
+    router.ring = HashRing(range(3))
+    router.workers = [(None, Worker()) for _ in range(3)]
+    return router
+
+
+def stanza(router, jid, body):
+    router.message(
+        router.make_message(mto="bot@test", mbody=body, mtype="chat", mfrom=jid)
+    )
+
+
+def test_router_sends_known_jids_to_their_shards_and_new_ones_by_audit(router):
+    owner = router.ring.lookup("audit")
+    other = (owner + 1) % 3
+    router.audit_names.add("audit")
+    stanza(router, "new@test", "audit")
+    assert router.workers[owner][1].received == [
+        ("stanza", "new@test", "audit", "chat")
+    ]
+
+    # Known on another shard, but joining this audit
+    router.routes["known@test"] = {other}
+    stanza(router, "known@test", "audit")
+    assert router.workers[owner][1].received[-1][1] == "known@test"
+
+    # An admin of audits on two shards reaches both
+    router.routes["admin@test"] = {owner, other}
+    stanza(router, "admin@test", "start")
+    stanza(router, "known@test", "0xabc")
+    assert router.workers[owner][1].received[-1][1:3] == ("admin@test", "start")
+    assert [message[1:3] for message in router.workers[other][1].received] == [
+        ("admin@test", "start"),
+        ("known@test", "0xabc"),
+    ]
+
+
+def test_shard_bot_reports_routes_and_answers_calls(loop):
+    from shards import ShardBot
+
+    conn, child = multiprocessing.Pipe()
+    bot = ShardBot("bot@test", child)
+    bot.loop_lag.stop()
+    audit = make_audit(auditors=0)
+    assert bot.add_audit(audit) == 200
+    assert conn.recv() == ("audit", "audit")
+    assert conn.recv() == ("route", "admin@audit")
+
+    conn.send(("stanza", "new@test", "audit", "chat"))
+    conn.send(("call", 7, "items_page", ("audit", 0, 2)))
+    conn.send(("call", 8, "no_such_method", ()))
+    bot.receive()
+    # The new auditor is routed here and gets the registration prompt
+    assert conn.recv() == ("route", "new@test")
+    kind, mto, body, mtype, droppable = conn.recv()
+    assert (kind, mto, mtype, droppable) == ("send", "new@test", "chat", False)
+    assert "registered for project" in body
+    assert conn.recv() == (
+        "result",
+        7,
+        True,
+        {
+            "items": [
+                {"number": 0, "description": "item 0"},
+                {"number": 1, "description": "item 1"},
+            ],
+            "next_cursor": 2,
+        },
+    )
+    request, ok = conn.recv()[1:3]
+    assert (request, ok) == (8, False)
+    bot.deadlines.clear()
+
+
+def test_router_learns_routes_and_resolves_calls_from_workers(router, loop):
+    conn, child = multiprocessing.Pipe()
+    shard = router.ring.lookup("audit")
+    router.workers[shard] = (None, conn)
+
+    async def call():
+        pending = loop.create_task(router.call("audit", "items_page", "audit"))
+        await asyncio.sleep(0)
+        assert child.recv() == ("call", 0, "items_page", ("audit",))
+        child.send(("audit", "audit"))
+        child.send(("route", "auditor@test"))
+        child.send(("route", "admin@test"))
+        child.send(("result", 0, True, {"items": []}))
+        router.receive(shard)
+        return await pending
+
+    assert loop.run_until_complete(call()) == {"items": []}
+    assert router.routes == {"auditor@test": {shard}, "admin@test": {shard}}
+    assert router.audit_names == {"audit"}
+
+
+def test_stopped_workers_write_out_their_last_commits(loop, tmp_path):
+    from shards import ShardRouter
+    from storage import SQLiteAuditStore
+
+    db = str(tmp_path / "audits.db")
+    router = ShardRouter("bot@test", "", 1, db=db)
+    router.loop_lag.stop()
+    fields = {"name": "audit", "admin_jid": "admin@test", "bond": 5}
+    assert router.loop.run_until_complete(router.register_audit(fields)) == 200
+    # Straight away, before the worker's group commit timer fires
+    router.stop_workers()
+    process, _ = router.workers[0]
+    assert process.exitcode == 0
+
+    store = SQLiteAuditStore(f"{db}.0")
+    assert store.active_audits() == {"audit"}
+    store.close()
@@ -0,0 +1,194 @@
+import asyncio
+import sqlite3
+
+import pytest
+
+from audit import AssignmentMode, Audits, State
+from helpers import make_audit, started_audit
+from storage import SQLiteAuditStore
+
+
+@pytest.fixture
+def path(tmp_path):
+    return str(tmp_path / "audits.db")
+
+
+@pytest.fixture
+def loop():
+    # Never run, it only gives the store somewhere to schedule group commits
+    loop = asyncio.new_event_loop()
+    yield loop
+    loop.close()
+
+
+def item_rows(store, name):
+    return store.db.execute(
+        "SELECT description FROM items WHERE audit = ? ORDER BY number", (name,)
+    ).fetchall()
+
+
+def test_audit_is_reloaded_as_it_was_saved(path):
+    store = SQLiteAuditStore(path)
+    audits = Audits(store)
+    audit = started_audit(auditors=3, items=4, per_item=3)
+    audits.add_audit(audit)
+    for inspection_id, finding in ((0, True), (4, False), (7, True)):
+        audit.set_audit_by_audit(inspection_id, finding)
+    audits.persist(audit)
+    store.close()
+
+    store = SQLiteAuditStore(path)
+    reloaded = Audits(store)
+    # Active audits are routed at once but only read when first looked up
+    assert dict.get(reloaded.audits, "audit") is None
+    assert reloaded.jid_in_admin("admin@audit").name == "audit"
+    loaded = reloaded.audits["audit"]
+    assert loaded.state == State.AUDITING
+    assert loaded.items == audit.items
+    assert loaded.auditors == audit.auditors
+    assert loaded.get_inspections(range(12)) == audit.get_inspections(range(12))
+    assert loaded.outstanding_count() == 9
+    store.close()
+
+
+def test_group_commit_waits_for_the_timer_or_a_full_batch(path, loop):
+    store = SQLiteAuditStore(path, max_batch=3)
+    store.attach(loop)
+    audits = Audits(store)
+    audits.add_audit(make_audit(name="one"))
+    audits.add_audit(make_audit(name="two"))
+    assert item_rows(store, "one") == []
+    assert store._commit_handle is not None
+    audits.add_audit(make_audit(name="three"))
+    assert len(item_rows(store, "one")) == 4
+    assert store._commit_handle is None
+    store.close()
+
+
+def test_failed_audit_does_not_lose_the_rest_of_the_group(path, loop):
+    store = SQLiteAuditStore(path)
+    store.attach(loop)
+    audits = Audits(store)
+    good, bad = make_audit(name="good"), make_audit(name="bad")
+    audits.add_audit(bad)
+    audits.add_audit(good)
+
+    write_audit = store._write_audit
+    failing = {"bad"}
+
+    def fail_some(audit):
+        write_audit(audit)
+        if audit.name in failing:
+            raise sqlite3.IntegrityError("injected")
+
+    store._write_audit = fail_some
+    store.flush()
+
+    assert len(item_rows(store, "good")) == 4
+    assert not good._items_dirty and not good._dirty_auditors
+    # The failed audit was rolled back to its savepoint and is still unsaved
+    assert item_rows(store, "bad") == []
+    assert bad._items_dirty and bad._dirty_auditors
+    assert store._dirty == {"bad": bad}
+
+    failing.clear()
+    store.flush()
+    assert len(item_rows(store, "bad")) == 4
+    assert not bad._items_dirty
+    store.close()
+
+
+class FailingCommit:
+    # Connection whose next COMMIT fails
+    def __init__(self, db):
+        self.db = db
+        self.fail = True
+
+    def __getattr__(self, name):
+        return getattr(self.db, name)
+
+    def execute(self, sql, *args):
+        if sql == "COMMIT" and self.fail:
+            self.fail = False
+            raise sqlite3.OperationalError("disk I/O error")
+        return self.db.execute(sql, *args)
+
+
+def test_failed_commit_requeues_the_whole_group(path, loop):
+    store = SQLiteAuditStore(path)
+    store.attach(loop)
+    audits = Audits(store)
+    first, second = make_audit(name="first"), make_audit(name="second")
+    audits.add_audit(first)
+    audits.add_audit(second)
+    store.db = FailingCommit(store.db)
+
+    with pytest.raises(sqlite3.OperationalError):
+        store.flush()
+    assert item_rows(store, "first") == item_rows(store, "second") == []
+    assert first._items_dirty and second._items_dirty
+    assert set(store._dirty) == {"first", "second"}
+
+    store.flush()
+    assert len(item_rows(store, "first")) == len(item_rows(store, "second")) == 4
+    store.close()
+
+
+def test_completed_audits_are_not_loaded(path):
+    store = SQLiteAuditStore(path)
+    audits = Audits(store)
+    audit = make_audit(name="done")
+    audit.state = State.COMPLETE
+    audits.add_audit(audit)
+    audits.add_audit(make_audit(name="active"))
+    store.close()
+
+    store = SQLiteAuditStore(path)
+    assert store.active_audits() == {"active"}
+    assert "done" not in Audits(store).audits
+    store.close()
+
+
+def test_dynamic_assignment_history_is_reloaded(path):
+    store = SQLiteAuditStore(path)
+    audits = Audits(store)
+    audit = started_audit(
+        auditors=4, items=2, per_item=2, assignment=AssignmentMode.DYNAMIC
+    )
+    audits.add_audit(audit)
+    slow, fast = audit.auditors["auditor0@audit"], audit.auditors["auditor1@audit"]
+    audit.expire_inspection(slow.current_inspection)
+    audit.set_audit_by_audit(fast.current_inspection, True)
+    audit._parked[slow.jid] = None
+    audit.touch_auditor(slow.jid)
+    audits.persist(audit)
+    store.close()
+
+    store = SQLiteAuditStore(path)
+    loaded = Audits(store).audits["audit"]
+    assert loaded._auditor_items == audit._auditor_items
+    assert loaded._answer_time == audit._answer_time
+    assert loaded.is_parked(loaded.auditors[slow.jid])
+    # The item taken away by the timeout is still not theirs to take
+    assert loaded._eligible_item(slow.jid) is None
+    store.close()
+
+
+def test_name_of_a_completed_audit_stays_taken_after_a_restart(path):
+    store = SQLiteAuditStore(path)
+    audit = started_audit(name="done")
+    audit.state = State.COMPLETE
+    Audits(store).add_audit(audit)
+    store.close()
+
+    store = SQLiteAuditStore(path)
+    audits = Audits(store)
+    assert audits.add_audit(make_audit(name="done")) == "9"
+    (result,) = audits.register_audits(
+        [{"name": "done", "admin_jid": "admin@done", "bond": 5}]
+    )
+    assert result["status"] == 409
+    assert store.load_audit("done").get_inspections(range(12)) == (
+        audit.get_inspections(range(12))
+    )
+    store.close()
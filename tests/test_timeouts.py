@@ -0,0 +1,52 @@
+import asyncio
+
+from timeouts import TimerWheel
+
+
+def test_deadlines_expire_once_unless_cancelled():
+    loop = asyncio.new_event_loop()
+    expired = []
+    wheel = TimerWheel(loop, expired.append, tick=0.01, size=4)
+    wheel.add("late", 0.01)
+    # Longer than a turn of the wheel
+    wheel.add("later", 0.2)
+    wheel.add("answered", 0.01)
+    wheel.cancel("answered")
+    loop.run_until_complete(asyncio.sleep(0.05))
+    assert expired == ["late"]
+    loop.run_until_complete(asyncio.sleep(0.25))
+    assert expired == ["late", "later"]
+    assert len(wheel) == 0 and wheel._handle is None
+    loop.close()
+
+
+class Clock:
+    # A loop whose time is set by the test, _advance is called by hand
+    def __init__(self):
+        self.now = 0.0
+
+    def time(self):
+        return self.now
+
+    def call_at(self, when, callback):
+        # Stands in for the timer handle too
+        return self
+
+    def cancel(self):
+        pass
+
+
+def test_deadline_added_between_ticks_does_not_fire_early():
+    clock = Clock()
+    expired = []
+    wheel = TimerWheel(clock, lambda key: expired.append((key, clock.now)))
+    wheel.add("first", 1.0)
+    # Keeps the wheel turning, so "second" is added between two ticks
+    wheel.add("keeper", 10.0)
+    for now in (1.0, 1.5, 2.0, 2.5, 3.0):
+        clock.now = now
+        if now == 1.5:
+            wheel.add("second", 1.0)
+        elif now == int(now):
+            wheel._advance()
+    assert expired == [("first", 1.0), ("second", 3.0)]
@@ -0,0 +1,60 @@
+import asyncio
+import importlib.util
+import os
+from argparse import Namespace
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def load(path):
+    # The scripts are not packages, so they are loaded from their files
+    name = os.path.splitext(os.path.basename(path))[0]
+    spec = importlib.util.spec_from_file_location(name, os.path.join(ROOT, path))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def test_load_generator_runs_full_lifecycles_in_process():
+    load_generator = load("test_scripts/load_generator.py")
+    options = Namespace(
+        transport="local",
+        audits=2,
+        auditors=4,
+        items=5,
+        per_item=3,
+        bond=1000,
+        think=0.0,
+        slow_fraction=0.0,
+        slow_factor=10.0,
+        assignment="static",
+        prefix="load_",
+        domain="test",
+        send_rate=0.0,
+    )
+    report = asyncio.run(load_generator.main(options))
+    assert report["failures"] == []
+    assert report["sessions"] == 2 * 5
+    # Every inspection answered once, each answer timed to the next reply
+    assert report["answers"] == 2 * 5 * 3
+    assert report["latency_ms"]["p50"] is not None
+    assert report["lifecycle_seconds"]["max"] > 0
+
+
+def test_scaling_benchmark_times_every_stage():
+    audit_scaling = load("benchmarks/audit_scaling.py")
+    runs = []
+    for auditors, items in ((5, 20), (10, 40)):
+        inspections, stages = audit_scaling.run_audit(auditors, items, 3, 10, False)
+        assert inspections == items * 3
+        assert set(stages) == set(audit_scaling.STAGES)
+        assert stages["auditor_command"]["operations"] == 10
+        runs.append(
+            {
+                "size": f"{auditors}x{items}",
+                "inspections": inspections,
+                "stages": stages,
+            }
+        )
+    exponents = audit_scaling.scaling_exponents(runs)
+    assert [(step["from"], step["to"]) for step in exponents] == [("5x20", "10x40")]
@@ -0,0 +1,86 @@
+#!/usr/bin/env python3
+
+import logging
+import math
+
+
+class TimerWheel:
+    """
+    Hashed timer wheel on an asyncio loop. Adding and cancelling a deadline
+    is O(1) however many are pending, and the loop is woken once per tick
+    while any are. Deadlines fire on the first tick at or after them, so up
+    to one tick late and never early.
+    """
+
+    def __init__(self, loop, on_expire, tick: float = 1.0, size: int = 512):
+        # on_expire(key) is called once for each key whose deadline passes
+        self.loop = loop
+        self.on_expire = on_expire
+        self.tick = tick
+        self.size = size
+
+        # Each slot maps key -> full turns of the wheel still to wait
+        self._slots = [dict() for _ in range(size)]
+        self._where = {}
+        self._cursor = 0
+        self._next_tick = None
+        self._handle = None
+
+    def __len__(self):
+        return len(self._where)
+
+    def __contains__(self, key):
+        return key in self._where
+
+    def add(self, key, delay: float):
+        # (Re)arm key to expire delay seconds from now
+        self.cancel(key)
+        now = self.loop.time()
+        if self._handle is None:
+            self._next_tick = now + self.tick
+            self._handle = self.loop.call_at(self._next_tick, self._advance)
+        # The slot n after the cursor is reached n - 1 ticks after the next
+        # one, which may be less than a tick away
+        ticks = max(1, 1 + math.ceil((now + delay - self._next_tick) / self.tick))
+        slot = (self._cursor + ticks) % self.size
+        self._slots[slot][key] = (ticks - 1) // self.size
+        self._where[key] = slot
+
+    def cancel(self, key):
+        slot = self._where.pop(key, None)
+        if slot is not None:
+            del self._slots[slot][key]
+
+    def clear(self):
+        for slot in self._slots:
+            slot.clear()
+        self._where.clear()
+        if self._handle is not None:
+            self._handle.cancel()
+            self._handle = None
+
+    def _advance(self):
+        expired = []
+        # Catch up on ticks missed while the loop was busy
+        while self._next_tick <= self.loop.time():
+            self._cursor = (self._cursor + 1) % self.size
+            slot = self._slots[self._cursor]
+            for key, turns in list(slot.items()):
+                if turns == 0:
+                    del slot[key]
+                    del self._where[key]
+                    expired.append(key)
+                else:
+                    slot[key] = turns - 1
+            self._next_tick += self.tick
+
+        if self._where:
+            self._handle = self.loop.call_at(self._next_tick, self._advance)
+        else:
+            self._handle = None
+
+        for key in expired:
+            try:
+                self.on_expire(key)
+            except Exception:
+                logging.exception("Deadline handler failed for %s", key)
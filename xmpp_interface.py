@@ -5,7 +5,9 @@
 # This file is part of Slixmpp.
 # See the file LICENSE for copying permission.
 
+import asyncio
 import logging
+import time
 from getpass import getpass
 from argparse import ArgumentParser
 from typing import Dict
@@ -16,10 +18,44 @@ import slixmpp
 from audit import (
     State,
     AuditorState,
+    AssignmentMode,
     Auditor,
     Audit,
     Audits,
+    PAGE_LIMIT,
+    START_CHUNK,
+    SettlementError,
 )
+from metrics import Registry, LoopLagMonitor, track_outbound, track_sessions
+from outbound import OutboundQueue, Reply
+from profiling import Profiler, DEFAULT_PROFILE_SECONDS
+from logs import log_event, setup_logging
+from sessions import PoolSession, SessionPool
+from timeouts import TimerWheel
+
+
+def parse_page_args(args):
+    # [cursor] [limit] [auditor=<jid>] [item=<number>], None if malformed
+    numbers = []
+    filters = {"auditor": None, "item": None}
+    try:
+        for arg in args:
+            key, sep, value = arg.partition("=")
+            if not sep:
+                numbers.append(int(arg))
+            elif key == "auditor":
+                filters["auditor"] = value
+            elif key == "item":
+                filters["item"] = int(value)
+            else:
+                return None
+    except ValueError:
+        return None
+    if len(numbers) > 2:
+        return None
+    cursor = numbers[0] if numbers else 0
+    limit = numbers[1] if len(numbers) > 1 else PAGE_LIMIT
+    return cursor, limit, filters["auditor"], filters["item"]
 
 
 class RWABot(slixmpp.ClientXMPP, Audits):
@@ -28,14 +64,90 @@ class RWABot(slixmpp.ClientXMPP, Audits):
     A bot that calls functions from XMPP commands
     """
 
-    def __init__(self, jid, password):
+    def __init__(
+        self,
+        jid,
+        password,
+        store=None,
+        send_rate=50.0,
+        send_burst=100,
+        max_outbound=100000,
+        start_chunk=START_CHUNK,
+        start_slice=0.01,
+        profile_dir=".",
+        accounts=(),
+    ):
         self.bot_jid = jid
         slixmpp.ClientXMPP.__init__(self, jid, password)
 
+        # Outgoing messages are queued and drained at send_rate per second
+        self.outbound = OutboundQueue(
+            self.send_now,
+            rate=send_rate,
+            burst=send_burst,
+            max_pending=max_outbound,
+        )
+
         self.add_event_handler("session_start", self.start)
 
-        self.add_event_handler("message", self.message)
-        self.audits = {}
+        # Extra (jid, password) accounts share the chat traffic, each with
+        # its own queue and send_rate. Stanzas on any of them reach message().
+        self.sessions = SessionPool(
+            self.message, rate=send_rate, burst=send_burst, max_pending=max_outbound
+        )
+        self.sessions.add(self, self.outbound)
+        for account_jid, account_password in accounts:
+            self.sessions.add(PoolSession(account_jid, account_password, self.loop))
+
+        # Deadlines of inspections handed to auditors, keyed (audit, id)
+        self.deadlines = TimerWheel(self.loop, self.inspection_expired)
+
+        # Audits whose inspections are being built, see start_audit
+        self.start_chunk = start_chunk
+        self.start_slice = start_slice
+        self._starting = set()
+
+        Audits.__init__(self, store)
+        if store is not None:
+            store.attach(self.loop)
+            self.audits.loaded = self.audit_loaded
+            # Deadlines only live in memory, so timed audits are read now to
+            # start them again
+            for name in store.timed_audits():
+                self.audits.get(name)
+            # Audits whose start_audit was cut short carry on where it stopped
+            for name in store.pending_assignment():
+                self.begin_start(self.audits[name], announce=False)
+
+        self.metrics = Registry()
+        self.stanzas = self.metrics.counter(
+            "rwa_stanzas_total", "Inbound chat stanzas by handler", ("handler",)
+        )
+        self.handler_seconds = self.metrics.histogram(
+            "rwa_handler_seconds", "Time spent handling a chat stanza", ("handler",)
+        )
+        self.metrics.gauge(
+            "rwa_audits", "Loaded audits by state", ("state",), self.audits_by_state
+        )
+        self.metrics.gauge(
+            "rwa_audits_not_loaded",
+            "Active audits in the store not read from disk yet",
+            collect=lambda: len(getattr(self.audits, "stored", ())),
+        )
+        self.metrics.gauge(
+            "rwa_outstanding_inspections",
+            "Inspections not answered yet, over loaded audits",
+            collect=self.outstanding_inspections,
+        )
+        self.track_outbound_metrics()
+        self.loop_lag = LoopLagMonitor(self.loop, self.metrics, "bot")
+        self.loop_lag.start()
+
+        # Turned on at runtime by the admin "profile" command or /profile/
+        self.profiler = Profiler(self.loop, profile_dir)
+
+        # callback(audit name, settlement) once compensation is calculated
+        self.settlement_callbacks = []
 
     async def start(self, event):
         """
@@ -47,6 +159,60 @@ class RWABot(slixmpp.ClientXMPP, Audits):
         self.send_presence()
         await self.get_roster()
 
+    def connect(self, *args, **kwargs):
+        self.sessions.connect(*args, **kwargs)
+        return slixmpp.ClientXMPP.connect(self, *args, **kwargs)
+
+    def track_outbound_metrics(self):
+        track_outbound(self.metrics, self.sessions)
+        track_sessions(self.metrics, self.sessions)
+
+    def audits_by_state(self):
+        counts = {(state.name,): 0 for state in State}
+        for audit in self.audits.values():
+            counts[(audit.state.name,)] += 1
+        return counts
+
+    def outstanding_inspections(self):
+        return sum(audit.outstanding_count() for audit in self.audits.values())
+
+    def collect_metrics(self):
+        return self.metrics.collect()
+
+    def start_profile(
+        self, mode="sampling", seconds=DEFAULT_PROFILE_SECONDS, done=None
+    ):
+        try:
+            path = self.profiler.start(mode, float(seconds), done)
+        except ValueError as error:
+            return {"error": str(error)}
+        return {"mode": mode, "seconds": float(seconds), "path": path}
+
+    def stop_profile(self):
+        return {"path": self.profiler.stop()}
+
+    def profiled(self, method: str, *args):
+        # Runs a bot method, under the profiler while it is on
+        if self.profiler.active:
+            return self.profiler.call(getattr(self, method), *args)
+        return getattr(self, method)(*args)
+
+    def settlement_ready(self, audit: Audit):
+        settlement = {"response": audit.settlement, "hash": audit.settlement_hash}
+        for callback in self.settlement_callbacks:
+            callback(audit.name, settlement)
+
+    def send_message(
+        self, mto, mbody, msubject=None, mtype=None, droppable=False, **kwargs
+    ):
+        # All chat messages go through the outbound queue of the contact's
+        # account. Droppable ones are notices the audit does not depend on,
+        # which may be dropped when the queue is full.
+        self.sessions.put(str(mto), mbody, mtype or "chat", droppable)
+
+    def send_now(self, mto, mbody, mtype):
+        slixmpp.ClientXMPP.send_message(self, mto=mto, mbody=mbody, mtype=mtype)
+
     state_group = {
         "pre_waiting_states": {
             State.INITIALIZATION,
@@ -77,15 +243,19 @@ class RWABot(slixmpp.ClientXMPP, Audits):
 
     def notify_auditors(self, audit: Audit, mbody: str):
         for auditor in audit.auditors:
-            self.send_message(mto=auditor, mbody=mbody, mtype="chat")
+            self.send_message(mto=auditor, mbody=mbody, mtype="chat", droppable=True)
 
-    def notify_auditor_of_current_inspection(self, audit: Audit, auditor: Auditor):
-        mbody = (
+    def current_inspection_message(self, audit: Audit, auditor: Auditor):
+        return (
             audit.messages["assignment_message"]
             + "\n"
             + audit.inspection_id_to_description(auditor.current_inspection)
         )
+
+    def notify_auditor_of_current_inspection(self, audit: Audit, auditor: Auditor):
+        mbody = self.current_inspection_message(audit, auditor)
         self.send_message(mto=auditor.jid, mbody=mbody, mtype="chat")
+        self.arm_deadline(audit, auditor)
 
     def notify_all_auditors_of_current_inspection(self, audit: Audit):
         for auditor in audit.auditors.values():
@@ -96,6 +266,7 @@ class RWABot(slixmpp.ClientXMPP, Audits):
                     + audit.inspection_id_to_description(auditor.current_inspection)
                 )
                 self.send_message(mto=auditor.jid, mbody=mbody, mtype="chat")
+                self.arm_deadline(audit, auditor)
             else:
                 self.send_message(
                     mto=auditor.jid,
@@ -117,7 +288,173 @@ class RWABot(slixmpp.ClientXMPP, Audits):
         for auditor in audit.auditors.values():
             self.notify_auditor_of_compensation(audit, auditor)
 
-    def admin_command(self, audit, msg):
+    def next_inspection(self, audit: Audit, auditor: Auditor, reply):
+        # Give an auditor who just answered, or has nothing in hand, more work
+        if audit.assign_current_inspection(auditor):
+            self.notify_auditor_of_current_inspection(audit, auditor)
+        elif audit.assignment_pending:
+            reply(audit.messages["assignment_pending"])
+        elif audit.is_parked(auditor):
+            reply(audit.messages["auditor_parked"])
+        else:
+            reply(audit.messages["auditor_complete"])
+        self.notify_woken_auditors(audit)
+
+    def begin_start(self, audit: Audit, announce=True):
+        # Runs start_audit as a task, so the handler that started it returns
+        task = self.loop.create_task(self.start_audit(audit, announce))
+        self._starting.add(task)
+        task.add_done_callback(lambda task: self.started(audit, task))
+
+    async def start_audit(self, audit: Audit, announce=True):
+        """
+        Builds a started audit's inspections a chunk at a time, and sends
+        auditors their first inspection as soon as the chunk giving them one
+        is built. The loop is yielded to every start_slice seconds, so other
+        audits, the outbound queue and the HTTP adapter are served meanwhile.
+        An audit reloaded part way through is resumed with announce False,
+        its auditors were already told it started.
+        """
+        slice_end = self.loop.time() + self.start_slice
+
+        async def pause():
+            nonlocal slice_end
+            if self.loop.time() >= slice_end:
+                await asyncio.sleep(0)
+                slice_end = self.loop.time() + self.start_slice
+
+        if announce:
+            for auditor in list(audit.auditors.values()):
+                self.send_message(
+                    mto=auditor.jid,
+                    mbody=audit.messages["start_message"],
+                    mtype="chat",
+                    droppable=True,
+                )
+                await pause()
+
+        for auditors in audit.assign_auditors_in_chunks(self.start_chunk):
+            for auditor in auditors:
+                if auditor.current_inspection is None:
+                    if audit.assign_current_inspection(auditor):
+                        self.notify_auditor_of_current_inspection(audit, auditor)
+                await pause()
+            self.persist(audit)
+            await pause()
+            if self.audits.get(audit.name) is not audit:
+                # Cleared while being built
+                return
+
+        # Everyone still without an inspection: DYNAMIC audits hand out their
+        # first ones here, STATIC auditors with nothing left are told so
+        for auditor in list(audit.auditors.values()):
+            if auditor.current_inspection is None:
+                if audit.assign_current_inspection(auditor):
+                    self.notify_auditor_of_current_inspection(audit, auditor)
+                else:
+                    mbody = audit.messages[
+                        "auditor_parked"
+                        if audit.is_parked(auditor)
+                        else "auditor_complete"
+                    ]
+                    self.send_message(mto=auditor.jid, mbody=mbody, mtype="chat")
+            await pause()
+        self.notify_woken_auditors(audit)
+        self.persist(audit)
+        self.send_message(
+            mto=audit.admin_jid,
+            mbody=f"All inspections for project {audit.name} assigned.",
+            mtype="chat",
+        )
+
+    def started(self, audit: Audit, task):
+        # Done callback of a start_audit task. A start that failed is rolled
+        # back, so it is not retried on every restart and can be fixed and
+        # started again.
+        self._starting.discard(task)
+        if task.cancelled() or task.exception() is None:
+            return
+        error = task.exception()
+        logging.error("Starting audit failed", exc_info=error)
+        if self.audits.get(audit.name) is not audit:
+            return
+        for auditor in audit.auditors.values():
+            if auditor.current_inspection is not None:
+                self.deadlines.cancel((audit.name, auditor.current_inspection))
+        audit.abort_start()
+        self.persist(audit)
+        self.send_message(
+            mto=audit.admin_jid,
+            mbody=f"Audit for project {audit.name} could not be started: {error!r}",
+            mtype="chat",
+        )
+
+    def arm_deadline(self, audit: Audit, auditor: Auditor):
+        # Start the clock on the inspection an auditor has just been told of
+        if audit.inspection_timeout > 0 and auditor.current_inspection is not None:
+            self.deadlines.add(
+                (audit.name, auditor.current_inspection), audit.inspection_timeout
+            )
+
+    def audit_loaded(self, audit: Audit):
+        # An audit read from the store, its deadlines were lost with the
+        # process that saved it and count from now
+        if audit.state == State.AUDITING:
+            self.arm_deadlines(audit)
+
+    def arm_deadlines(self, audit: Audit):
+        # After the timeout changes, restart the clock on every current
+        # inspection with it, or stop them all for 0
+        for auditor in audit.auditors.values():
+            if auditor.current_inspection is None:
+                continue
+            if audit.inspection_timeout > 0:
+                self.arm_deadline(audit, auditor)
+            else:
+                self.deadlines.cancel((audit.name, auditor.current_inspection))
+
+    def inspection_expired(self, key):
+        # Called by the deadline wheel for an inspection not answered in time
+        name, inspection_id = key
+        audit = self.audits.get(name)
+        if audit is None or audit.state != State.AUDITING:
+            return
+        expired = audit.expire_inspection(inspection_id)
+        if expired is None:
+            # Nobody else can take it, so the auditor keeps it for now
+            completed = audit.get_inspection(inspection_id).completed
+            if not completed and audit.inspection_timeout > 0:
+                self.deadlines.add(key, audit.inspection_timeout)
+            return
+
+        original, assigned = expired
+        self.send_message(
+            mto=original.jid, mbody=audit.messages["inspection_timeout"], mtype="chat"
+        )
+        if original.current_inspection is None:
+            reply = Reply(self.send_message, original.jid, "chat")
+            self.next_inspection(audit, original, reply)
+            reply.flush()
+        for auditor in assigned:
+            self.notify_auditor_of_current_inspection(audit, auditor)
+        self.notify_woken_auditors(audit)
+        self.persist(audit)
+
+    def clear_audits(self):
+        self.deadlines.clear()
+        Audits.clear_audits(self)
+
+    def notify_woken_auditors(self, audit: Audit):
+        # Parked auditors of a DYNAMIC audit that got a slot or are done
+        woken, released = audit.wake_parked()
+        for auditor in woken:
+            self.notify_auditor_of_current_inspection(audit, auditor)
+        for auditor in released:
+            self.send_message(
+                mto=auditor.jid, mbody=audit.messages["auditor_complete"], mtype="chat"
+            )
+
+    def admin_command(self, audit, msg, reply):
         body = msg["body"].strip()
         command = body.split()[0]
         try:
@@ -141,74 +478,143 @@ class RWABot(slixmpp.ClientXMPP, Audits):
                 # Check if in correct state
                 if audit.state == State.INITIALIZATION:
                     audit.calculate_inspection_reward()
-                    msg.reply(
-                        f"Project {audit.name} opened for auditors to register"
-                    ).send()
-                    msg.reply(
-                        f"Reward per inspection set at: {audit.inspection_reward}"
-                    ).send()
-                    msg.reply(f"Slashing ratio set at: {audit.slashing_ratio}").send()
+                    reply(f"Project {audit.name} opened for auditors to register")
+                    reply(f"Reward per inspection set at: {audit.inspection_reward}")
+                    reply(f"Slashing ratio set at: {audit.slashing_ratio}")
 
                     # Set state for next phase
                     audit.state = State.AUDITOR_REGISTRATION
                 else:
-                    msg.reply(
+                    reply(
                         "Command can only be used when audit is in INITIALIZATION state"
-                    ).send()
+                    )
 
             # Closes registration window
             case "close":
                 if audit.state == State.AUDITOR_REGISTRATION:
                     audit.state = State.AUDITOR_REGISTRATION_COMPLETE
-                    msg.reply(f"Project {audit.name} closed for registration.").send()
+                    reply(f"Project {audit.name} closed for registration.")
                     self.notify_auditors(audit, audit.messages["registration_closed"])
                 else:
-                    msg.reply(
+                    reply(
                         "Command can only be used when audit is in AUDITOR_REGISTRATION state"
-                    ).send()
+                    )
 
             # Start audit
             case "start":
-                if audit.state == State.AUDITOR_REGISTRATION_COMPLETE:
+                if (
+                    audit.state == State.AUDITOR_REGISTRATION_COMPLETE
+                    and not audit.auditors
+                ):
+                    reply(f"No auditors registered for project {audit.name}.")
+                elif (
+                    audit.state == State.AUDITOR_REGISTRATION_COMPLETE
+                    and audit.auditors_needed()
+                ):
+                    reply(
+                        f"A dynamic audit needs at least {audit.number_of_audits_per_item}"
+                        f" auditors, {len(audit.auditors)} registered."
+                        " Use 'mode static' to start it with these auditors."
+                    )
+                elif audit.state == State.AUDITOR_REGISTRATION_COMPLETE:
                     audit.state = State.AUDITING
-                    audit.assign_auditors_to_items()
-                    msg.reply(f"Audit for project {audit.name} started.").send()
-                    self.notify_auditors(audit, audit.messages["start_message"])
-                    audit.assign_all_current_inspection()
-                    self.notify_all_auditors_of_current_inspection(audit)
+                    audit.assignment_pending = True
+                    reply(f"Audit for project {audit.name} started.")
+                    # Inspections are built and handed out without blocking
+                    # the loop, see start_audit
+                    self.begin_start(audit)
                 else:
-                    msg.reply(
+                    reply(
                         "Command can only be used when audit is in AUDITOR_REGISTRATION_COMPLETE state"
-                    ).send()
+                    )
 
             # Stop Audit
             case "stop":
                 if audit.state == State.AUDITING:
 
-                    if audit.check_if_audit_complete():
-                        audit.state = State.AUDITING_FINISHED
-                        msg.reply(f"Audit for project {audit.name} stopped.").send()
-                        self.notify_auditors(audit, audit.messages["auditing_stopped"])
+                    if audit.assignment_pending:
+                        reply("Inspections are still being assigned, try again shortly")
 
-                        audit.calculate_item_results()
-                        audit.calculate_audit_results()
-                        audit.calculate_auditor_results()
-                        audit.calculate_auditor_compensation()
+                    elif audit.check_if_audit_complete():
+                        try:
+                            audit.calculate_results()
+                        except SettlementError as error:
+                            reply(f"Audit for project {audit.name} not stopped.")
+                            reply(f"The payout cannot be settled: {error}")
+                            return
+
+                        reply(f"Audit for project {audit.name} stopped.")
+                        self.notify_auditors(audit, audit.messages["auditing_stopped"])
+                        self.settlement_ready(audit)
 
                         self.notify_all_auditors_of_compensation(audit)
 
                     else:
-                        msg.reply(self.messages["audit_not_complete"]).send()
-                        msg.reply(audit.get_outstanding_audits_for_print()).send()
+                        reply(self.messages["audit_not_complete"])
+                        reply(f"{audit.outstanding_count()} inspections outstanding")
+                        reply(audit.outstanding_page_for_print())
 
                 else:
-                    msg.reply(
-                        "Command can only be used when audit is in AUDITING state"
-                    ).send()
+                    reply("Command can only be used when audit is in AUDITING state")
 
             case "state":
                 # Report audit state
-                msg.reply(f"Audit State: {audit.state}").send()
+                reply(f"Audit State: {audit.state}")
+
+            # Profile the whole bot for a while, see profiling.py
+            case "profile":
+                if variable == "stop":
+                    path = self.profiler.stop()
+                    reply(f"Profile written to {path}" if path else "Not profiling")
+                else:
+                    try:
+                        seconds = float(value) if value else DEFAULT_PROFILE_SECONDS
+                    except ValueError:
+                        seconds = -1
+                    admin_jid = msg["from"].bare
+                    started = self.start_profile(
+                        variable or "sampling",
+                        seconds,
+                        lambda path: self.send_message(
+                            mto=admin_jid,
+                            mbody=f"Profile written to {path}",
+                            mtype="chat",
+                        ),
+                    )
+                    if "error" in started:
+                        reply(started["error"])
+                        reply(
+                            "Usage: profile [sampling|deterministic] [seconds] | profile stop"
+                        )
+                    else:
+                        reply(
+                            f"Profiling ({started['mode']}) for {started['seconds']} seconds"
+                        )
+
+            # Choose how inspections are assigned, before the audit starts
+            case "mode" if variable is not None:
+                if audit.state not in self.state_group["pre_waiting_states"]:
+                    reply("Command can only be used before the audit starts")
+                elif variable.upper() not in AssignmentMode.__members__:
+                    reply("Usage: mode static|dynamic")
+                else:
+                    audit.assignment = AssignmentMode[variable.upper()]
+                    reply(f"Assignment mode set to: {audit.assignment.name.lower()}")
+
+            # Seconds an auditor has to answer before the inspection is
+            # given to someone else, 0 to wait forever
+            case "timeout" if variable is not None:
+                try:
+                    seconds = float(variable)
+                except ValueError:
+                    seconds = -1
+                if not seconds >= 0:
+                    reply("Usage: timeout <seconds>")
+                else:
+                    audit.inspection_timeout = seconds
+                    if audit.state == State.AUDITING:
+                        self.arm_deadlines(audit)
+                    reply(f"Inspection timeout set to: {seconds} seconds")
 
             # Add a single item to the Audit. Can only be done before audit begins
             case "add":
@@ -216,11 +622,11 @@ class RWABot(slixmpp.ClientXMPP, Audits):
                     State.INITIALIZATION,
                 ]:
                     audit.add_item(payload)
-                    msg.reply(f"Item added. Item count: {len(audit.items)}").send()
+                    reply(f"Item added. Item count: {len(audit.items)}")
                 else:
-                    msg.reply(
+                    reply(
                         "Command can only be used when audit is in INITIALIZATION state"
-                    ).send()
+                    )
 
             # Delete an item from the audit
             case "del":
@@ -230,83 +636,99 @@ class RWABot(slixmpp.ClientXMPP, Audits):
                     State.AUDITOR_REGISTRATION_COMPLETE,
                 ]:
                     variable = int(variable)
-                    msg.reply(f"Item # {variable} : {audit.items[variable]}").send()
+                    reply(f"Item # {variable} : {audit.items[variable]}")
                     audit.delete_item(variable)
-                    msg.reply(f"Item deleted. Item count: {len(audit.items)}").send()
+                    reply(f"Item deleted. Item count: {len(audit.items)}")
                 else:
-                    msg.reply(
+                    reply(
                         "Command can only be used when audit is in INITIALIZATION state"
-                    ).send()
+                    )
 
-            # List items in audit
+            # List items in audit, a page at a time
             case "items":
-                msg.reply(audit.list_items_for_print()).send()
+                page = parse_page_args(body.split()[1:])
+                if page is None:
+                    reply("Usage: items [cursor] [limit]")
+                else:
+                    cursor, limit, _, _ = page
+                    reply(audit.items_page_for_print(cursor, limit))
 
-            # Show insepctions that are outstanding still
+            # Show insepctions that are outstanding still, a page at a time
             case "outstanding_inspections":
-                msg.reply(audit.get_outstanding_audits_for_print()).send()
+                page = parse_page_args(body.split()[1:])
+                if page is None:
+                    reply(
+                        "Usage: outstanding_inspections [cursor] [limit] [auditor=<jid>] [item=<number>]"
+                    )
+                else:
+                    reply(audit.outstanding_page_for_print(*page))
 
             # Set a variable
             # TODO Decide whether to keep this guy - possibly hidden command
             # Not sure if this should stay, possible individual commands might be better
             case "set" if variable is not None:
-                msg.reply(
-                    f"Initial value of {variable}: {getattr(audit, variable)}"
-                ).send()
+                reply(f"Initial value of {variable}: {getattr(audit, variable)}")
                 setattr(audit, variable, value)
-                msg.reply(
-                    f"Value of {variable} set to: {getattr(audit, variable)}"
-                ).send()
+                reply(f"Value of {variable} set to: {getattr(audit, variable)}")
 
             # Get the value of a variable
             case "get" if variable is not None:
-                msg.reply(str(getattr(audit, variable))).send()
+                reply(str(getattr(audit, variable)))
 
             # Show all public variables in audit object, with their current values
             case "list":
                 for item in vars(audit):
-                    msg.reply(f"{item} : {getattr(audit, item)}").send()
+                    reply(f"{item} : {getattr(audit, item)}")
 
             # Display if no matches found
             case other:
-                msg.reply(
+                reply(
                     f"\nYou are the admin for project\n {audit.name}\n======================="
-                ).send()
-                msg.reply("Command not found, or incorrect amount of arguments.").send()
-                msg.reply("\nMain commands are:\n=======================").send()
-                msg.reply("open : Allows auditors to register").send()
-                msg.reply("close : Closes registration").send()
-                msg.reply("start : Start the audit").send()
-                msg.reply("stop : Stop the audit").send()
-                msg.reply("state : Returns the current state of the audit").send()
-                msg.reply("add <description> : Adds an item to the audit").send()
-                msg.reply("items : Returns the items in the audit").send()
-                msg.reply(
+                )
+                reply("Command not found, or incorrect amount of arguments.")
+                reply("\nMain commands are:\n=======================")
+                reply("open : Allows auditors to register")
+                reply("close : Closes registration")
+                reply("start : Start the audit")
+                reply("stop : Stop the audit")
+                reply("state : Returns the current state of the audit")
+                reply(
+                    "profile [sampling|deterministic] [seconds] : Profile the bot for a while, `profile stop` ends it early"
+                )
+                reply(
+                    "mode static|dynamic : Assign all inspections at start, or hand them out as auditors become free"
+                )
+                reply(
+                    "timeout <seconds> : Reassign inspections not answered within this time, 0 for never"
+                )
+                reply("add <description> : Adds an item to the audit")
+                reply("items [cursor] [limit] : Returns the items in the audit")
+                reply(
                     "del <number> : Deletess item from the audit. <number> is obtained from `item list`"
-                ).send()
-                msg.reply(
+                )
+                reply(
                     "set num_items <value> : Sets the number of items that need to be audited"
-                ).send()
-                msg.reply(
+                )
+                reply(
                     "set num_audits_per_item <value> : Sets the number audits per item (needs to be an odd number)"
-                ).send()
-                msg.reply(
-                    "outstanding_inspections : Returns the outstanding audits"
-                ).send()
+                )
+                reply(
+                    "outstanding_inspections [cursor] [limit] [auditor=<jid>] [item=<number>] : Returns the outstanding audits"
+                )
 
-                msg.reply("\nAvailable commands are:\n=======================").send()
-                msg.reply(
+                reply("\nAvailable commands are:\n=======================")
+                reply(
                     "set slashing_ratio <value> : Sets the severity of the slash an auditor will receive for every incorrect observation"
-                ).send()
-                msg.reply("get <var>").send()
-                msg.reply("list").send()
+                )
+                reply("get <var>")
+                reply("list")
 
         return
 
-    def auditor_command(self, audit: Audit, auditor: Auditor, msg):
+    def auditor_command(self, audit: Audit, auditor: Auditor, msg, reply):
 
         if audit.auditor_done(auditor):
-            msg.reply(audit.messages["auditor_complete"]).send()
+            reply(audit.messages["auditor_complete"])
             return
 
         body = msg["body"].strip().lower()
@@ -314,31 +736,24 @@ class RWABot(slixmpp.ClientXMPP, Audits):
         answer_true = {"yes", "true", "1", "y", "t"}
         answer_false = {"no", "false", "0", "n", "f"}
 
-        if body in answer_true:
-            audit.inspections[auditor.current_inspection].finding = True
-            audit.inspections[auditor.current_inspection].completed = True
-            if audit.assign_current_inspection(auditor):
-                self.notify_auditor_of_current_inspection(audit, auditor)
-            else:
-                msg.reply(audit.messages["auditor_complete"]).send()
+        if auditor.current_inspection is None:
+            # Parked, or nothing handed out yet, in a DYNAMIC audit
+            self.next_inspection(audit, auditor, reply)
 
-        elif body in answer_false:
-            audit.inspections[auditor.current_inspection].finding = False
-            audit.inspections[auditor.current_inspection].completed = True
-            if audit.assign_current_inspection(auditor):
-                self.notify_auditor_of_current_inspection(audit, auditor)
-            else:
-                msg.reply(audit.messages["auditor_complete"]).send()
+        elif body in answer_true or body in answer_false:
+            self.deadlines.cancel((audit.name, auditor.current_inspection))
+            audit.set_audit_by_audit(auditor.current_inspection, body in answer_true)
+            self.next_inspection(audit, auditor, reply)
 
         else:
-            msg.reply("Answer not recognised.").send()
-            msg.reply("Accepted replies for True are:").send()
-            msg.reply(str(answer_true)).send()
-            msg.reply("Accepted replies for False are:").send()
-            msg.reply(str(answer_false)).send()
-            msg.reply("Answers are case-insensitive").send()
+            reply("Answer not recognised.")
+            reply("Accepted replies for True are:")
+            reply(str(answer_true))
+            reply("Accepted replies for False are:")
+            reply(str(answer_false))
+            reply("Answers are case-insensitive")
 
-            self.notify_auditor_of_current_inspection(audit, auditor)
+            reply(self.current_inspection_message(audit, auditor))
 
     def message(self, msg):
         """
@@ -348,93 +763,122 @@ class RWABot(slixmpp.ClientXMPP, Audits):
                    how it may be used.
         """
         if msg["type"] in ("chat", "normal"):
-            # Get relevant info from message
-            jid = msg["from"].bare
-            body = msg["body"].strip()
-
-            # Check if client is admin -> present admin commands
-            audit = self.jid_in_admin(jid)
-            if audit is not None:
-                self.admin_command(audit, msg)
-                return
-
-            # Check if client is registered with an audit
-            (audit, auditor, state) = self.jid_in_audit(jid)
-            if auditor is None:
-                state = AuditorState.REQUESTING_PROJECT
-                auditor = Auditor(**{"jid": jid})
-
-            match state:
-                # New user, get the project they interested in
-                case AuditorState.REQUESTING_PROJECT:
-                    if body in self.audits:
-                        if self.audits[body].state == State.AUDITOR_REGISTRATION:
-                            # Assign audit to auditor
-                            auditor.audit = msg["body"]
-                            # Add auditor to audit's auditor list
-                            self.audits[msg["body"]].auditors[jid] = auditor
-                            # Update state
-                            auditor.state = AuditorState.REQUESTING_CRYPTO_ADDR
-                            # Add auditor to audit
-                            self.audits[auditor.audit].auditors[jid] = auditor
-                            # Update user via xmpp
-                            msg.reply(self.messages["project_registered"]).send()
-                            msg.reply(auditor.audit).send()
-                            msg.reply(
-                                f"The per-inspection reward for this project is:\n{self.audits[body].inspection_reward}"
-                            ).send()
-                            msg.reply(
-                                f"The slashing ratio for this project is:\n{self.audits[body].slashing_ratio}"
-                            ).send()
-
-                            msg.reply(self.messages["addr_request"]).send()
-                        else:
-                            if self.audits[body].state == State.INITIALIZATION:
-                                # Project still being initialized, try again later
-                                msg.reply(
-                                    self.audits[body].messages["project_not_open_yet"]
-                                ).send()
-                                msg.reply(self.messages["project_welcome"]).send()
-                            else:
-                                # Audit is not accepting new auditors
-                                msg.reply(self.messages["project_closed"]).send()
-                                msg.reply(self.messages["project_welcome"]).send()
+            started = time.perf_counter()
+            # Everything replied while handling this message goes out together
+            reply = Reply(self.send_message, msg["from"].bare, msg["type"])
+            handler = "failed"
+            try:
+                if self.profiler.active:
+                    handler = self.profiler.call(self.handle_message, msg, reply)
+                else:
+                    handler = self.handle_message(msg, reply)
+            finally:
+                reply.flush()
+                self.stanzas.inc(handler)
+                self.handler_seconds.observe(time.perf_counter() - started, handler)
+
+    def handle_message(self, msg, reply):
+        # Returns the name of the handler used, for metrics
+        # Get relevant info from message
+        jid = msg["from"].bare
+        body = msg["body"].strip()
 
-                    else:
-                        # Audit name not valid, retry
-                        msg.reply(self.messages["project_not_found"]).send()
-                        msg.reply(self.messages["project_welcome"]).send()
-
-                # Get user's crypto address
-                case AuditorState.REQUESTING_CRYPTO_ADDR:
-                    # Check if Ethereum address is valid
-                    if Web3.isChecksumAddress(body):
-                        auditor.addr = body
-                        msg.reply(self.messages["addr_accepted"]).send()
-                        msg.reply(audit.messages["welcome_message"]).send()
+        # Check if client is admin -> present admin commands
+        audit = self.jid_in_admin(jid)
+        if audit is not None:
+            self.admin_command(audit, msg, reply)
+            self.persist(audit)
+            return "admin_command"
+
+        # Check if client is registered with an audit
+        (audit, auditor, state) = self.jid_in_audit(jid)
+        if auditor is None:
+            state = AuditorState.REQUESTING_PROJECT
+            auditor = Auditor(**{"jid": jid})
+
+        match state:
+            # New user, get the project they interested in
+            case AuditorState.REQUESTING_PROJECT:
+                if body in self.audits:
+                    if self.audits[body].state == State.AUDITOR_REGISTRATION:
+                        # Assign audit to auditor
+                        auditor.audit = body
                         # Update state
-                        auditor.state = AuditorState.READY
+                        auditor.state = AuditorState.REQUESTING_CRYPTO_ADDR
+                        # Add auditor to audit and to the routing index
+                        self.register_auditor(self.audits[body], auditor)
+                        self.persist(self.audits[body], auditor)
+                        # Update user via xmpp
+                        reply(self.messages["project_registered"])
+                        reply(auditor.audit)
+                        reply(
+                            f"The per-inspection reward for this project is:\n{self.audits[body].inspection_reward}"
+                        )
+                        reply(
+                            f"The slashing ratio for this project is:\n{self.audits[body].slashing_ratio}"
+                        )
+
+                        reply(self.messages["addr_request"])
                     else:
-                        # Invalid ethereum address
-                        msg.reply(self.messages["addr_invalid"]).send()
-                        msg.reply(self.messages["addr_request"]).send()
-
-                # Message from registered user
-                case AuditorState.READY:
-                    if audit.state in self.state_group["pre_waiting_states"]:
-                        msg.reply(audit.messages["waiting_for_start"]).send()
-                    elif audit.state in self.state_group["active_states"]:
-                        self.auditor_command(audit, auditor, msg)
-                    elif audit.state in self.state_group["post_waiting_states"]:
-                        msg.reply(audit.messages["waiting_for_calculations"]).send()
-                    elif audit.state in self.state_group["post_states"]:
-                        self.notify_auditor_of_compensation(audit, auditor)
+                        if self.audits[body].state == State.INITIALIZATION:
+                            # Project still being initialized, try again later
+                            reply(self.audits[body].messages["project_not_open_yet"])
+                            reply(self.messages["project_welcome"])
+                        else:
+                            # Audit is not accepting new auditors
+                            reply(self.messages["project_closed"])
+                            reply(self.messages["project_welcome"])
 
-                # self.auditor_command(audit, auditor, msg)
+                else:
+                    # Audit name not valid, retry
+                    reply(self.messages["project_not_found"])
+                    reply(self.messages["project_welcome"])
+
+            # Get user's crypto address
+            case AuditorState.REQUESTING_CRYPTO_ADDR:
+                # Check if Ethereum address is valid
+                if Web3.isChecksumAddress(body):
+                    auditor.addr = body
+                    reply(self.messages["addr_accepted"])
+                    reply(audit.messages["welcome_message"])
+                    # Update state
+                    auditor.state = AuditorState.READY
+                    self.persist(audit, auditor)
+                else:
+                    # Invalid ethereum address
+                    reply(self.messages["addr_invalid"])
+                    reply(self.messages["addr_request"])
+
+            # Message from registered user
+            case AuditorState.READY:
+                if audit.state in self.state_group["pre_waiting_states"]:
+                    reply(audit.messages["waiting_for_start"])
+                elif audit.state in self.state_group["active_states"]:
+                    self.auditor_command(audit, auditor, msg, reply)
+                    self.persist(audit)
+                elif audit.state in self.state_group["post_waiting_states"]:
+                    reply(audit.messages["waiting_for_calculations"])
+                elif audit.state in self.state_group["post_states"]:
+                    self.notify_auditor_of_compensation(audit, auditor)
+
+            # self.auditor_command(audit, auditor, msg)
+
+            # Nothing matched - probably a bug
+            case other:
+                log_event(
+                    "unhandled_state",
+                    "Somthing went wrong",
+                    logging.WARNING,
+                    jid=jid,
+                    state=state,
+                )
+                return "unknown"
 
-                # Nothing matched - probably a bug
-                case other:
-                    print("Somthing went wrong")
+        if state == AuditorState.READY:
+            if audit.state in self.state_group["active_states"]:
+                return "auditor_command"
+            return "ready"
+        return state.name.lower()
 
 
 if __name__ == "__main__":
@@ -471,7 +915,7 @@ if __name__ == "__main__":
     args.password = "botty"
 
     # Setup logging.
-    logging.basicConfig(level=args.loglevel, format="%(levelname)-8s %(message)s")
+    log_listener = setup_logging(args.loglevel)
 
     if args.jid is None:
         args.jid = input("Username: ")
@@ -484,3 +928,4 @@ if __name__ == "__main__":
     # Connect to the XMPP server and start processing XMPP stanzas.
     xmpp.connect()
     xmpp.process()
+    log_listener.stop()